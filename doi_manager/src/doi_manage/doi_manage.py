@@ -13,6 +13,7 @@ from lxml import etree as ElementTree
 from libpkg.dbutils import uncompress_bitmap_values
 from libpkg.metautils import export_to_datacite_4
 from libpkg.unixutils import make_tempdir, remove_tempdir, sendmail
+from libpkg.xmlutils import get_xml_schema
 
 
 DEBUG = False
@@ -266,7 +267,7 @@ def update_doi(config, **kwargs):
         # validate the DataCite XML before sending it
         root = ElementTree.fromstring(dc).find(".")
         schema_parts = root.get("{http://www.w3.org/2001/XMLSchema-instance}schemaLocation").split()
-        xml_schema = ElementTree.XMLSchema(ElementTree.parse(schema_parts[-1]))
+        xml_schema = get_xml_schema(schema_parts[-1])
         xml_schema.assertValid(root)
         dcfile = os.path.join(tdir, dsid + ".dc4")
         with open(dcfile, "w") as f:
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import psycopg2
@@ -5,15 +6,26 @@ import shutil
 import socket
 import subprocess
 import sys
-import time
 
-from libpkg.metaformats import iso_19139
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from libpkg.dbutils import create_connection_pool
+from libpkg.metaformats import create_validation_pool, export_batch
+from libpkg.metautils import metadata_date
 from libpkg.strutils import strand
-from lxml import etree
+from libpkg.xmlutils import set_xml_catalog
 
 
 LOCAL_WAF = "/data/dset_waf"
 REPO_HEAD = os.path.join(LOCAL_WAF, "git-repos")
+# the SHA-256 hash and the metadata date of each record as last pushed
+MANIFEST = os.path.join(LOCAL_WAF, "manifest.json")
+# the number of datasets that are pushed and checkpointed together
+CHUNK_SIZE = 45
+# the XSD that each format's records are validated against
+SCHEMAS = {
+    'iso_19139': os.path.join(LOCAL_WAF, "schemas/iso/iso19139.xsd"),
+}
 
 GIT_REPOS = [
     "dset-web-accessible-folder-dev/rda",
@@ -21,6 +33,208 @@ GIT_REPOS = [
 ]
 
 
+def read_manifest():
+    try:
+        with open(MANIFEST, "r") as f:
+            return json.load(f)
+
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(manifest):
+    tmp_name = MANIFEST + ".tmp"
+    with open(tmp_name, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    os.replace(tmp_name, MANIFEST)
+
+
+def record_hash(rec):
+    return hashlib.sha256(rec.encode("utf-8")).hexdigest()
+
+
+def run_git(repo_path, *args):
+    return subprocess.run(["git", "-C", repo_path] + list(args),
+                          capture_output=True)
+
+
+def sync_repo(repo, push_list, uflag):
+    """
+    Brings the git repo 'repo' up to date with its remote, copies the WAF
+    records of the datasets in 'push_list' into it, and commits and pushes
+    them. The records are staged with a single 'git add'. Raises a
+    RuntimeError if a git command fails.
+    """
+    repo_path = os.path.join(REPO_HEAD, repo)
+    print("REPO_PATH = " + str(repo_path))
+    o = run_git(repo_path, "stash")
+    if o.returncode != 0:
+        raise RuntimeError(("git stash error: '{}'; uflag was '{}'")
+                           .format(o.stderr.decode("utf-8"), uflag))
+
+    o = run_git(repo_path, "pull", "-q")
+    err = o.stderr.decode("utf-8")
+    if len(err) > 0:
+        if o.returncode == 0:
+            print(("git pull message: '{}'; uflag was '{}'")
+                  .format(err, uflag))
+        else:
+            raise RuntimeError(("git pull error: '{}'; uflag was '{}'")
+                               .format(err, uflag))
+
+    print(o.stdout.decode("utf-8"))
+    for dsid in push_list:
+        shutil.copyfile(
+                os.path.join(LOCAL_WAF, "waf-" + dsid + ".xml"),
+                os.path.join(repo_path, dsid + ".xml"))
+
+    o = run_git(repo_path, "add", "--",
+                *[dsid + ".xml" for dsid in push_list])
+    err = o.stderr.decode("utf-8")
+    if len(err) > 0:
+        raise RuntimeError(("git add error for {}: '{}'; uflag was '{}'")
+                           .format(push_list, err, uflag))
+
+    print("COPIED")
+    o = run_git(repo_path, "commit", "-m", "auto update", "-a")
+    err = o.stderr.decode("utf-8")
+    if len(err) > 0 and err.find("Auto packing") < 0:
+        raise RuntimeError(("git commit error: '{}'; uflag was '{}'")
+                           .format(err, uflag))
+
+    o = run_git(repo_path, "push", "-q")
+    err = o.stderr.decode("utf-8")
+    if len(err) > 0 and err.find("remote: Resolving deltas") != 0:
+        raise RuntimeError(("git push error: '{}'; uflag was '{}'")
+                           .format(err, uflag))
+
+    run_git(repo_path, "stash", "clear")
+
+
+def push_chunk(chunk, mdb_pool, wdb_pool, validation_pool, mcursor,
+               manifest, mdates, queued):
+    """
+    Exports the ISO records of the datasets in 'chunk', validates them in
+    'validation_pool', and commits and pushes the changed ones to each git
+    repo. Then the chunk is checkpointed: its manifest entries are written
+    and, if 'queued', its datasets are removed from the queue. Returns the
+    number of records that were pushed.
+    """
+    uflag = ""
+    if queued:
+        # the chunk's queue entries are marked with their own flag, so that
+        #   only this chunk is left in the queue if the push fails
+        uflag = strand(10)
+        # a dataset from a failed chunk that was queued again has a flagged
+        #   and an unflagged entry; (dsid, uflag) is unique, so only one
+        #   entry per dataset is kept and flagged
+        mcursor.execute((
+                "delete from metautil.dset_waf2 as w using metautil.dset_waf2 "
+                "as o where w.dsid in %s and o.dsid = w.dsid and o.uflag < w."
+                "uflag"), (tuple(chunk), ))
+        mcursor.execute((
+                "update metautil.dset_waf2 as w set uflag = %s where w.dsid "
+                "in %s and not exists (select 1 from metautil.dset_waf2 as o "
+                "where o.dsid = w.dsid and o.uflag < w.uflag) returning "
+                "dsid"), (uflag, tuple(chunk)))
+        print("QUEUED-ONLY! " + uflag + " " + str(mcursor.fetchall()))
+
+    failed_validation_set = set()
+
+    def print_progress(done, total, dsid, err):
+        if err is not None:
+            print("Warning: {} failed to validate: '{}'".format(dsid, err))
+
+        if done % 100 == 0 or done == total:
+            print("exported {} of {} datasets".format(done, total))
+
+    # a record that is byte-identical to the one last pushed is not
+    #   validated, copied or committed again
+    unchanged_set = set()
+
+    def is_changed(dsid, docs):
+        if (dsid in manifest and manifest[dsid]['sha256'] ==
+                record_hash(docs['iso_19139']) and
+                os.path.exists(os.path.join(LOCAL_WAF,
+                                            "waf-" + dsid + ".xml"))):
+            unchanged_set.add(dsid)
+            return False
+
+        return True
+
+    # export and validate the ISO records
+    recs, errors = export_batch(
+            chunk, mdb_pool, wdb_pool, formats=["iso_19139"],
+            schemas=SCHEMAS, validation_pool=validation_pool,
+            progress=print_progress, changed=is_changed)
+    failed_validation_set.update(errors)
+    print("UNCHANGED: " + str(len(unchanged_set)) + " datasets")
+    for dsid, rec in recs.items():
+        try:
+            waf_name = os.path.join(LOCAL_WAF, "waf-" + dsid + ".xml")
+            with open(waf_name, "w") as f:
+                f.write(rec['iso_19139'])
+
+        except Exception as err:
+            print("Warning: {} failed to validate: '{}'".format(dsid, err))
+            failed_validation_set.add(dsid)
+
+    print("FAILED VALIDATION: " + str(failed_validation_set))
+    pushed_list = [e for e in chunk if e not in failed_validation_set]
+    push_list = [e for e in pushed_list if e not in unchanged_set]
+    if queued:
+        for dsid in failed_validation_set:
+            try:
+                print(f"RESETING FLAG {dsid}")
+                # if the dataset was queued again during the push, its
+                #   flagged entry is dropped instead of colliding with the
+                #   new one
+                mcursor.execute((
+                        "update metautil.dset_waf2 as w set uflag = '' where "
+                        "w.dsid = %s and w.uflag = %s and not exists (select "
+                        "1 from metautil.dset_waf2 as o where o.dsid = w.dsid "
+                        "and o.uflag = '')"), (dsid, uflag))
+                print(mcursor.query)
+                mcursor.execute((
+                        "delete from metautil.dset_waf2 where dsid = %s and "
+                        "uflag = %s"), (dsid, uflag))
+            except Exception as err:
+                print((
+                        "Warning: unable to reset uflag for '{}': error: "
+                        "'{}'").format(dsid, err))
+
+    # the repos are independent, so they are updated at the same time
+    if len(push_list) > 0:
+        with ThreadPoolExecutor(len(GIT_REPOS)) as executor:
+            futures = [executor.submit(sync_repo, repo, push_list, uflag) for
+                       repo in GIT_REPOS]
+            errors = [future.exception() for future in futures if
+                      future.exception() is not None]
+
+        if len(errors) > 0:
+            for err in errors:
+                print(err)
+
+            sys.exit(1)
+
+    for dsid in pushed_list:
+        if dsid in recs:
+            manifest[dsid] = {
+                    'sha256': record_hash(recs[dsid]['iso_19139'])}
+
+        manifest[dsid]['metadata_date'] = mdates[dsid]
+
+    # checkpoint the chunk
+    write_manifest(manifest)
+    if len(uflag) > 0:
+        print("DELETING " + uflag)
+        mcursor.execute("delete from metautil.dset_waf2 where uflag = %s",
+                        (uflag, ))
+
+    return len(push_list)
+
+
 def do_push(args):
     if len(args) < 3:
         print("Error: missing argument(s) for PUSH")
@@ -43,6 +257,7 @@ def do_push(args):
     elif args[0][0] == 'd':
         push_list.append(args[0])
 
+    pools = []
     try:
         mconn = psycopg2.connect(**mdb_config)
         mconn.autocommit = True
@@ -50,15 +265,25 @@ def do_push(args):
         print("Connect to DB: push_list=" + str(push_list))
         if len(push_list) == 0:
             print("EMPTY push_list, querying DB")
-            if args[0] == "all":
+            if args[0] in ("all", "changed"):
                 mcursor.execute((
                         "select dsid from search.datasets where type in "
                         "('P', 'H') and dsid < 'd999000'"))
             elif args[0] == "queued-only":
+                # entries for datasets that aren't public are never pushed,
+                #   so they are removed from the queue now
                 mcursor.execute((
-                        "select w.dsid from metautil.dset_waf2 as w left join "
-                        "search.datasets as d on d.dsid = w.dsid where d.type "
-                        "in ('P', 'H') and w.uflag = ''"))
+                        "delete from metautil.dset_waf2 as w where not exists "
+                        "(select 1 from search.datasets as d where d.dsid = "
+                        "w.dsid and d.type in ('P', 'H'))"))
+                print("REMOVED {} non-public queue entries".format(
+                      mcursor.rowcount))
+                # entries that are still flagged are from a chunk of a failed
+                #   push, so they are picked up again
+                mcursor.execute((
+                        "select distinct w.dsid from metautil.dset_waf2 as w "
+                        "left join search.datasets as d on d.dsid = w.dsid "
+                        "where d.type in ('P', 'H')"))
             else:
                 print("Error: invalid DSID_LIST")
                 sys.exit(1)
@@ -72,160 +297,58 @@ def do_push(args):
             print("No matching datasets found.")
             sys.exit(1)
 
-        if len(push_list) > 45:
-            print("Too many datasets? " + str(push_list))
-            sys.exit(1)
-
-        uflag = ""
-        if args[0] == "queued-only":
-            uflag = strand(10)
-            print("QUEUED-ONLY! " + uflag)
-            mcursor.execute("update metautil.dset_waf2 set uflag = %s",
-                            (uflag, ))
-            mcursor.execute("select dsid, uflag from metautil.dset_waf2 where uflag = %s", (uflag, ))
-            print(mcursor.query)
-            res = mcursor.fetchall()
-            print(str(res))
-
-        mconn.close()
-        xml_schema = etree.XMLSchema(
-                etree.parse("/data/dset_waf/schemas/iso/iso19139.xsd"))
-        failed_validation_set = set()
+        # the metadata dates are read before the records are exported, so
+        #   that a change during the push is picked up by the next one
+        manifest = read_manifest()
+        mdates = {}
         for dsid in push_list:
-            try:
-                iso_rec = iso_19139.export(dsid, mdb_config, wdb_config)
-                # validate the ISO record
-                root = etree.fromstring(iso_rec).find(".")
-                xml_schema.assertValid(root)
-                waf_name = os.path.join(LOCAL_WAF, "waf-" + dsid + ".xml")
-                with open(waf_name, "w") as f:
-                    f.write(iso_rec)
-
-            except Exception as err:
-                print("Warning: {} failed to validate: '{}'".format(dsid, err))
-                failed_validation_set.add(dsid)
-
-        print("FAILED VALIDATION: " + str(failed_validation_set))
-        mconn = psycopg2.connect(**mdb_config)
-        mconn.autocommit = True
-        mcursor = mconn.cursor()
-        num_tries = 0
-        while num_tries < 3:
-            mcursor.execute("select dsid, uflag from metautil.dset_waf2 where uflag = %s", (uflag, ))
-            print(mcursor.query)
-            res = mcursor.fetchall()
-            print("num_tries=" + str(num_tries) + " " + str(res))
-            if len(res) > 0:
-                break
-
-            num_tries += 1
-            time.sleep(15)
-
-        if len(failed_validation_set) > 0:
-            push_list = [e for e in push_list if e not in
-                         failed_validation_set]
-            for dsid in failed_validation_set:
-                try:
-                    print(f"RESETING FLAG {dsid}")
-                    mcursor.execute((
-                            "update metautil.dset_waf2 set uflag = '' where "
-
-                            "dsid = %s"), (dsid, ))
-                    print(mcursor.query)
-                except Exception as err:
-                    print((
-                            "Warning: unable to reset uflag for '{}': error: "
-                            "'{}'").format(dsid, err))
-
-        for repo in GIT_REPOS:
-            repo_path = os.path.join(REPO_HEAD, repo)
-            print("REPO_PATH = " + str(repo_path))
-            mcursor.execute("select dsid, uflag from metautil.dset_waf2 where uflag = %s", (uflag, ))
-            print(mcursor.query)
-            res = mcursor.fetchall()
-            print(str(res))
-            o = subprocess.run((
-                    "git -C " + repo_path + " stash; git -C " + repo_path +
-                    " pull -q"), shell=True, capture_output=True)
-            err = o.stderr.decode("utf-8")
-            if len(err) > 0:
-                if o.returncode == 0:
-                    print(("git pull message: '{}'; uflag was '{}'")
-                          .format(err, uflag))
-                else:
-                    print(("git pull error: '{}'; uflag was '{}'")
-                          .format(err, uflag))
-                    sys.exit(1)
-
-            print(o.stdout.decode("utf-8"))
-            for dsid in push_list:
-                shutil.copyfile(
-                        os.path.join(LOCAL_WAF, "waf-" + dsid + ".xml"),
-                        os.path.join(repo_path, dsid + ".xml"))
-                o = subprocess.run(
-                        "git -C " + repo_path + " add " + dsid + ".xml",
-                        shell=True, capture_output=True)
-                err = o.stderr.decode("utf-8")
-                if len(err) > 0:
-                    print(("git add error for {}: '{}'; uflag was '{}'")
-                          .format(err, dsid, uflag))
-                    sys.exit(1)
-
-
-            print("COPIED")
-            mcursor.execute("select dsid, uflag from metautil.dset_waf2 where uflag = %s", (uflag, ))
-            print(mcursor.query)
-            res = mcursor.fetchall()
-            print(str(res))
-            o = subprocess.run(
-                    "git -C " + repo_path + " commit -m 'auto update' -a",
-                    shell=True, capture_output=True)
-            err = o.stderr.decode("utf-8")
-            if len(err) > 0 and err.find("Auto packing") < 0:
-                print(("git commit error: '{}'; uflag was '{}'")
-                      .format(err, uflag))
-                sys.exit(1)
-
-            mcursor.execute("select dsid, uflag from metautil.dset_waf2 where uflag = %s", (uflag, ))
-            print(mcursor.query)
-            res = mcursor.fetchall()
-            print(str(res))
-            o = subprocess.run("git -C " + repo_path + " push -q", shell=True,
-                               capture_output=True)
-            err = o.stderr.decode("utf-8")
-            if len(err) > 0 and err.find("remote: Resolving deltas") != 0:
-                print(("git push error: '{}'; uflag was '{}'")
-                      .format(err, uflag))
-                sys.exit(1)
-
-            err = ""
-            while len(err) == 0:
-                o = subprocess.run(
-                        "git -C " + repo_path + " stash drop 'stash@{0}'",
-                        shell=True, capture_output=True)
-                err = o.stderr.decode("utf-8")
-
-            mcursor.execute("select dsid, uflag from metautil.dset_waf2 where uflag = %s", (uflag, ))
-            print(mcursor.query)
-            res = mcursor.fetchall()
-            print(str(res))
-
-        if len(uflag) > 0:
-            print("DELETING " + uflag)
-            mcursor.execute("select dsid, uflag from metautil.dset_waf2 where uflag = %s", (uflag, ))
-            print(mcursor.query)
-            res = mcursor.fetchall()
-            print(str(res))
-            mcursor.execute("delete from metautil.dset_waf2 where uflag = %s",
-                            (uflag, ))
-
-        print(f"Pushed {len(push_list)} datasets.")
+            mdate = metadata_date(dsid, mcursor)
+            mdates[dsid] = (mdate.isoformat() if isinstance(mdate, datetime)
+                            else None)
+
+        if args[0] == "changed":
+            push_list = [e for e in push_list if e not in manifest or
+                         mdates[e] is None or
+                         mdates[e] != manifest[e]['metadata_date']]
+            print("CHANGED: " + str(push_list))
+            if len(push_list) == 0:
+                print("No changed datasets found.")
+                sys.exit(0)
+
+        # the schemas that the ISO schema imports are read from the local
+        #   copies in the catalog
+        catalog = os.path.join(LOCAL_WAF, "schemas/catalog.xml")
+        if os.path.exists(catalog):
+            set_xml_catalog(catalog)
+
+        # the chunks share one pool of connections to each database, and
+        #   one pool of validation processes, which compile the schema once
+        pools.append(create_connection_pool(mdb_config))
+        pools.append(create_connection_pool(wdb_config))
+        validation_pool = create_validation_pool(SCHEMAS)
+        queued = args[0] == "queued-only"
+        num_pushed = 0
+        for n in range(0, len(push_list), CHUNK_SIZE):
+            chunk = push_list[n:n+CHUNK_SIZE]
+            print("CHUNK {}-{} of {}".format(n + 1, n + len(chunk),
+                                             len(push_list)))
+            num_pushed += push_chunk(chunk, pools[0], pools[1],
+                                     validation_pool, mcursor, manifest,
+                                     mdates, queued)
+
+        print(f"Pushed {num_pushed} datasets.")
     except Exception as err:
         print("An error occurred: '{}'".format(err))
     finally:
         if 'mconn' in locals():
             mconn.close()
 
+        if 'validation_pool' in locals():
+            validation_pool.shutdown()
+
+        for pool in pools:
+            pool.closeall()
+
 
 def do_delete(args):
     print("do_delete")
@@ -283,6 +406,9 @@ def print_usage_and_exit():
     print(("    'dnnnnnn ...':          specify one or more individual "
            "dataset IDs"))
     print(("    'all':                  identify all public datasets"))
+    print(("    'changed' (PUSH):       only push public datasets whose "
+           "metadata date has"))
+    print(("                            changed since their last push"))
     print(("    'queued-only' (PUSH):   only push datasets that are queued in "
            "the database"))
     print(("    'non-public' (DELETE):  identify and delete just "
@@ -0,0 +1,41 @@
+import os
+import subprocess
+
+import pytest
+
+from dset_waf import dset_waf
+
+
+def _git(*args):
+    subprocess.run(["git"] + list(args), check=True, capture_output=True)
+
+
+@pytest.fixture
+def waf(tmp_path, monkeypatch):
+    """
+    A local WAF under 'tmp_path' with a clone of a local bare repo for each
+    of GIT_REPOS, in place of the GitHub remotes. Returns the path of the
+    directory that holds the bare repos, with the same relative names.
+    """
+    local_waf = str(tmp_path)
+    monkeypatch.setattr(dset_waf, "LOCAL_WAF", local_waf)
+    monkeypatch.setattr(dset_waf, "REPO_HEAD",
+                        os.path.join(local_waf, "git-repos"))
+    monkeypatch.setattr(dset_waf, "MANIFEST",
+                        os.path.join(local_waf, "manifest.json"))
+    origins = os.path.join(local_waf, "origins")
+    for repo in dset_waf.GIT_REPOS:
+        origin = os.path.join(origins, repo)
+        _git("init", "-q", "--bare", "-b", "main", origin)
+        clone = os.path.join(dset_waf.REPO_HEAD, repo)
+        _git("clone", "-q", origin, clone)
+        _git("-C", clone, "config", "user.name", "dset_waf")
+        _git("-C", clone, "config", "user.email", "dset_waf@localhost")
+        with open(os.path.join(clone, "README"), "w") as f:
+            f.write("WAF\n")
+
+        _git("-C", clone, "add", "README")
+        _git("-C", clone, "commit", "-q", "-m", "init")
+        _git("-C", clone, "push", "-q", "-u", "origin", "main")
+
+    return origins
@@ -0,0 +1,54 @@
+import os
+import subprocess
+
+import pytest
+
+from dset_waf import dset_waf
+
+
+def _write_records(dsids, text):
+    for dsid in dsids:
+        with open(os.path.join(dset_waf.LOCAL_WAF, "waf-" + dsid + ".xml"),
+                  "w") as f:
+            f.write("<rec>{} {}</rec>".format(dsid, text))
+
+
+def _origin_files(origin):
+    o = subprocess.run(["git", "-C", origin, "ls-tree", "--name-only",
+                        "main"], check=True, capture_output=True)
+    return sorted(o.stdout.decode("utf-8").split())
+
+
+def _origin_file(origin, name):
+    o = subprocess.run(["git", "-C", origin, "show", "main:" + name],
+                       check=True, capture_output=True)
+    return o.stdout.decode("utf-8")
+
+
+def test_sync_repo_pushes_records(waf):
+    dsids = ["d{:06d}".format(n) for n in range(0, 45)]
+    _write_records(dsids, "v1")
+    for repo in dset_waf.GIT_REPOS:
+        dset_waf.sync_repo(repo, dsids, "")
+
+    for repo in dset_waf.GIT_REPOS:
+        origin = os.path.join(waf, repo)
+        assert _origin_files(origin) == sorted(
+                ["README"] + [dsid + ".xml" for dsid in dsids])
+        assert _origin_file(origin, "d000007.xml") == "<rec>d000007 v1</rec>"
+
+
+def test_sync_repo_updates_records(waf):
+    repo = dset_waf.GIT_REPOS[0]
+    _write_records(["d000001", "d000002"], "v1")
+    dset_waf.sync_repo(repo, ["d000001", "d000002"], "")
+    _write_records(["d000002"], "v2")
+    dset_waf.sync_repo(repo, ["d000002"], "")
+    origin = os.path.join(waf, repo)
+    assert _origin_file(origin, "d000001.xml") == "<rec>d000001 v1</rec>"
+    assert _origin_file(origin, "d000002.xml") == "<rec>d000002 v2</rec>"
+
+
+def test_sync_repo_raises_on_git_error(waf):
+    with pytest.raises(RuntimeError):
+        dset_waf.sync_repo("no/such-repo", ["d000001"], "")
@@ -7,17 +7,44 @@ import re
 import requests
 import sys
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from lxml import etree
 
-from libpkg.dbutils import uncompress_bitmap_values
+from libpkg.citeutils import CitationIndex, get_citation_works
+from libpkg.dbutils import (
+        CompressedBitmap,
+        create_connection_pool,
+        get_connection,
+        get_grid_definitions,
+        put_connection
+)
 from libpkg.gridutils import (
         convert_grid_definition,
+        set_domain_cache_file,
         spatial_domain_from_grid_definition
 )
-from libpkg.metaformats import dublin_core, json_ld
-from libpkg.metautils import get_date_from_precision, open_dataset_overview
+from libpkg.metaformats import export_all
+from libpkg.metautils import (
+        get_date_from_precision,
+        open_dataset_overview,
+        set_overview_cache_dir
+)
 
-from .utils import name_to_initial, unicode_escape, update_wagtail
+from .probes import page_exists, start_probes
+from .profiling import (
+        ProfilingCursor,
+        output_profile,
+        profiled,
+        stage,
+        start_profile,
+        stop_profile
+)
+from .utils import (
+        WagtailUpdates,
+        name_to_initial,
+        unicode_escape,
+        update_wagtail
+)
 
 
 HOST_NAME = "http://localhost:8080"
@@ -25,11 +52,14 @@ DATASETS_URL = os.path.join(HOST_NAME, "datasets")
 METADATA_URL = os.path.join(HOST_NAME, "metadata")
 
 
-def write_meta_and_jsonld(dsid, metadb_config, wagtaildb_config):
-    dc_meta = dublin_core.export(
-            dsid, metadb_config, wagtaildb_config,
-            output="html_meta")
-    jsonld = json_ld.export(dsid, metadb_config, wagtaildb_config)
+@profiled
+def write_meta_and_jsonld(dsid, metadb, wagtaildb):
+    # 'metadb' and 'wagtaildb' are connection settings, pools or open
+    #   connections, as accepted by the metaformats exporters
+    docs = export_all(dsid, metadb, wagtaildb,
+                      formats=["dublin_core_html_meta", "json_ld"])
+    dc_meta = docs['dublin_core_html_meta']
+    jsonld = docs['json_ld']
     with open(os.path.join("/data/web/jsonld", dsid + ".jsonld"), "w") as f:
         f.write(dc_meta + "\n")
         f.write('<script type="application/ld+json">\n')
@@ -38,6 +68,7 @@ def write_meta_and_jsonld(dsid, metadb_config, wagtaildb_config):
         f.write("</script>")
 
 
+@profiled
 def get_contributors(dsid, cursor):
     contributors = []
     cursor.execute((
@@ -59,6 +90,7 @@ def get_contributors(dsid, cursor):
     return contributors
 
 
+@profiled
 def get_data_volume(dsid, cursor):
     data_volume = {}
     cursor.execute("select dweb_size from dssdb.dataset where dsid = %s",
@@ -95,24 +127,23 @@ def get_data_volume(dsid, cursor):
     return data_volume
 
 
+@profiled
 def add_variable_table(dsid, format, list):
-    response = requests.get(
-            os.path.join(DATASETS_URL, dsid, "metadata", format + ".html"))
+    dataset_url = os.path.join(DATASETS_URL, dsid)
     appended = False
-    if response.status_code == 200:
+    if page_exists(dataset_url, "metadata/" + format + ".html"):
         list.append({'format': format.upper(),
                      'html': "metadata/" + format + ".html"})
         appended = True
 
-    response = requests.get(
-            os.path.join(DATASETS_URL, dsid, "metadata", format + ".xml"))
-    if response.status_code == 200:
+    if page_exists(dataset_url, "metadata/" + format + ".xml"):
         if not appended:
             list.append({'format': format.upper()})
 
         list[-1].update({'xml': "metadata/" + format + ".xml"})
 
 
+@profiled
 def get_variables(dsid, cursor):
     variables = {}
     cursor.execute((
@@ -138,6 +169,7 @@ def get_variables(dsid, cursor):
     return variables
 
 
+@profiled
 def get_temporal(dsid, cursor):
     temporal = {}
     cursor.execute((
@@ -306,29 +338,13 @@ def add_author(author, citation, last_author, ignore_orcid_id):
     return citation
 
 
-def add_book_chapter(doi, cursor, citation):
-    cursor.execute((
-            "select pages, isbn from citation.book_chapter_works where doi = "
-            "%s"), (doi, ))
-    book_data = cursor.fetchone()
-    if book_data is None:
-        return ""
-
-    pages, isbn = book_data
-    cursor.execute(
-            "select title, publisher from citation.book_works where isbn = %s",
-            (isbn, ))
-    book_data = cursor.fetchone()
-    if book_data is None:
+def add_book_chapter(chapter, citation):
+    # 'chapter' is the BookChapter of a work, or None
+    if chapter is None:
         return ""
 
-    title, publisher = book_data
-    citation += "{}. Ed. ".format(html.escape(title))
-    cursor.execute((
-            "select first_name, middle_name, last_name from citation."
-            "works_authors where id = %s and id_type = 'ISBN' order by "
-            "sequence"), (isbn, ))
-    authors = cursor.fetchall()
+    citation += "{}. Ed. ".format(html.escape(chapter.title))
+    authors = chapter.editors
     if len(authors) == 0:
         return ""
 
@@ -346,15 +362,12 @@ def add_book_chapter(doi, cursor, citation):
 
         auth_s += html.escape(author[2])
 
-    citation += "{}, {}, {}.".format(auth_s, publisher, pages)
+    citation += "{}, {}, {}.".format(auth_s, chapter.publisher,
+                                     chapter.pages)
     return citation
 
 
-def add_journal(doi, cursor, citation):
-    cursor.execute((
-            "select pub_name, volume, pages from citation.journal_works where "
-            "doi = %s"), (doi, ))
-    journal_data = cursor.fetchone()
+def add_journal(doi, journal_data, citation):
     if journal_data is None:
         return ""
 
@@ -373,11 +386,7 @@ def add_journal(doi, cursor, citation):
     return citation
 
 
-def add_proceedings(doi, publisher, cursor, citation):
-    cursor.execute((
-            "select pub_name, pages from citation.proceedings_works where "
-            "doi = %s"), (doi, ))
-    pub_data = cursor.fetchone()
+def add_proceedings(doi, publisher, pub_data, citation):
     if pub_data is None:
         return ""
 
@@ -395,33 +404,18 @@ def add_proceedings(doi, publisher, cursor, citation):
     return citation
 
 
-def get_citations(dsid, cursor):
+@profiled
+def get_citations(dsid, cursor, **kwargs):
     citations = {}
-    cursor.execute((
-            "select distinct d.doi_work from citation.data_citations_gdex as "
-            "d left join dssdb.dsvrsn as v on v.doi = d.doi_data where v.dsid "
-            "= %s"), (dsid, ))
-    res = cursor.fetchall()
-    for e in res:
-        doi = e[0]
-        cursor.execute((
-                "select title, pub_year, type, publisher from citation.works "
-                "where doi = %s"), (doi, ))
-        pub_data = cursor.fetchone()
-        if pub_data is None:
-            continue
-
-        title, pub_year, type, publisher = pub_data
+    for doi, work in get_citation_works(dsid, cursor, **kwargs):
+        title, pub_year, type, publisher = (
+                work.title, work.pub_year, work.type, work.publisher)
         title = title.replace("\\/sub", "/sub")
         title = html.escape(unicode_escape(title))
         if type == "C":
             title = '"' + title + '", in '
 
-        cursor.execute((
-                "select last_name, first_name, middle_name, orcid_id from "
-                "citation.works_authors where id = %s and id_type = 'DOI' "
-                "order by sequence"), (doi, ))
-        authors = cursor.fetchall()
+        authors = work.authors
         if len(authors) == 0:
             continue
 
@@ -438,11 +432,12 @@ def get_citations(dsid, cursor):
 
         citation += ", " + str(pub_year) + ": " + title
         if type == "C":
-            citation = add_book_chapter(doi, cursor, citation)
+            citation = add_book_chapter(work.book_chapter, citation)
         elif type == "J":
-            citation = add_journal(doi, cursor, citation)
+            citation = add_journal(doi, work.journal, citation)
         elif type == "P":
-            citation = add_proceedings(doi, publisher, cursor, citation)
+            citation = add_proceedings(doi, publisher, work.proceedings,
+                                       citation)
 
         if len(citation) > 0:
             citations[pub_year].append((auth_list, citation))
@@ -463,7 +458,8 @@ def get_citations(dsid, cursor):
     return citations
 
 
-def update_wagtail_from_metadata_db(dsid, mcursor, wconn):
+@profiled
+def update_wagtail_from_metadata_db(dsid, mcursor, wconn, **kwargs):
     mcursor.execute(
             "select title, summary from search.datasets where dsid = %s",
             (dsid, ))
@@ -492,7 +488,7 @@ def update_wagtail_from_metadata_db(dsid, mcursor, wconn):
     else:
         update_wagtail(dsid, "dataset_description_datasetdescriptionpage",
                        "dsdoi", "", wconn)
-    citations = get_citations(dsid, mcursor)
+    citations = get_citations(dsid, mcursor, **kwargs)
     update_wagtail(dsid, "dataset_citation_datasetcitationpage", "citations",
                    json.dumps(citations), wconn)
     num_citations = 0
@@ -702,6 +698,7 @@ def add_publications(dsid, xml, wconn):
                    "publications", json.dumps([e[1] for e in pubs]), wconn)
 
 
+@profiled
 def update_wagtail_from_xml(dsid, xml, wconn):
     dslogo = xml.find("./logo")
     if dslogo is not None:
@@ -725,6 +722,7 @@ def update_wagtail_from_xml(dsid, xml, wconn):
     add_publications(dsid, xml, wconn)
 
 
+@profiled
 def add_related_dslist(dsid, cursor, xml, wconn):
     ele_list = xml.findall("./relatedDataset")
     dslist = []
@@ -770,25 +768,20 @@ def add_format_urls(formats):
     return data_formats
 
 
+@profiled
 def add_gridded_coverage(dsid, cursor, wconn):
     cursor.execute((
             'select distinct grid_definition_codes from "WGrML".' + dsid +
             '_agrids2'))
-    res = cursor.fetchall()
-    gvals = set()
-    for bitmap in res:
-        gvals.update(uncompress_bitmap_values(bitmap[0]))
+    gvals = CompressedBitmap().union(
+            *[CompressedBitmap(bitmap[0]) for bitmap in cursor])
 
     gdefs = []
     min_west = 180.
     max_east = -180.
     min_south = 90.
     max_north = -90.
-    for val in gvals:
-        cursor.execute((
-                'select definition, def_params from "WGrML".grid_definitions '
-                'where code = %s'), (val, ))
-        res = cursor.fetchone()
+    for code, res in get_grid_definitions(cursor, gvals):
         domain = spatial_domain_from_grid_definition(
                 res, centerOn="primeMeridian")
         if all(domain.values()):
@@ -851,6 +844,7 @@ def add_gridded_coverage(dsid, cursor, wconn):
                    "spatial_coverage", json.dumps(scov), wconn)
 
 
+@profiled
 def check_for_auto_content_metadata(dsid, mconn, wconn):
     has_auto_cmd = False
     cursor = mconn.cursor()
@@ -879,10 +873,8 @@ def check_for_auto_content_metadata(dsid, mconn, wconn):
                 if db[1] == "grid":
                     add_gridded_coverage(dsid, cursor, wconn)
                     d = {'list': []}
-                    response = requests.head(
-                            os.path.join(DATASETS_URL, dsid,
-                                         "metadata/grib2_levels.html"))
-                    if response.status_code == 200:
+                    if page_exists(os.path.join(DATASETS_URL, dsid),
+                                   "metadata/grib2_levels.html"):
                         d['grib2'] = True
 
                     update_wagtail(
@@ -900,6 +892,7 @@ def check_for_auto_content_metadata(dsid, mconn, wconn):
     return has_auto_cmd
 
 
+@profiled
 def add_data_types(dsid, xml, wconn):
     dlist = xml.findall("./contentMetadata/dataType")
     data_types = []
@@ -910,6 +903,7 @@ def add_data_types(dsid, xml, wconn):
                    "data_types", json.dumps(data_types), wconn)
 
 
+@profiled
 def add_data_formats(dsid, xml, wconn):
     flist = xml.findall("./contentMetadata/format")
     data_formats = []
@@ -932,6 +926,7 @@ def add_data_formats(dsid, xml, wconn):
                    "data_formats", json.dumps(data_formats), wconn)
 
 
+@profiled
 def add_temporal_frequency(dsid, xml, wconn):
     freq_list = xml.findall("./contentMetadata/temporalFrequency")
     freqs = []
@@ -988,13 +983,26 @@ def add_temporal_frequency(dsid, xml, wconn):
                    "temporal_freq", ", ".join(freqs), wconn)
 
 
+@profiled
 def add_detailed_variables(dsid, xml, wconn):
-    cursor = wconn.cursor()
-    cursor.execute((
-            "select variables from wagtail2."
-            "dataset_description_datasetdescriptionpage where dsid = %s"),
-            (dsid, ))
-    variables = cursor.fetchone()
+    # the variables were set earlier in the run, so they may not have been
+    #   written to the database yet
+    variables = None
+    if isinstance(wconn, WagtailUpdates):
+        variables = wconn.get(
+                dsid, "dataset_description_datasetdescriptionpage",
+                "variables")
+
+    if variables is not None:
+        variables = (json.loads(variables),)
+    else:
+        cursor = wconn.cursor()
+        cursor.execute((
+                "select variables from wagtail2."
+                "dataset_description_datasetdescriptionpage where dsid = %s"),
+                (dsid, ))
+        variables = cursor.fetchone()
+
     if variables is not None:
         variables = variables[0]
         det_vars = xml.findall(
@@ -1009,6 +1017,7 @@ def add_detailed_variables(dsid, xml, wconn):
                        "variables", json.dumps(variables), wconn)
 
 
+@profiled
 def add_vertical_levels(dsid, xml, wconn):
     vlist = []
     levels = xml.findall("./contentMetadata/levels/level")
@@ -1071,6 +1080,178 @@ def add_vertical_levels(dsid, xml, wconn):
                        "levels", json.dumps([]), wconn)
 
 
+def generate(dsid, mconn, wconn, **kwargs):
+    """
+    Updates the landing page content of the dataset 'dsid' from the metadata
+    database connection 'mconn' and writes it to the wagtail database
+    connection 'wconn'. Returns False if the dataset is skipped because it
+    is a working dataset, otherwise True.
+
+    Optional keyword arguments:
+        write_jsonld: output the <meta> tags and JSON-LD (default True)
+        dset_waf: add the dataset to the queue for the DSET WAF (default
+                  True)
+        citation_index: a CitationIndex to take the citing works from
+    """
+    write_jsonld = kwargs['write_jsonld'] if 'write_jsonld' in kwargs else True
+    dset_waf = kwargs['dset_waf'] if 'dset_waf' in kwargs else True
+    citation_index = (kwargs['citation_index'] if 'citation_index' in kwargs
+                      else None)
+    cursor = mconn.cursor()
+    cursor.execute("select type from search.datasets where dsid = %s",
+                   (dsid, ))
+    type, = cursor.fetchone()
+    if type == "W":
+        return False
+
+    # the pages that the run checks for are requested in the background
+    with stage("start_probes"):
+        start_probes(os.path.join(DATASETS_URL, dsid))
+
+    if write_jsonld:
+        write_meta_and_jsonld(dsid, mconn, wconn)
+
+    # the wagtail updates are written together at the end of the run
+    wconn = WagtailUpdates(wconn)
+    with stage("update_dstype"):
+        update_wagtail(dsid, "dataset_description_datasetdescriptionpage",
+                       "dstype", type, wconn)
+
+    update_wagtail_from_metadata_db(dsid, mconn.cursor(), wconn,
+                                    citation_index=citation_index)
+    with stage("open_dataset_overview"):
+        xml = open_dataset_overview(dsid)
+
+    update_wagtail_from_xml(dsid, xml, wconn)
+    add_related_dslist(dsid, mconn.cursor(), xml, wconn)
+    has_auto_cmd = check_for_auto_content_metadata(dsid, mconn, wconn)
+    if not has_auto_cmd:
+        add_data_types(dsid, xml, wconn)
+        add_data_formats(dsid, xml, wconn)
+        add_temporal_frequency(dsid, xml, wconn)
+        add_detailed_variables(dsid, xml, wconn)
+        add_vertical_levels(dsid, xml, wconn)
+
+    with stage("flush_wagtail_updates"):
+        wconn.flush()
+
+    if dset_waf and type in ('P', 'H') and dsid < 'd999000':
+        with stage("queue_dset_waf"):
+            cursor.execute((
+                    "insert into metautil.dset_waf2 (dsid, uflag) values "
+                    "(%s, '') on conflict (dsid, uflag) do update set "
+                    "uflag = excluded.uflag"), (dsid, ))
+            mconn.commit()
+
+    return True
+
+
+def get_batch_list(args, mpool):
+    # the dataset IDs in 'args', which are dataset IDs, files of dataset IDs
+    #   (one per line) or "all" for every dataset in search.datasets
+    dsids = []
+    for arg in args:
+        if arg == "all":
+            mconn = get_connection(mpool, "metadata")
+            try:
+                cursor = mconn.cursor()
+                cursor.execute((
+                        "select dsid from search.datasets where type != 'W' "
+                        "order by dsid"))
+                dsids.extend([e[0] for e in cursor.fetchall()])
+            finally:
+                put_connection(mconn, mpool)
+
+        elif os.path.isfile(arg):
+            with open(arg, "r") as f:
+                dsids.extend([line.strip() for line in f if
+                              len(line.strip()) > 0])
+
+        else:
+            dsids.append(arg)
+
+    return list(dict.fromkeys(dsids))
+
+
+def run_batch(args, metadb_config, wagtaildb_config, **kwargs):
+    """
+    Runs generate() for each dataset in the batch specification 'args' (see
+    get_batch_list), 'workers' datasets at a time. The workers share a pool
+    of connections to each database, the process-wide caches and a
+    CitationIndex, which is loaded once for the batch. Returns a
+    dictionary that maps each dataset ID to None on success, "skipped" for a
+    working dataset, or the exception that it raised.
+
+    Optional keyword arguments:
+        workers: the number of datasets to process at once (default 4)
+        print_profile, profile_log: as for the --profile and --profile-log
+                                    options
+        any keyword argument of generate()
+    """
+    workers = kwargs.pop('workers') if 'workers' in kwargs else 4
+    print_profile = (kwargs.pop('print_profile') if 'print_profile' in kwargs
+                     else False)
+    profile_log = (kwargs.pop('profile_log') if 'profile_log' in kwargs else
+                   None)
+    profiling = print_profile or profile_log is not None
+    conn_kwargs = {'cursor_factory': ProfilingCursor} if profiling else {}
+    mpool = create_connection_pool({**metadb_config, **conn_kwargs},
+                                   maxconn=workers)
+    try:
+        wpool = create_connection_pool({**wagtaildb_config, **conn_kwargs},
+                                       maxconn=workers)
+        try:
+            dsids = get_batch_list(args, mpool)
+            if 'citation_index' not in kwargs:
+                kwargs['citation_index'] = CitationIndex()
+
+            mconn = get_connection(mpool, "metadata")
+            try:
+                kwargs['citation_index'].refresh(mconn.cursor())
+                mconn.commit()
+            finally:
+                put_connection(mconn, mpool)
+
+            def run(dsid):
+                if profiling:
+                    start_profile(dsid)
+
+                try:
+                    mconn = get_connection(mpool, "metadata")
+                    try:
+                        wconn = get_connection(wpool, "wagtail")
+                        try:
+                            return None if generate(dsid, mconn, wconn,
+                                                    **kwargs) else "skipped"
+                        finally:
+                            put_connection(wconn, wpool)
+
+                    finally:
+                        put_connection(mconn, mpool)
+
+                finally:
+                    if profiling:
+                        output_profile(stop_profile(), print_profile,
+                                       profile_log)
+
+            results = {}
+            with ThreadPoolExecutor(workers) as executor:
+                futures = {executor.submit(run, dsid): dsid for dsid in dsids}
+                for future in as_completed(futures):
+                    try:
+                        results[futures[future]] = future.result()
+                    except Exception as err:
+                        results[futures[future]] = err
+
+        finally:
+            wpool.closeall()
+
+    finally:
+        mpool.closeall()
+
+    return results
+
+
 def print_usage(util_name, err):
     if len(str(err)) > 0:
         print("Error: {}\n".format(err))
@@ -1085,9 +1266,30 @@ def print_usage(util_name, err):
         "--wdb=<dict>   <dict> is the wagtail database configuration "
         "dictionary\n"
         "\noptions:\n"
+        "--domain-cache=<file>\n"
+        "               keep the spatial domains of grid definitions in the "
+        "SQLite\n"
+        "               database <file> for reuse by later runs\n"
         "--no-dset-waf  don't add the dataset to the queue for the DSET WAF"
         "\n"
         "--no-jsonld    don't output <meta> tags and JSON-LD\n"
+        "--overview-cache=<dir>\n"
+        "               keep the downloaded dataset overviews in <dir> and "
+        "only\n"
+        "               download them again when they have changed\n"
+        "--profile      print the wall time, database queries and HTTP "
+        "requests of\n"
+        "               each stage to stderr\n"
+        "--profile-log=<file>\n"
+        "               append the profile to <file> as a line of JSON\n"
+        "--batch        process every dataset in the arguments, which can "
+        "be dataset\n"
+        "               IDs, files of dataset IDs (one per line) or 'all' "
+        "for every\n"
+        "               dataset in search.datasets, and report the result of "
+        "each\n"
+        "--workers=<n>  with --batch, process <n> datasets at a time "
+        "(default 4)\n"
         "\n"
         "dnnnnnn        dataset ID"
     ))
@@ -1103,12 +1305,18 @@ def main():
 
         opts, args = getopt.getopt(sys.argv[1:], "",
                                    ["mdb=", "wdb=", "no-jsonld",
-                                    "no-dset-waf"])
+                                    "no-dset-waf", "domain-cache=",
+                                    "overview-cache=", "profile",
+                                    "profile-log=", "batch", "workers="])
     except getopt.GetoptError as err:
         print_usage(util_name, err)
 
     write_jsonld = True
     no_dset_waf = False
+    print_profile = False
+    profile_log = None
+    batch = False
+    workers = 4
     for opt in opts:
         if opt[0] == "--mdb":
             try:
@@ -1126,6 +1334,21 @@ def main():
             write_jsonld = False
         elif opt[0] == "--no-dset-waf":
             no_dset_waf = True
+        elif opt[0] == "--domain-cache":
+            set_domain_cache_file(opt[1])
+        elif opt[0] == "--overview-cache":
+            set_overview_cache_dir(opt[1])
+        elif opt[0] == "--profile":
+            print_profile = True
+        elif opt[0] == "--profile-log":
+            profile_log = opt[1]
+        elif opt[0] == "--batch":
+            batch = True
+        elif opt[0] == "--workers":
+            try:
+                workers = int(opt[1])
+            except ValueError:
+                print_usage(util_name, "bad number of workers")
 
     errs = []
     if 'metadb_config' not in locals():
@@ -1134,43 +1357,44 @@ def main():
     if 'wagtaildb_config' not in locals():
         errs.append("missing wagtail database configuration")
 
+    if len(args) == 0:
+        errs.append("missing dataset ID")
+
     if len(errs) > 0:
         print_usage(util_name, "\n".join(errs))
 
+    if batch:
+        results = run_batch(args, metadb_config, wagtaildb_config,
+                            workers=workers, print_profile=print_profile,
+                            profile_log=profile_log,
+                            write_jsonld=write_jsonld,
+                            dset_waf=not no_dset_waf)
+        failed = [dsid for dsid, err in results.items() if
+                  isinstance(err, Exception)]
+        for dsid in sorted(results):
+            if results[dsid] is None:
+                print("{}: OK".format(dsid))
+            elif dsid in failed:
+                print("{}: FAILED: {}".format(dsid, results[dsid]))
+            else:
+                print("{}: {}".format(dsid, results[dsid]))
+
+        print("{} datasets, {} failed".format(len(results), len(failed)))
+        sys.exit(1 if len(failed) > 0 else 0)
+
     dsid = args[0]
+    conn_kwargs = {}
+    if print_profile or profile_log is not None:
+        start_profile(dsid)
+        conn_kwargs['cursor_factory'] = ProfilingCursor
+
     try:
-        mconn = psycopg2.connect(**metadb_config)
-        cursor = mconn.cursor()
-        cursor.execute("select type from search.datasets where dsid = %s",
-                       (dsid, ))
-        type, = cursor.fetchone()
-        if type == "W":
-            sys.exit(0)
-
-        wconn = psycopg2.connect(**wagtaildb_config)
-        if write_jsonld:
-            write_meta_and_jsonld(dsid, metadb_config, wagtaildb_config)
-        update_wagtail(dsid, "dataset_description_datasetdescriptionpage",
-                       "dstype", type, wconn)
-        update_wagtail_from_metadata_db(dsid, mconn.cursor(), wconn)
-        xml = open_dataset_overview(dsid)
-        update_wagtail_from_xml(dsid, xml, wconn)
-        add_related_dslist(dsid, mconn.cursor(), xml, wconn)
-        has_auto_cmd = check_for_auto_content_metadata(dsid, mconn, wconn)
-        if not has_auto_cmd:
-            add_data_types(dsid, xml, wconn)
-            add_data_formats(dsid, xml, wconn)
-            add_temporal_frequency(dsid, xml, wconn)
-            add_detailed_variables(dsid, xml, wconn)
-            add_vertical_levels(dsid, xml, wconn)
-
-        if not no_dset_waf and type in ('P', 'H') and dsid < 'd999000':
-            cursor.execute((
-                    "insert into metautil.dset_waf2 (dsid, uflag) values (%s, "
-                    "'') on conflict (dsid, uflag) do update set uflag = "
-                    "excluded.uflag"), (dsid, ))
-            mconn.commit()
+        with stage("connect"):
+            mconn = psycopg2.connect(**metadb_config, **conn_kwargs)
+            wconn = psycopg2.connect(**wagtaildb_config, **conn_kwargs)
 
+        generate(dsid, mconn, wconn, write_jsonld=write_jsonld,
+                 dset_waf=not no_dset_waf)
     finally:
         try:
             mconn.close()
@@ -1182,6 +1406,9 @@ def main():
         except Exception:
             pass
 
+        if 'cursor_factory' in conn_kwargs:
+            output_profile(stop_profile(), print_profile, profile_log)
+
 
 if __name__ == "__main__":
     main()
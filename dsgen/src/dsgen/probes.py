@@ -0,0 +1,90 @@
+import collections
+import os
+import requests
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from .profiling import in_current_profile
+
+
+# the pages under a dataset's URL whose existence a run checks for
+PROBE_PAGES = (
+        "metadata/grib.html", "metadata/grib.xml", "metadata/grib2.html",
+        "metadata/grib2.xml", "metadata/on84.html", "metadata/on84.xml",
+        "metadata/grib2_levels.html")
+# the number of requests to have in flight at once
+_PROBE_THREADS = 8
+# the number of datasets to keep the probes of
+_PROBE_CACHE_SIZE = 64
+# the future of the existence of each probed page, keyed by dataset URL and
+#   then by page
+_probe_cache = collections.OrderedDict()
+_probe_cache_lock = threading.Lock()
+_session = None
+_executor = None
+
+
+def _head(url):
+    # True if 'url' exists; redirects are followed, as a GET would
+    return _session.head(url, allow_redirects=True).status_code == 200
+
+
+def _submit(dataset_url, pages, probes):
+    # starts the HEAD request of each of 'pages' into 'probes'; call with
+    #   _probe_cache_lock held
+    global _session, _executor
+    if _executor is None:
+        # the session keeps a connection to the web server open for each
+        #   thread
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=_PROBE_THREADS)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+        _executor = ThreadPoolExecutor(_PROBE_THREADS)
+
+    for page in pages:
+        probes[page] = _executor.submit(in_current_profile(_head),
+                                        os.path.join(dataset_url, page))
+
+
+def _get_probes(dataset_url, reset):
+    # returns the probes of 'dataset_url', starting all of PROBE_PAGES if
+    #   there aren't any or if 'reset' is True; call with _probe_cache_lock
+    #   held
+    if reset or dataset_url not in _probe_cache:
+        _probe_cache[dataset_url] = {}
+        _submit(dataset_url, PROBE_PAGES, _probe_cache[dataset_url])
+        while len(_probe_cache) > _PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+
+    _probe_cache.move_to_end(dataset_url)
+    return _probe_cache[dataset_url]
+
+
+def start_probes(dataset_url):
+    """
+    Starts checking whether each of PROBE_PAGES exists under 'dataset_url',
+    with HEAD requests that run at the same time as each other and as the
+    caller. Any earlier results for 'dataset_url' are discarded, so that a
+    run sees the pages as they are when it starts.
+    """
+    with _probe_cache_lock:
+        _get_probes(dataset_url, True)
+
+
+def page_exists(dataset_url, page):
+    """
+    Returns True if 'page' under 'dataset_url' exists. The result comes from
+    start_probes() if it has been called for 'dataset_url'; otherwise all of
+    PROBE_PAGES are probed now and the results are kept for later calls.
+    """
+    with _probe_cache_lock:
+        probes = _get_probes(dataset_url, False)
+        if page not in probes:
+            _submit(dataset_url, (page, ), probes)
+
+        probe = probes[page]
+
+    return probe.result()
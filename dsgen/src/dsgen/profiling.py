@@ -0,0 +1,201 @@
+import functools
+import json
+import psycopg2.extensions
+import requests
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+# the profile of the run in each thread; a thread's profile is None if its
+#   run isn't being profiled
+_state = threading.local()
+# the number of runs being profiled, which counts HTTP requests while it is
+#   more than zero
+_num_profiles = 0
+_profiles_lock = threading.Lock()
+# serializes the counting of threads that share a profile
+_count_lock = threading.Lock()
+_output_lock = threading.Lock()
+_session_send = requests.Session.send
+
+
+class Profile:
+    """
+    The wall time of each stage of a dsgen run, and the database queries and
+    HTTP requests that the stage made.
+    """
+    COUNTERS = ("db_queries", "db_seconds", "http_requests", "http_bytes")
+
+    def __init__(self, dsid):
+        self.dsid = dsid
+        self.stages = []
+        self.counters = {key: 0 for key in self.COUNTERS}
+        self.start = time.perf_counter()
+        self.seconds = None
+        self._path = []
+
+    def to_json(self):
+        """
+        Returns the profile as one line of JSON.
+        """
+        return json.dumps({'dsid': self.dsid, 'seconds': self.seconds,
+                           **self.counters, 'stages': self.stages})
+
+    def report(self):
+        """
+        Returns the profile as a table of the stages, with nested stages
+        indented under the stages that called them.
+        """
+        fmt = "{:<48} {:>9} {:>7} {:>9} {:>5} {:>10}"
+        lines = [fmt.format("stage", "seconds", "queries", "db_secs", "http",
+                            "http_bytes")]
+        for stage in self.stages + [dict(self.counters, stage="total",
+                                         seconds=self.seconds)]:
+            depth = stage['stage'].count("/")
+            lines.append(fmt.format(
+                    "  " * depth + stage['stage'].split("/")[-1],
+                    "{:.3f}".format(stage['seconds']), stage['db_queries'],
+                    "{:.3f}".format(stage['db_seconds']),
+                    stage['http_requests'], stage['http_bytes']))
+
+        return "\n".join(lines)
+
+
+def _count(**kwargs):
+    profile = getattr(_state, "profile", None)
+    if profile is not None:
+        with _count_lock:
+            for key, val in kwargs.items():
+                profile.counters[key] += val
+
+
+class ProfilingCursor(psycopg2.extensions.cursor):
+    """
+    A cursor that counts and times its queries; pass it as the
+    'cursor_factory' of a connection.
+    """
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _count(db_queries=1, db_seconds=time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _count(db_queries=1, db_seconds=time.perf_counter() - start)
+
+
+def _counting_send(session, request, **kwargs):
+    resp = _session_send(session, request, **kwargs)
+    _count(http_requests=1,
+           http_bytes=(0 if kwargs.get("stream") else len(resp.content)))
+    return resp
+
+
+def start_profile(dsid):
+    """
+    Starts profiling a run for the dataset 'dsid' in the calling thread.
+    Queries are only counted on connections that use ProfilingCursor; all
+    requests made with the 'requests' package are counted.
+    """
+    global _num_profiles
+    _state.profile = Profile(dsid)
+    with _profiles_lock:
+        if _num_profiles == 0:
+            requests.Session.send = _counting_send
+
+        _num_profiles += 1
+
+
+def stop_profile():
+    """
+    Stops profiling the run in the calling thread and returns its Profile.
+    """
+    global _num_profiles
+    profile, _state.profile = _state.profile, None
+    with _profiles_lock:
+        _num_profiles -= 1
+        if _num_profiles == 0:
+            requests.Session.send = _session_send
+
+    profile.seconds = time.perf_counter() - profile.start
+    return profile
+
+
+def output_profile(profile, print_report, log_file):
+    """
+    Prints the report of 'profile' to stderr if 'print_report' is True, and
+    appends it to 'log_file' as a line of JSON if 'log_file' isn't None.
+    Profiles from several threads are output one at a time.
+    """
+    with _output_lock:
+        if print_report:
+            print(profile.report(), file=sys.stderr)
+
+        if log_file is not None:
+            with open(log_file, "a") as f:
+                f.write(profile.to_json() + "\n")
+
+
+def in_current_profile(func):
+    """
+    Returns a wrapper of 'func' that counts its queries and requests in the
+    profile of the calling thread, for running 'func' in another thread.
+    """
+    profile = getattr(_state, "profile", None)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        saved = getattr(_state, "profile", None)
+        _state.profile = profile
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _state.profile = saved
+
+    return wrapper
+
+
+@contextmanager
+def stage(name):
+    """
+    Records the code in the 'with' block as the stage 'name' of the current
+    profile. Does nothing when the run isn't being profiled.
+    """
+    profile = getattr(_state, "profile", None)
+    if profile is None:
+        yield
+        return
+
+    profile._path.append(name)
+    record = {'stage': "/".join(profile._path)}
+    profile.stages.append(record)
+    before = dict(profile.counters)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        for key in Profile.COUNTERS:
+            record[key] = profile.counters[key] - before[key]
+
+        profile._path.pop()
+
+
+def profiled(func):
+    """
+    Decorator that records each call of 'func' as a stage named after it.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -24,7 +24,57 @@ def unicode_escape(s):
     return s
 
 
+class WagtailUpdates:
+    """
+    Collects the wagtail column updates of a run so that they can be written
+    with one multi-column UPDATE per table, in a single transaction, by
+    flush(). Pass it to update_wagtail() in place of the connection. The
+    connection stays open and belongs to the caller.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        # the pending column values, keyed by (table, dsid)
+        self.pending = {}
+
+    def add(self, dsid, table, column, value):
+        self.pending.setdefault((table, dsid), {})[column] = value
+
+    def get(self, dsid, table, column):
+        """
+        Returns the pending value of 'column', or None if it hasn't been
+        updated since the last flush.
+        """
+        key = (table, dsid)
+        if key in self.pending and column in self.pending[key]:
+            return self.pending[key][column]
+
+        return None
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def flush(self):
+        cursor = self.conn.cursor()
+        try:
+            for (table, dsid), columns in self.pending.items():
+                cursor.execute((
+                        "update wagtail2." + table + " set " +
+                        ", ".join([column + " = %s" for column in columns]) +
+                        " where dsid = %s"), list(columns.values()) + [dsid])
+
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        self.pending.clear()
+
+
 def update_wagtail(dsid, table, column, insert_value, conn):
+    if isinstance(conn, WagtailUpdates):
+        conn.add(dsid, table, column, insert_value)
+        return
+
     conn.cursor().execute((
         "update wagtail2." + table + " set " + column + " = %s where dsid = "
         "%s"), (insert_value, dsid))
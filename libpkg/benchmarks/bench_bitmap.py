@@ -0,0 +1,46 @@
+"""
+Throughput of compress_bitmap_values and uncompress_bitmap_values.
+
+    python benchmarks/bench_bitmap.py [number of values]
+"""
+import random
+import sys
+import time
+
+from libpkg.dbutils import (CompressedBitmap, compress_bitmap_values,
+                            uncompress_bitmap_values)
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return (result, time.perf_counter() - start)
+
+
+def main(nvals):
+    rnd = random.Random(7)
+    vals = []
+    val = 1
+    for x in range(0, nvals):
+        val += rnd.choice([1, 1, 1, 2, 5])
+        vals.append(val)
+
+    bitmap, encode_time = _timed(compress_bitmap_values, vals)
+    decoded, decode_time = _timed(uncompress_bitmap_values, bitmap)
+    if list(decoded) != vals:
+        raise RuntimeError("the values did not round-trip")
+
+    print("{} values with small gaps: encode {:.3f}s, decode {:.3f}s, {} "
+          "chars".format(nvals, encode_time, decode_time, len(bitmap)))
+
+    # a union of overlapping bitmaps is encoded from its runs
+    merged = CompressedBitmap().union(*[
+            CompressedBitmap(compress_bitmap_values(range(s, s + 5000, 2)))
+            for s in range(0, nvals, 3000)])
+    bitmap, encode_time = _timed(compress_bitmap_values, merged)
+    print("merged CompressedBitmap of {} values: encode {:.4f}s, {} chars"
+          .format(len(merged), encode_time, len(bitmap)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,32 @@
+"""
+Time of fill_spatial_domain_from_lambert_conformal_grid for some large
+Lambert conformal grids.
+
+    python benchmarks/bench_lambert.py
+"""
+import time
+
+from libpkg.gridutils import fill_spatial_domain_from_lambert_conformal_grid
+
+
+GRIDS = [
+    ("HRRR", "1799:1059:21.138N:122.72W:38.5N:97.5W:N:3:3"),
+    ("NCEP 218", "614:428:12.19N:133.459W:25N:95W:N:12.191:12.191"),
+    ("NARR", "349:277:1N:145.5W:50N:107W:N:32.463:32.463"),
+    ("dateline", "500:500:1N:170E:60N:170W:N:40:40"),
+    ("pole", "400:400:10N:120W:80N:100W:N:60:60"),
+    ("stepped", "2500:2300:21.138N:122.72W:38.5N:97.5W:N:2:2"),
+]
+
+
+def main():
+    for name, gdef in GRIDS:
+        start = time.perf_counter()
+        domain = fill_spatial_domain_from_lambert_conformal_grid(
+                gdef.split(":"))
+        elapsed = time.perf_counter() - start
+        print("{:<9} {:.3f}s {}".format(name, elapsed, domain))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Mean time of uncompress_bitmap_values on synthetic bitmaps of 10^3 to 10^7
+values, with repeat sections and groups.
+
+    python benchmarks/bench_uncompress.py
+"""
+import random
+import time
+
+from libpkg.dbutils import uncompress_bitmap_values
+
+
+def synthetic_bitmap(nvals, seed=1):
+    # a random mix of single bits, runs of '1' bits, runs of '0' bits and
+    #   '0's followed by a '1', then one of each kind of repeat section
+    rnd = random.Random(seed)
+    bits = []
+    n = 0
+    while n < nvals:
+        r = rnd.random()
+        if r < 0.3:
+            # 2-26 '1' bits
+            nbits = rnd.randint(2, 26)
+            bits.append(chr(ord('A') + nbits - 2))
+            n += nbits
+        elif r < 0.5:
+            bits.append("1")
+            n += 1
+        elif r < 0.6:
+            bits.append("0")
+        elif r < 0.75:
+            # 2-26 '0' bits
+            bits.append(chr(ord('a') + rnd.randint(0, 24)))
+        else:
+            # one '0' bit and then a '1' bit
+            bits.append("2")
+            n += 1
+
+    return "{}:{}-{}/1A2-{}/{{AB3x}}C1-{}/a".format(
+            rnd.randint(0, 1000), "".join(bits), rnd.randint(1, 50),
+            rnd.randint(1, 50), rnd.randint(1, 50))
+
+
+def main():
+    for nvals in (10**3, 10**4, 10**5, 10**6, 10**7):
+        bitmap = synthetic_bitmap(nvals)
+        reps = max(1, 10**6 // nvals)
+        start = time.perf_counter()
+        for x in range(0, reps):
+            uncompress_bitmap_values(bitmap)
+
+        print("{:>9} values: {:.5f}s".format(
+                nvals, (time.perf_counter() - start) / reps))
+
+    start = time.perf_counter()
+    for x in range(0, 100000):
+        uncompress_bitmap_values("5:1A2")
+
+    print("tiny bitmap x100000: {:.3f}s".format(time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
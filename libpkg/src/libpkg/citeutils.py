@@ -0,0 +1,216 @@
+import collections
+import threading
+import time
+
+
+CitationWork = collections.namedtuple("CitationWork", (
+        "title", "pub_year", "type", "publisher", "authors", "journal",
+        "proceedings", "book_chapter"))
+BookChapter = collections.namedtuple("BookChapter", (
+        "pages", "title", "publisher", "editors"))
+
+# the oldest transaction that was still running when the query started, as
+#   the 32-bit ID that is stored in the xmin of each row
+_SNAPSHOT_XID = (
+        "select txid_snapshot_xmin(txid_current_snapshot()) % 4294967296")
+# the DOIs of the works with a row that was inserted or updated by a
+#   transaction at or after %(xid)s; the citation tables don't have a
+#   modification time, so the row version (xmin) is used instead
+_CHANGED_WORKS = (
+        "select doi from citation.works where xmin::text::bigint >= %(xid)s "
+        "union select id from citation.works_authors where id_type = 'DOI' "
+        "and xmin::text::bigint >= %(xid)s union select doi from citation."
+        "journal_works where xmin::text::bigint >= %(xid)s union select doi "
+        "from citation.proceedings_works where xmin::text::bigint >= %(xid)s "
+        "union select c.doi from citation.book_chapter_works as c left join "
+        "citation.book_works as b on b.isbn = c.isbn where c.xmin::text::"
+        "bigint >= %(xid)s or b.xmin::text::bigint >= %(xid)s or c.isbn in "
+        "(select id from citation.works_authors where id_type = 'ISBN' and "
+        "xmin::text::bigint >= %(xid)s)")
+# the DOIs of the works that cite the dataset %(dsid)s
+CITING_DOIS = (
+        "select distinct d.doi_work from citation.data_citations_gdex as d "
+        "left join dssdb.dsvrsn as v on v.doi = d.doi_data where v.dsid = "
+        "%(dsid)s")
+
+
+def load_citation_works(cursor, dois=None):
+    """
+    Returns a dictionary of the works with the DOIs in the list 'dois' (or
+    of all works if 'dois' is None), keyed by DOI. Each work is a
+    CitationWork:
+        title, pub_year, type, publisher: from citation.works
+        authors: the (last name, first name, middle name, ORCID iD) of each
+                 author, in order
+        journal: the (publication name, volume, pages) of a journal article,
+                 or None
+        proceedings: the (publication name, pages) of a proceedings paper, or
+                     None
+        book_chapter: the BookChapter of a book chapter, with its 'pages' and
+                      the 'title', 'publisher' and 'editors' (first name,
+                      middle name, last name) of its book, or None
+
+    Each kind of data is loaded for all of the works in one query.
+    """
+    if dois is None:
+        where, params = "true", ()
+    else:
+        where, params = "{} = any(%s)", (dois, )
+
+    works = {}
+    cursor.execute((
+            "select doi, title, pub_year, type, publisher from citation.works "
+            "where " + where.format("doi")), params)
+    for doi, title, pub_year, type, publisher in cursor.fetchall():
+        if doi not in works:
+            works[doi] = [title, pub_year, type, publisher, [], None, None,
+                          None]
+
+    cursor.execute((
+            "select id, last_name, first_name, middle_name, orcid_id from "
+            "citation.works_authors where " + where.format("id") + " and "
+            "id_type = 'DOI' order by id, sequence"), params)
+    for e in cursor.fetchall():
+        if e[0] in works:
+            works[e[0]][4].append(e[1:])
+
+    cursor.execute((
+            "select doi, pub_name, volume, pages from citation.journal_works "
+            "where " + where.format("doi")), params)
+    for e in cursor.fetchall():
+        if e[0] in works and works[e[0]][5] is None:
+            works[e[0]][5] = e[1:]
+
+    cursor.execute((
+            "select doi, pub_name, pages from citation.proceedings_works "
+            "where " + where.format("doi")), params)
+    for e in cursor.fetchall():
+        if e[0] in works and works[e[0]][6] is None:
+            works[e[0]][6] = e[1:]
+
+    cursor.execute((
+            "select c.doi, c.pages, c.isbn, b.title, b.publisher from "
+            "citation.book_chapter_works as c join citation.book_works as b "
+            "on b.isbn = c.isbn where " + where.format("c.doi")), params)
+    chapters = []
+    books = {}
+    for doi, pages, isbn, title, publisher in cursor.fetchall():
+        if doi in works and works[doi][7] is None:
+            works[doi][7] = isbn
+            chapters.append((doi, pages, isbn, title, publisher))
+            books[isbn] = []
+
+    if dois is not None:
+        params = (list(books), )
+
+    cursor.execute((
+            "select id, first_name, middle_name, last_name from citation."
+            "works_authors where " + where.format("id") + " and id_type = "
+            "'ISBN' order by id, sequence"), params)
+    for e in cursor.fetchall():
+        if e[0] in books:
+            books[e[0]].append(e[1:])
+
+    # the chapters of a book share its editors
+    books = {isbn: tuple(editors) for isbn, editors in books.items()}
+    for doi, pages, isbn, title, publisher in chapters:
+        works[doi][7] = BookChapter(pages, title, publisher, books[isbn])
+
+    for doi, work in works.items():
+        work[4] = tuple(work[4])
+        works[doi] = CitationWork(*work)
+
+    return works
+
+
+def get_citing_dois(dsid, cursor):
+    """
+    Returns the DOIs of the works that cite the dataset 'dsid'.
+    """
+    cursor.execute(CITING_DOIS, {'dsid': dsid})
+    return [e[0] for e in cursor.fetchall()]
+
+
+class CitationIndex:
+    """
+    All of the works in the citation schema, keyed by DOI, for sharing
+    between the datasets of a batch (and its threads). The first refresh()
+    loads every work and later ones only reload the works with rows that
+    were added or changed since the one before. Deleted rows aren't noticed
+    until the index is rebuilt.
+    """
+    def __init__(self, max_age=300):
+        # the number of seconds after which get_works() refreshes the index
+        self.max_age = max_age
+        self.works = {}
+        self._xid = None
+        self._refreshed = None
+        self._lock = threading.Lock()
+
+    def _is_stale(self):
+        return (self._refreshed is None or time.monotonic() - self._refreshed
+                > self.max_age)
+
+    def refresh(self, cursor):
+        with self._lock:
+            self._refresh(cursor)
+
+    def _refresh(self, cursor):
+        cursor.execute(_SNAPSHOT_XID)
+        xid, = cursor.fetchone()
+        # a full load the first time, and when the transaction ID has
+        #   wrapped around
+        if self._xid is None or xid < self._xid:
+            self.works = load_citation_works(cursor)
+        else:
+            cursor.execute(_CHANGED_WORKS, {'xid': self._xid})
+            dois = [e[0] for e in cursor.fetchall()]
+            if len(dois) > 0:
+                works = load_citation_works(cursor, dois)
+                for doi in dois:
+                    if doi in works:
+                        self.works[doi] = works[doi]
+                    else:
+                        self.works.pop(doi, None)
+
+        self._xid = xid
+        self._refreshed = time.monotonic()
+
+    def get_works(self, dois, cursor):
+        """
+        Returns a dictionary of the indexed works with the DOIs in the list
+        'dois', keyed by DOI, after refreshing the index with 'cursor' if it
+        is more than 'max_age' seconds old.
+        """
+        if self._is_stale():
+            with self._lock:
+                # another thread may have refreshed it while this one waited
+                if self._is_stale():
+                    self._refresh(cursor)
+
+        works = self.works
+        return {doi: works[doi] for doi in dois if doi in works}
+
+
+def get_citation_works(dsid, cursor, **kwargs):
+    """
+    Returns the (DOI, CitationWork) of each work that cites the dataset
+    'dsid'.
+
+    Optional keyword arguments:
+        citation_index: a CitationIndex to take the works from, instead of
+                        loading them from the database
+        citing_dois: the already-loaded DOIs of the citing works (e.g.
+                     DatasetSnapshot.citing_dois)
+    """
+    if 'citing_dois' in kwargs and kwargs['citing_dois'] is not None:
+        dois = kwargs['citing_dois']
+    else:
+        dois = get_citing_dois(dsid, cursor)
+
+    if 'citation_index' in kwargs and kwargs['citation_index'] is not None:
+        works = kwargs['citation_index'].get_works(dois, cursor)
+    else:
+        works = load_citation_works(cursor, dois)
+
+    return [(doi, works[doi]) for doi in dois if doi in works]
@@ -1,49 +1,157 @@
-def decode_bit(bit, next_val, mult, mult_len):
-    if bit == '0':
-        # bit '0' is a 'skip' bit
-        return (next_val + 1, [])
+import numpy as np
+import psycopg2
+import psycopg2.pool
+import re
 
-    bias = mult * mult_len
-    if bit == '1':
-        # bit '1' is a 'next_val' bit
-        return (next_val + 1, [next_val - bias])
+from array import array
+from bisect import bisect_right
+from itertools import islice
 
-    bit = ord(bit)
-    if bit in range(ord('A'), ord('Z')):
-        # sequence of 2-27 '1' bits
-        nvals = bit - 63
-        v = []
-        for x in range(0, nvals):
-            v.append(next_val - bias)
-            next_val += 1
 
-        return (next_val, v)
+def _build_bit_opcodes():
+    # each entry is a tuple of (number of '0' bits to skip, number of '1' bits
+    #   that follow) for the character with that ordinal; invalid characters
+    #   are None
+    opcodes = [None] * 256
+    # bit '0' is a 'skip' bit
+    opcodes[ord('0')] = (1, 0)
+    # bit '1' is a 'next_val' bit
+    opcodes[ord('1')] = (0, 1)
+    for bit in range(ord('A'), ord('Z') + 1):
+        # sequence of 2-27 '1' bits
+        opcodes[bit] = (0, bit - 63)
 
-    if bit in range(ord('a'), ord('z')):
+    for bit in range(ord('a'), ord('z') + 1):
         # sequence of 2-27 '0' bits
-        return (next_val + bit - 95, [])
+        opcodes[bit] = (bit - 95, 0)
 
-    if bit in range(ord('2'), ord('9')):
+    for bit in range(ord('2'), ord('9') + 1):
         # sequence of 1-8 '0' bits, then a '1' bit
-        next_val += bit - 49
-        return (next_val + 1, [next_val - bias])
+        opcodes[bit] = (bit - 49, 1)
 
-    if bit in range(ord('!'), ord(',')):
+    for bit in range(ord('!'), ord(',') + 1):
         # sequence of 9-20 '0' bits, then a '1' bit
-        next_val += bit - 24
-        return (next_val + 1, [next_val - bias])
+        opcodes[bit] = (bit - 24, 1)
 
-    if bit in range(ord(';'), ord('@')):
+    for bit in range(ord(';'), ord('@') + 1):
         # sequence of 21-26 '0' bits, then a '1' bit
-        next_val += bit - 38
-        return (next_val + 1, [next_val - bias])
+        opcodes[bit] = (bit - 38, 1)
+
+    # sequence of 27 '0' bits, then a '1' bit
+    opcodes[ord('.')] = (27, 1)
+    return opcodes
+
+
+_BIT_OPCODES = _build_bit_opcodes()
+_BIT_VALID = np.array([op is not None for op in _BIT_OPCODES])
+_BIT_SKIPS = np.array([op[0] if op else 0 for op in _BIT_OPCODES],
+                      dtype=np.int64)
+_BIT_COUNTS = np.array([op[1] if op else 0 for op in _BIT_OPCODES],
+                       dtype=np.int64)
+# strings of bits shorter than this are cheaper to decode one at a time than
+#   to hand off to numpy
+_MIN_VECTORIZED_BITS = 128
+
+
+def _opcode(bit):
+    code = ord(bit)
+    op = _BIT_OPCODES[code] if code < 256 else None
+    if op is None:
+        raise ValueError("invalid bit '{}' for decode".format(bit))
+
+    return op
+
+
+def _bit_codes(bits):
+    try:
+        return bits.encode("latin-1")
+    except UnicodeEncodeError:
+        raise ValueError("invalid bit in '{}' for decode".format(bits))
+
+
+def _decode_codes(codes, next_val, mult, vals, mult_len):
+    # vectorized decode of a string of bits (as bytes) into 'vals'; returns the
+    #   new next_val
+    codes = np.frombuffer(codes, dtype=np.uint8)
+    valid = _BIT_VALID[codes]
+    if not valid.all():
+        code = codes[np.argmin(valid)]
+        raise ValueError("invalid bit '{}' for decode".format(chr(code)))
+
+    nbits = _BIT_COUNTS[codes]
+    ends = np.cumsum(_BIT_SKIPS[codes] + nbits) + next_val
+    has_bits = nbits > 0
+    starts = (ends - nbits)[has_bits]
+    nbits = nbits[has_bits]
+    nvals = int(nbits.sum())
+    if nvals > 0:
+        # number of values decoded before each bit that has values
+        nprev = np.cumsum(nbits) - nbits
+        if mult != 0:
+            starts -= mult * ((len(vals) + nprev) if mult_len is None else
+                              mult_len)
+
+        v = np.repeat(starts - nprev, nbits) + np.arange(nvals)
+        vals.frombytes(v.astype("=i8", copy=False).tobytes())
+
+    return int(ends[-1])
+
+
+def _decode_bits(bits, next_val, mult, vals, mult_len=None):
+    # decodes the string of bits into 'vals' and returns the new next_val; the
+    #   bias for each value uses the length of 'vals' at the start of its bit,
+    #   unless 'mult_len' fixes it (as it does for a bitmap group)
+    codes = _bit_codes(bits)
+    if len(codes) > 0 and len(codes) >= _MIN_VECTORIZED_BITS:
+        return _decode_codes(codes, next_val, mult, vals, mult_len)
+
+    opcodes = _BIT_OPCODES
+    for code in codes:
+        op = opcodes[code]
+        if op is None:
+            raise ValueError("invalid bit '{}' for decode".format(chr(code)))
 
-    if bit == '.':
-        # sequence of 27 '0' bits, then a '1' bit
-        next_val += bit - 19
-        return (next_val + 1, [next_val - bias])
+        skip, nbits = op
+        next_val += skip
+        if nbits > 0:
+            val = next_val
+            if mult != 0:
+                val -= mult * (len(vals) if mult_len is None else mult_len)
 
-    raise ValueError("invalid bit '{}' for decode".format(chr(bit)))
+            if nbits == 1:
+                vals.append(val)
+            else:
+                vals.extend(range(val, val + nbits))
+
+            next_val += nbits
+
+    return next_val
+
+
+def _decode_repeated_group(group, repeat, next_val, mult, vals):
+    # every repeat of a group decodes to the first repeat shifted by a fixed
+    #   amount, so decode it once and tile it
+    if repeat <= 0:
+        return next_val
+
+    nprev = len(vals)
+    end_val = _decode_bits(group, next_val, mult, vals, mult_len=nprev)
+    if repeat == 1 or len(vals) == nprev:
+        return next_val + (end_val - next_val) * repeat
+
+    first = np.array(vals[nprev:], dtype=np.int64)
+    shift = (end_val - next_val) - mult * len(first)
+    tiled = (np.arange(1, repeat, dtype=np.int64)[:, np.newaxis] * shift +
+             first).ravel()
+    vals.frombytes(tiled.astype("=i8", copy=False).tobytes())
+    return next_val + (end_val - next_val) * repeat
+
+
+def decode_bit(bit, next_val, mult, mult_len):
+    skip, nbits = _opcode(bit)
+    next_val += skip
+    val = next_val - mult * mult_len
+    return (next_val + nbits, list(range(val, val + nbits)))
 
 
 def decode_group(bitgrp, next_val, mult, mult_len):
@@ -56,38 +164,24 @@ def decode_group(bitgrp, next_val, mult, mult_len):
     else:
         raise ValueError("malformed bitmap group '{}'".format(bitgrp))
 
-    vals = []
-    for x in range(0, repeat):
-        next_val, v = decode_bit(parts[0][0], next_val, mult, mult_len)
-        vals.extend(v)
+    vals = array('q')
+    next_val = _decode_bits(parts[0][0] * repeat + parts[0][1:], next_val,
+                            mult, vals, mult_len=mult_len)
+    return (next_val, vals.tolist())
 
-    for bit in parts[0][1:]:
-        next_val, v = decode_bit(bit, next_val, mult, mult_len)
-        vals.extend(v)
 
-    return (next_val, vals)
-
-
-def uncompress_bitmap_values(bitmap):
-    vals = []
+def _parse_bitmap(bitmap):
+    # splits a compressed bitmap into its first value, its multiplier and a
+    #   list of (bits, repeat, is_group) segments, where 'bits' is decoded
+    #   'repeat' times in a row
     start = bitmap.find(":")
-    if start < 0:
-        if bitmap[0] == '!':
-            parts = bitmap[1:].split(",")
-            vals = [int(part) for part in parts]
-
-        return vals
-
     parts = bitmap[0:start].split("<N>")
     next_val = int(parts[0])
     mult = int(parts[1]) if len(parts) > 1 else 0
+    segments = []
     sects = bitmap.split("-")
     if sects[0][0] != ':':
-        sect = sects[0][start+1:]
-        for bit in sect:
-            next_val, v = decode_bit(bit, next_val, mult, len(vals))
-            vals.extend(v)
-
+        segments.append((sects[0][start+1:], 1, False))
         del sects[0]
 
     for sect in sects:
@@ -95,29 +189,558 @@ def uncompress_bitmap_values(bitmap):
         if len(parts) != 2:
             raise ValueError("malformed bitmap group in bitmap '{}'".format(bitmap))
 
-        if len(parts) == 3:
-            parts[1] += "/" + parts[2]
-
         repeat = int(parts[0])
         if parts[1][0] == '{':
             idx = parts[1].find("}")
             if idx < 0:
                 raise ValueError("missing end-of-group delimiter in bitmap '{}'".format(bitmap))
 
-            for x in range(0, repeat):
-                next_val, v = decode_group(parts[1][1:idx-1], next_val, mult, len(vals))
-                vals.extend(v)
-
+            segments.append((parts[1][1:idx], repeat, True))
             bsect = parts[1][idx+1:]
         else:
-            for x in range(0, repeat):
-                next_val, v = decode_bit(parts[1][0], next_val, mult, len(vals))
-                vals.extend(v)
+            if repeat > 0:
+                segments.append((parts[1][0], repeat, False))
 
             bsect = parts[1][1:]
 
-        for bit in bsect:
-            next_val, v = decode_bit(bit, next_val, mult, len(vals))
-            vals.extend(v)
+        segments.append((bsect, 1, False))
+
+    return (next_val, mult, segments)
+
+
+def uncompress_bitmap_values(bitmap):
+    vals = array('q')
+    if bitmap.find(":") < 0:
+        if bitmap[0] == '!':
+            parts = bitmap[1:].split(",")
+            vals.extend(int(part) for part in parts)
+
+        return vals
+
+    next_val, mult, segments = _parse_bitmap(bitmap)
+    for bits, repeat, is_group in segments:
+        if is_group:
+            next_val = _decode_repeated_group(bits, repeat, next_val, mult,
+                                              vals)
+        elif repeat > 0:
+            next_val = _decode_bits(bits * repeat, next_val, mult, vals)
 
     return vals
+
+
+def _iter_bits(bits, repeat, next_val, mult, nvals):
+    # yields the values for the string of bits, repeated 'repeat' times;
+    #   returns the new next_val and value count
+    opcodes = [_opcode(bit) for bit in bits]
+    for x in range(0, repeat):
+        for skip, nbits in opcodes:
+            next_val += skip
+            if nbits > 0:
+                val = next_val - mult * nvals
+                yield from range(val, val + nbits)
+                nvals += nbits
+                next_val += nbits
+
+    return (next_val, nvals)
+
+
+def iter_bitmap_values(bitmap):
+    """
+    Yields the same values as uncompress_bitmap_values, in the same order, as
+    they are decoded. Only one bitmap group at a time is held in memory, so
+    this suits bitmaps that cover a very large number of values.
+    """
+    if bitmap.find(":") < 0:
+        if bitmap[0] == '!':
+            for part in bitmap[1:].split(","):
+                yield int(part)
+
+        return
+
+    next_val, mult, segments = _parse_bitmap(bitmap)
+    nvals = 0
+    for bits, repeat, is_group in segments:
+        if repeat <= 0:
+            continue
+
+        if is_group:
+            # every repeat of a group is the first one shifted by a fixed
+            #   amount
+            group = array('q')
+            end_val = _decode_bits(bits, next_val, mult, group,
+                                   mult_len=nvals)
+            span = end_val - next_val
+            shift = span - mult * len(group)
+            for x in range(0, repeat):
+                for val in group:
+                    yield val + shift * x
+
+            next_val += span * repeat
+            nvals += len(group) * repeat
+        else:
+            next_val, nvals = yield from _iter_bits(bits, repeat, next_val,
+                                                    mult, nvals)
+
+
+def create_connection_pool(db_settings, minconn=1, maxconn=8):
+    """
+    Returns a thread-safe pool of connections to the database described by
+    the psycopg2 connection settings 'db_settings'. A pool can be passed to
+    the metaformats exporters in place of the settings, so that a batch of
+    exports reuses the same connections.
+    """
+    try:
+        return psycopg2.pool.ThreadedConnectionPool(minconn, maxconn,
+                                                    **db_settings)
+    except psycopg2.Error as err:
+        raise RuntimeError("database connection error: '{}'".format(err))
+
+
+def get_connection(db, name="database"):
+    """
+    Returns an open connection for 'db', which is one of:
+        - a dictionary of psycopg2 connection settings: a new connection is
+          opened
+        - a psycopg2 connection pool: a connection is taken from the pool
+        - an open psycopg2 connection: it is returned as is
+
+    'name' identifies the database in the RuntimeError raised when the
+    connection fails. Hand the connection back with put_connection() when
+    done with it.
+    """
+    if isinstance(db, psycopg2.extensions.connection):
+        return db
+
+    try:
+        if isinstance(db, psycopg2.pool.AbstractConnectionPool):
+            return db.getconn()
+
+        return psycopg2.connect(**db)
+    except psycopg2.Error as err:
+        raise RuntimeError("{} database connection error: '{}'"
+                           .format(name, err))
+
+
+def put_connection(conn, db):
+    """
+    Hands back a connection that get_connection() returned for 'db': a
+    connection from a pool goes back to the pool, a connection opened from
+    settings is closed and a connection passed in as 'db' is left open.
+    """
+    if conn is db:
+        return
+
+    if isinstance(db, psycopg2.pool.AbstractConnectionPool):
+        db.putconn(conn)
+    else:
+        conn.close()
+
+
+def get_grid_definitions(cursor, codes, chunk_size=5000):
+    """
+    Yields a (code, (definition, def_params)) tuple from
+    "WGrML".grid_definitions for each of the integer 'codes' (e.g. a
+    CompressedBitmap) that has a grid definition, in the order of 'codes'.
+    The codes are looked up 'chunk_size' at a time, in one query per chunk.
+    """
+    codes = iter(codes)
+    while True:
+        chunk = [int(code) for code in islice(codes, chunk_size)]
+        if len(chunk) == 0:
+            break
+
+        cursor.execute((
+                'select code, definition, def_params from "WGrML".'
+                'grid_definitions where code = any(%s)'), (chunk, ))
+        gdefs = {e[0]: (e[1], e[2]) for e in cursor.fetchall()}
+        for code in chunk:
+            if code in gdefs:
+                yield (code, gdefs[code])
+
+
+def _append_run(starts, stops, start, stop):
+    if len(stops) > 0 and stops[-1] == start:
+        stops[-1] = stop
+    else:
+        starts.append(start)
+        stops.append(stop)
+
+
+def _decode_bit_runs(bits, next_val, mult, nvals, starts, stops,
+                     mult_len=None):
+    # like _decode_bits, but appends [start, stop) runs of values instead of
+    #   the values themselves; returns the new next_val and value count
+    codes = _bit_codes(bits)
+    if len(codes) > 0 and len(codes) >= _MIN_VECTORIZED_BITS:
+        return _decode_code_runs(codes, next_val, mult, nvals, starts, stops,
+                                 mult_len)
+
+    opcodes = _BIT_OPCODES
+    last_stop = stops[-1] if len(stops) > 0 else None
+    for code in codes:
+        op = opcodes[code]
+        if op is None:
+            raise ValueError("invalid bit '{}' for decode".format(chr(code)))
+
+        skip, nbits = op
+        next_val += skip
+        if nbits > 0:
+            val = next_val
+            if mult != 0:
+                val -= mult * (nvals if mult_len is None else mult_len)
+
+            if val == last_stop:
+                stops[-1] = last_stop = val + nbits
+            else:
+                starts.append(val)
+                stops.append(val + nbits)
+                last_stop = val + nbits
+
+            nvals += nbits
+            next_val += nbits
+
+    return (next_val, nvals)
+
+
+def _decode_code_runs(codes, next_val, mult, nvals, starts, stops, mult_len):
+    # vectorized version of _decode_bit_runs
+    codes = np.frombuffer(codes, dtype=np.uint8)
+    valid = _BIT_VALID[codes]
+    if not valid.all():
+        code = codes[np.argmin(valid)]
+        raise ValueError("invalid bit '{}' for decode".format(chr(code)))
+
+    nbits = _BIT_COUNTS[codes]
+    ends = np.cumsum(_BIT_SKIPS[codes] + nbits) + next_val
+    has_bits = nbits > 0
+    rstops = ends[has_bits]
+    nbits = nbits[has_bits]
+    if len(nbits) > 0:
+        if mult != 0:
+            rstops -= mult * ((nvals + np.cumsum(nbits) - nbits) if mult_len
+                              is None else mult_len)
+
+        _append_runs(starts, stops, rstops - nbits, rstops)
+
+    return (int(ends[-1]), nvals + int(nbits.sum()))
+
+
+def _append_runs(starts, stops, rstarts, rstops):
+    # appends numpy arrays of [start, stop) runs, merging any that touch
+    new_run = np.ones(len(rstarts), dtype=bool)
+    new_run[1:] = rstarts[1:] != rstops[:-1]
+    first = np.flatnonzero(new_run)
+    last = np.append(first[1:] - 1, len(rstarts) - 1)
+    rstarts = rstarts[first]
+    rstops = rstops[last]
+    if len(stops) > 0 and stops[-1] == rstarts[0]:
+        stops[-1] = int(rstops[0])
+        rstarts = rstarts[1:]
+        rstops = rstops[1:]
+
+    starts.frombytes(rstarts.astype("=i8", copy=False).tobytes())
+    stops.frombytes(rstops.astype("=i8", copy=False).tobytes())
+
+
+def _coalesce_runs(starts, stops):
+    # sorts [start, stop) runs and merges any that overlap or touch
+    starts = np.asarray(starts, dtype=np.int64)
+    stops = np.asarray(stops, dtype=np.int64)
+    if len(starts) == 0:
+        return (array('q'), array('q'))
+
+    order = np.argsort(starts, kind="stable")
+    starts = starts[order]
+    stops = np.maximum.accumulate(stops[order])
+    new_run = np.ones(len(starts), dtype=bool)
+    new_run[1:] = starts[1:] > stops[:-1]
+    first = np.flatnonzero(new_run)
+    last = np.append(first[1:] - 1, len(starts) - 1)
+    return (array('q', starts[first].astype("=i8").tobytes()),
+            array('q', stops[last].astype("=i8").tobytes()))
+
+
+class CompressedBitmap:
+    """
+    A set of integer values (e.g. grid definition codes) held as sorted,
+    non-overlapping [start, stop) runs, so that set operations cost time in
+    proportion to the number of runs instead of the number of values.
+
+    CompressedBitmap(bitmap) parses a compressed bitmap string in the format
+    understood by uncompress_bitmap_values without expanding it.
+    """
+
+    def __init__(self, bitmap=None):
+        self._starts = array('q')
+        self._stops = array('q')
+        if bitmap is None:
+            return
+
+        if bitmap.find(":") < 0:
+            if bitmap[0] == '!':
+                vals = np.array([int(part) for part in bitmap[1:].split(",")],
+                                dtype=np.int64)
+                self._starts, self._stops = _coalesce_runs(vals, vals + 1)
+
+            return
+
+        next_val, mult, segments = _parse_bitmap(bitmap)
+        starts = array('q')
+        stops = array('q')
+        nvals = 0
+        for bits, repeat, is_group in segments:
+            if repeat <= 0:
+                continue
+
+            if is_group:
+                # each repeat is the first one shifted by a fixed amount
+                gstarts = array('q')
+                gstops = array('q')
+                end_val, gvals = _decode_bit_runs(bits, next_val, mult, 0,
+                                                  gstarts, gstops,
+                                                  mult_len=nvals)
+                span = end_val - next_val
+                shift = span - mult * gvals
+                for x in range(0, repeat):
+                    for start, stop in zip(gstarts, gstops):
+                        _append_run(starts, stops, start + shift * x,
+                                    stop + shift * x)
+
+                next_val += span * repeat
+                nvals += gvals * repeat
+            elif repeat == 1 or mult != 0:
+                next_val, nvals = _decode_bit_runs(
+                        bits * repeat, next_val, mult, nvals, starts, stops)
+            else:
+                skip, nbits = _opcode(bits)
+                if skip == 0:
+                    _append_run(starts, stops, next_val,
+                                next_val + nbits * repeat)
+                elif nbits > 0:
+                    for x in range(0, repeat):
+                        start = next_val + (skip + nbits) * x + skip
+                        _append_run(starts, stops, start, start + nbits)
+
+                next_val += (skip + nbits) * repeat
+                nvals += nbits * repeat
+
+        if mult == 0:
+            self._starts, self._stops = starts, stops
+        else:
+            # a multiplier can make the values decrease
+            self._starts, self._stops = _coalesce_runs(starts, stops)
+
+    @classmethod
+    def from_runs(cls, runs):
+        runs = [(start, stop) for start, stop in runs if stop > start]
+        bitmap = cls()
+        if len(runs) > 0:
+            starts, stops = zip(*runs)
+            bitmap._starts, bitmap._stops = _coalesce_runs(starts, stops)
+
+        return bitmap
+
+    @classmethod
+    def from_values(cls, values):
+        vals = np.sort(np.fromiter(values, dtype=np.int64))
+        bitmap = cls()
+        if len(vals) > 0:
+            vals = vals[np.append(True, vals[1:] != vals[:-1])]
+            new_run = np.ones(len(vals), dtype=bool)
+            new_run[1:] = np.diff(vals) != 1
+            first = np.flatnonzero(new_run)
+            last = np.append(first[1:] - 1, len(vals) - 1)
+            bitmap._starts = array('q', vals[first].astype("=i8").tobytes())
+            bitmap._stops = array('q',
+                                  (vals[last] + 1).astype("=i8").tobytes())
+
+        return bitmap
+
+    def runs(self):
+        return zip(self._starts, self._stops)
+
+    def union(self, *others):
+        bitmaps = [self] + list(others)
+        bitmap = type(self)()
+        bitmap._starts, bitmap._stops = _coalesce_runs(
+                np.concatenate([np.frombuffer(b._starts, dtype=np.int64) for b
+                                in bitmaps]),
+                np.concatenate([np.frombuffer(b._stops, dtype=np.int64) for b
+                                in bitmaps]))
+        return bitmap
+
+    def intersection(self, *others):
+        bitmap = self
+        for other in others:
+            starts = array('q')
+            stops = array('q')
+            m, n = 0, 0
+            while m < len(bitmap._starts) and n < len(other._starts):
+                start = max(bitmap._starts[m], other._starts[n])
+                stop = min(bitmap._stops[m], other._stops[n])
+                if start < stop:
+                    _append_run(starts, stops, start, stop)
+
+                if bitmap._stops[m] < other._stops[n]:
+                    m += 1
+                else:
+                    n += 1
+
+            bitmap = type(self)()
+            bitmap._starts, bitmap._stops = starts, stops
+
+        if bitmap is self:
+            bitmap = type(self)()
+            bitmap._starts, bitmap._stops = array('q', self._starts), array(
+                    'q', self._stops)
+
+        return bitmap
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __contains__(self, value):
+        idx = bisect_right(self._starts, value) - 1
+        return idx >= 0 and value < self._stops[idx]
+
+    def __iter__(self):
+        for start, stop in self.runs():
+            yield from range(start, stop)
+
+    def __len__(self):
+        return sum(self._stops) - sum(self._starts)
+
+    def __bool__(self):
+        return len(self._starts) > 0
+
+    def __eq__(self, other):
+        if not isinstance(other, CompressedBitmap):
+            return NotImplemented
+
+        return (self._starts == other._starts and
+                self._stops == other._stops)
+
+    def __repr__(self):
+        return "{}.from_runs({})".format(type(self).__name__,
+                                         list(self.runs()))
+
+
+# inverse of _BIT_OPCODES: the bit for each (skip, ones) tuple
+_BIT_CHARS = {op: chr(code) for code, op in enumerate(_BIT_OPCODES) if op is
+              not None}
+# the bit for a gap of 0-27 '0' bits followed by a '1' bit, and the bit for
+#   0-27 '1' bits, as ordinals; 0 is no bit
+_GAP_CODES = np.array([0] + [ord(_BIT_CHARS[(n, 1)]) for n in range(1, 28)],
+                      dtype=np.uint8)
+_ONES_CODES = np.array([0] + [ord(_BIT_CHARS[(0, n)]) for n in range(1, 28)],
+                       dtype=np.uint8)
+# a unit of up to 16 bits that repeats at least three times in a row
+_REPEATED_BITS = re.compile(r"(.{1,16}?)\1{2,}", re.DOTALL)
+
+
+def _encode_bits(nbits, bit, one):
+    # encodes a sequence of 'nbits' '0' or '1' bits, where 'bit' is the bit
+    #   for 27 of them; long sequences become a repeat section
+    nmax, nrem = divmod(nbits, 27)
+    bits = ""
+    if nmax > 0:
+        sect = "-{}/{}".format(nmax, bit)
+        bits = sect if len(sect) < nmax else bit * nmax
+
+    if nrem > 0:
+        bits += _BIT_CHARS[(0, nrem) if one else (nrem, 0)]
+
+    return bits
+
+
+def _compress_repeats(bits):
+    # replaces runs of a repeated bit or group of bits with repeat sections
+    #   wherever that makes the bitmap shorter
+    sects = []
+    pos = 0
+    for m in _REPEATED_BITS.finditer(bits):
+        unit = m.group(1)
+        sect = "-{}/{}".format(len(m.group(0)) // len(unit), unit if len(unit)
+                               == 1 else "{" + unit + "}")
+        if len(sect) < len(m.group(0)):
+            sects.append(bits[pos:m.start()])
+            sects.append(sect)
+            pos = m.end()
+
+    sects.append(bits[pos:])
+    return "".join(sects)
+
+
+def _encode_run(gap, ones):
+    # encodes a run of 'ones' values that follows 'gap' skipped values; returns
+    #   a list of literal bits and repeat sections
+    bits = []
+    if gap > 0:
+        # the last (up to 27) '0' bits share a bit with the first '1' bit
+        nlast = gap % 27 or 27
+        bits.append(_encode_bits(gap - nlast, 'z', False))
+        bits.append(_BIT_CHARS[(nlast, 1)])
+        ones -= 1
+
+    bits.append(_encode_bits(ones, 'Z', True))
+    return bits
+
+
+def compress_bitmap_values(values):
+    """
+    Returns the compressed bitmap for a set of integer values, such that
+    uncompress_bitmap_values returns the values in ascending order with
+    duplicates removed. 'values' can be any iterable of integers or a
+    CompressedBitmap, which is encoded without expanding it.
+
+    Sparse sets of values are written as an explicit list ('!a,b,c') when
+    that is shorter than the bitmap.
+    """
+    if not isinstance(values, CompressedBitmap):
+        values = CompressedBitmap.from_values(values)
+
+    starts = np.frombuffer(values._starts, dtype=np.int64)
+    stops = np.frombuffer(values._stops, dtype=np.int64)
+    if len(starts) == 0:
+        return "0:"
+
+    if starts[0] < 0:
+        # the bitmap format has no room for a negative first value
+        return "!" + ",".join(str(val) for val in values)
+
+    gaps = starts - np.append(starts[0], stops[:-1])
+    ones = stops - starts - (gaps > 0)
+    # most runs encode as at most two bits, so do those all at once and only
+    #   encode the long gaps and runs one at a time
+    is_long = (gaps > 27) | (ones > 27)
+    codes = np.zeros((len(starts), 2), dtype=np.uint8)
+    codes[:, 0] = _GAP_CODES[np.where(is_long, 0, gaps)]
+    codes[:, 1] = _ONES_CODES[np.where(is_long, 0, ones)]
+    sects = []
+    literal = []
+    last = 0
+    for n in np.append(np.flatnonzero(is_long), len(starts)).tolist():
+        short = codes[last:n].ravel()
+        literal.append(short[short > 0].tobytes().decode("latin-1"))
+        if n < len(starts):
+            for bits in _encode_run(int(gaps[n]), int(stops[n] - starts[n])):
+                if bits.find("-") >= 0:
+                    sects.append(_compress_repeats("".join(literal)))
+                    sects.append(bits)
+                    literal = []
+                else:
+                    literal.append(bits)
+
+        last = n + 1
+
+    sects.append(_compress_repeats("".join(literal)))
+    bitmap = "{}:{}".format(int(starts[0]), "".join(sects))
+    if len(values) * 2 < len(bitmap):
+        vlist = "!" + ",".join(str(val) for val in values)
+        if len(vlist) < len(bitmap):
+            return vlist
+
+    return bitmap
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 
 R_EARTH = 6.3712e+6
@@ -47,6 +48,91 @@ def ll_from_polar_gridpoint(gridpoint_dict, grid_dict):
     return ll_dict
 
 
+def ll_from_polar_gridpoints(i, j, grid_dict):
+    """
+    Vectorized version of ll_from_polar_gridpoint.
+
+    i and j are arrays of gridpoints in polar space, broadcast against each
+        other
+
+    grid_dict is a dictionary of grid information, as described for
+        ll_from_polar_gridpoint; 'ni' and 'nj' can also be arrays, broadcast
+        against i and j
+
+    (lat, elon) is the returned tuple of arrays of the latitudes and east
+        longitudes of the gridpoints in geo space
+    """
+    x = (np.asarray(i, dtype=np.float64) + 1. -
+         (np.asarray(grid_dict['ni'], dtype=np.float64) + 1.) / 2.)
+    if grid_dict['projection'] == "S":
+        x = -x
+
+    y = (np.asarray(j, dtype=np.float64) + 1. -
+         (np.asarray(grid_dict['nj'], dtype=np.float64) + 1.) / 2.)
+    x, y = np.broadcast_arrays(x, y)
+    r2 = (x * x) + (y * y)
+    re2 = math.pow(
+            ((1. + math.sin(math.radians(abs(grid_dict['tan_lat'])))) *
+             R_EARTH / (grid_dict['dx'] * 1000.)), 2.)
+    lat = np.degrees(np.arcsin((re2 - r2) / (re2 + r2)))
+    elon = (
+            np.degrees(np.arctan2(y, x)) + 90. -
+            (360. - grid_dict['orient_elon']))
+    at_pole = r2 == 0.
+    lat[at_pole] = 90.
+    elon[at_pole] = 360.
+    if grid_dict['projection'] == "S":
+        lat = -lat
+
+    while True:
+        wrap = elon < 0.
+        if not wrap.any():
+            break
+
+        elon[wrap] += 360.
+
+    return (lat, elon)
+
+
+def lambert_conformal_constants(grid_dict):
+    """
+    grid_dict is a dictionary of grid information, as described for
+        ll_from_lambert_conformal_gridpoint
+
+    consts_dict is the returned dictionary of the projection constants that
+        do not depend on the gridpoint:
+        'hemi': 1 for a northern hemisphere projection, -1 for southern
+        'an': cone constant
+        'pole_i' and 'pole_j': the pole point in lambert-conformal space
+        'theta': gridpoints within this angle of the cut opposite the
+                 orientation longitude are out of bounds
+        'z': scale factor from radius in grid units to latitude
+        'orient_elon': longitude of orientation in degrees (0. to 360.)
+    """
+    hemi = 1 if grid_dict['tan_lat'] > 0 else -1
+    tan_lat = math.radians(grid_dict['tan_lat'])
+    an = hemi * math.sin(tan_lat)
+    lat1 = math.radians(grid_dict['left_lat'])
+    elon1 = math.radians(grid_dict['left_elon'])
+    dx = grid_dict['dx'] * 1000.
+    # radius in meters to lower left corner of grid
+    rmll = (
+            R_EARTH / dx * math.pow(math.cos(tan_lat), 1. - an) *
+            pow(1. + an, an) *
+            pow(math.cos(lat1) / (1. + hemi * math.sin(lat1)), an) / an)
+    # find pole point
+    arg = an * (elon1 - math.radians(grid_dict['orient_elon']))
+    aninv = 1. / an
+    return {'hemi': hemi, 'an': an,
+            'pole_i': 1. - hemi * rmll * math.sin(arg),
+            'pole_j': 1. + rmll * math.cos(arg),
+            'theta': math.pi * (1. - an),
+            'z': (math.pow(an / (R_EARTH / dx), aninv) /
+                  (math.pow(math.cos(tan_lat), (1. - an) * aninv) *
+                  (1. + an))),
+            'orient_elon': grid_dict['orient_elon']}
+
+
 def ll_from_lambert_conformal_gridpoint(gridpoint_dict, grid_dict):
     """
     gridpoint_dict is a dictionary containing the gridpoint to convert:
@@ -66,49 +152,73 @@ def ll_from_lambert_conformal_gridpoint(gridpoint_dict, grid_dict):
         'lat' and 'elon' are the latitude and east longitudes of the
             gridpoint in geo space
     """
-    hemi = 1 if grid_dict['tan_lat'] > 0 else -1
-    tan_lat = math.radians(grid_dict['tan_lat'])
-    an = hemi * math.sin(tan_lat)
-    lat1 = math.radians(grid_dict['left_lat'])
-    elon1 = math.radians(grid_dict['left_elon'])
-    grid_dict['dx'] *= 1000.
-    # radius in meters to lower left corner of grid
-    rmll = (
-            R_EARTH / grid_dict['dx'] * math.pow(math.cos(tan_lat), 1. - an) *
-            pow(1. + an, an) *
-            pow(math.cos(lat1) / (1. + hemi * math.sin(lat1)), an) / an)
-    # find pole point
-    arg = an * (elon1 - math.radians(grid_dict['orient_elon']))
-    pole_i = 1. - hemi * rmll * math.sin(arg)
-    pole_j = 1. + rmll * math.cos(arg)
+    consts = lambert_conformal_constants(grid_dict)
+    hemi = consts['hemi']
+    an = consts['an']
     # radius to the (i, j) point in grid units
-    x = gridpoint_dict['i'] + 1 - pole_i
-    y = gridpoint_dict['j'] + 1 - pole_j
+    x = gridpoint_dict['i'] + 1 - consts['pole_i']
+    y = gridpoint_dict['j'] + 1 - consts['pole_j']
     r2 = (x * x) + (y * y)
     # check that requested i and j are not out of bounds
-    theta = math.pi * (1. - an)
     beta = abs(math.atan2(x, y))
-    if beta < theta:
+    if beta < consts['theta']:
         return {'lat': 99., 'elon': 999.}
 
     ll_dict = {}
     if r2 == 0.:
         ll_dict['lat'] = hemi * 90.
-        ll_dict['elon'] = grid_dict['orient_elon']
+        ll_dict['elon'] = consts['orient_elon']
     else:
         aninv = 1. / an
-        z = (
-                math.pow(an / (R_EARTH / grid_dict['dx']), aninv) /
-                (math.pow(math.cos(tan_lat), (1. - an) * aninv) *
-                (1. + an)))
         ll_dict['lat'] = (
                 hemi *
                 math.degrees(math.pi / 2. - 2. *
-                             math.atan(z * math.pow(r2, aninv / 2.))))
+                             math.atan(consts['z'] *
+                                       math.pow(r2, aninv / 2.))))
         ll_dict['elon'] = (
-                grid_dict['orient_elon'] +
+                consts['orient_elon'] +
                 math.degrees(math.atan2(hemi * x, -y) / an))
         while ll_dict['elon'] > 360.:
             ll_dict['elon'] -= 360.
 
     return ll_dict
+
+
+def ll_from_lambert_conformal_gridpoints(i, j, consts):
+    """
+    Vectorized version of ll_from_lambert_conformal_gridpoint.
+
+    i and j are arrays of gridpoints in lambert-conformal space, broadcast
+        against each other
+
+    consts is the dictionary of projection constants returned by
+        lambert_conformal_constants
+
+    (lat, elon) is the returned tuple of arrays of the latitudes and east
+        longitudes of the gridpoints in geo space; out-of-bounds gridpoints
+        have a latitude of 99. and an east longitude of 999.
+    """
+    hemi = consts['hemi']
+    an = consts['an']
+    x = np.asarray(i, dtype=np.float64) + 1 - consts['pole_i']
+    y = np.asarray(j, dtype=np.float64) + 1 - consts['pole_j']
+    x, y = np.broadcast_arrays(x, y)
+    r2 = (x * x) + (y * y)
+    lat = hemi * np.degrees(
+            math.pi / 2. - 2. * np.arctan(consts['z'] *
+                                          np.power(r2, 1. / an / 2.)))
+    elon = consts['orient_elon'] + np.degrees(np.arctan2(hemi * x, -y) / an)
+    while True:
+        wrap = elon > 360.
+        if not wrap.any():
+            break
+
+        elon[wrap] -= 360.
+
+    at_pole = r2 == 0.
+    lat[at_pole] = hemi * 90.
+    elon[at_pole] = consts['orient_elon']
+    out_of_bounds = np.abs(np.arctan2(x, y)) < consts['theta']
+    lat[out_of_bounds] = 99.
+    elon[out_of_bounds] = 999.
+    return (lat, elon)
@@ -1,9 +1,29 @@
+import collections
 import math
+import numpy as np
+import os
 import re
+import sqlite3
+import threading
 
 from .gridpoints import (
+        lambert_conformal_constants,
         ll_from_lambert_conformal_gridpoint,
-        ll_from_polar_gridpoint)
+        ll_from_lambert_conformal_gridpoints,
+        ll_from_polar_gridpoint,
+        ll_from_polar_gridpoints)
+
+
+# maximum number of gridpoints to project at once
+_GRID_BLOCK_SIZE = 1 << 20
+# number of grid definition spatial domains to keep in memory
+_DOMAIN_CACHE_SIZE = 4096
+_domain_cache = collections.OrderedDict()
+_domain_cache_lock = threading.Lock()
+# the SQLite file that persists the spatial domains, and the connection to it
+#   for the process that opened it
+_domain_cache_file = None
+_domain_cache_conn = (None, None)
 
 
 def decode_latitude(lats):
@@ -22,7 +42,65 @@ def decode_elongitude(lons):
     return lon
 
 
-def fill_spatial_domain_from_lambert_conformal_grid(def_params):
+def _add_domain_edges(edges, lat, elon, valid, row_offset):
+    # adds the (row, column) of the gridpoints that are, within rounding, at
+    #   the edge of the domain of this block of gridpoints
+    if not valid.any():
+        return
+
+    for vals in (lat, elon):
+        for edge in (vals[valid].min(), vals[valid].max()):
+            rows, cols = np.nonzero(valid & (
+                    np.abs(vals - edge) <= 1.e-9 * max(1., abs(edge))))
+            edges.update(zip((rows + row_offset).tolist(), cols.tolist()))
+
+
+def _grid_perimeter(ni, nj):
+    # returns the (i, j) of the gridpoints around the edge of the grid, in
+    #   order: the bottom row, the right column, the top row and the left
+    #   column
+    i = np.concatenate((np.arange(0, ni), np.full(nj, ni - 1),
+                        np.arange(ni - 1, -1, -1),
+                        np.zeros(nj, dtype=np.int64)))
+    j = np.concatenate((np.zeros(ni, dtype=np.int64), np.arange(0, nj),
+                        np.full(ni, nj - 1), np.arange(nj - 1, -1, -1)))
+    return (i, j)
+
+
+def _pole_in_grid(pole_i, pole_j, ni, nj):
+    return 0. <= pole_i <= ni - 1 and 0. <= pole_j <= nj - 1
+
+
+def _fill_domain_from_perimeter(domain, ring_i, ring_j, lat, elon,
+                                ll_from_gridpoint, grid_dict):
+    # the extremes of a conformal projection lie on the perimeter of the grid
+    #   when the pole is outside it; the east longitudes are unwrapped around
+    #   the perimeter so that a grid that straddles the prime meridian has a
+    #   continuous range of longitudes
+    shifts = np.zeros(len(elon))
+    shifts[1:] = -360. * np.cumsum(np.round(np.diff(elon) / 360.))
+    elon = elon + shifts
+    edges = set()
+    for vals in (lat, elon):
+        for edge in (vals.min(), vals.max()):
+            near = np.abs(vals - edge) <= 1.e-9 * max(1., abs(edge))
+            edges.update(np.flatnonzero(near).tolist())
+
+    # keep the west longitude in [0., 360.)
+    shifts -= 360. * math.floor(elon.min() / 360.)
+    for n in edges:
+        ll = ll_from_gridpoint({'i': int(ring_i[n]), 'j': int(ring_j[n])},
+                               grid_dict)
+        if shifts[n] != 0.:
+            ll['elon'] += float(shifts[n])
+
+        domain['slat'] = min(ll['lat'], domain['slat'])
+        domain['nlat'] = max(ll['lat'], domain['nlat'])
+        domain['wlon'] = min(ll['elon'], domain['wlon'])
+        domain['elon'] = max(ll['elon'], domain['elon'])
+
+
+def fill_spatial_domain_from_lambert_conformal_grid(def_params, **kwargs):
     domain = {'slat': 99., 'nlat': -99., 'wlon': 999., 'elon': -999.}
     ni = int(def_params[0])
     istep = 1
@@ -34,32 +112,83 @@ def fill_spatial_domain_from_lambert_conformal_grid(def_params):
     if nj > 2000:
         jstep = int(nj / 2000)
 
-    for j in range(0, nj, jstep):
-        straddles_prime_meridian = False
-        previous_elon = None
-        for i in range(0, ni, istep):
-            ll = ll_from_lambert_conformal_gridpoint(
-                    {'i': i, 'j': j},
-                    {'left_lat': decode_latitude(def_params[2]),
-                     'left_elon': decode_elongitude(def_params[3]),
-                     'tan_lat': decode_latitude(def_params[4]),
-                     'orient_elon': decode_elongitude(def_params[5]),
-                     'dx': float(def_params[7])})
-            if ll['lat'] != 99.:
-                if previous_elon is None:
-                    previous_elon = ll['elon']
-
-                if ll['elon'] < 180. and previous_elon > 180.:
-                    straddles_prime_meridian = True
-
-                if straddles_prime_meridian:
-                    ll['elon'] += 360.
-
-                domain['slat'] = min(ll['lat'], domain['slat'])
-                domain['nlat'] = max(ll['lat'], domain['nlat'])
-                domain['wlon'] = min(ll['elon'], domain['wlon'])
-                domain['elon'] = max(ll['elon'], domain['elon'])
-                previous_elon = ll['elon']
+    grid_dict = {'left_lat': decode_latitude(def_params[2]),
+                 'left_elon': decode_elongitude(def_params[3]),
+                 'tan_lat': decode_latitude(def_params[4]),
+                 'orient_elon': decode_elongitude(def_params[5]),
+                 'dx': float(def_params[7])}
+    consts = lambert_conformal_constants(grid_dict)
+    if 'method' in kwargs and kwargs['method'] == "perimeter":
+        ring_i, ring_j = _grid_perimeter(ni, nj)
+        lat, elon = ll_from_lambert_conformal_gridpoints(ring_i, ring_j,
+                                                         consts)
+        valid = lat != 99.
+        if _pole_in_grid(consts['pole_i'] - 1, consts['pole_j'] - 1, ni, nj):
+            # every longitude meets at the pole
+            if consts['hemi'] > 0:
+                domain['slat'] = float(lat[valid].min())
+                domain['nlat'] = 90.
+            else:
+                domain['slat'] = -90.
+                domain['nlat'] = float(lat[valid].max())
+
+            domain['wlon'] = -180.
+            domain['elon'] = 180.
+            return domain
+
+        # if the cut opposite the orientation longitude crosses the grid, the
+        #   extremes are not on the perimeter, so project the whole grid
+        if len(lat) > 0 and valid.all():
+            _fill_domain_from_perimeter(
+                    domain, ring_i, ring_j, lat, elon,
+                    ll_from_lambert_conformal_gridpoint, grid_dict)
+            if domain['wlon'] > 180.:
+                domain['wlon'] -= 360.
+
+            if domain['elon'] > 180.:
+                domain['elon'] -= 360.
+
+            return domain
+
+    i = np.arange(0, ni, istep)
+    j = np.arange(0, nj, jstep)
+    # gridpoints that are (within rounding) at the edge of the domain
+    edges = set()
+    # the first column of each row from which the row straddles the prime
+    #   meridian
+    straddle_cols = np.empty(len(j), dtype=np.int64)
+    # project the grid a block of rows at a time to bound the memory used
+    nrows = max(1, _GRID_BLOCK_SIZE // max(1, len(i)))
+    for n in range(0, len(j), nrows):
+        lat, elon = ll_from_lambert_conformal_gridpoints(
+                i[np.newaxis, :], j[n:n+nrows, np.newaxis], consts)
+        valid = lat != 99.
+        # a row straddles the prime meridian from its first point with an
+        #   east longitude below 180. that follows a valid point above 180.
+        prev = np.where(valid, np.arange(len(i)), -1)
+        prev = np.maximum.accumulate(prev, axis=1)[:, :-1]
+        prev_elon = np.take_along_axis(elon, np.maximum(prev, 0), axis=1)
+        crosses = np.zeros(valid.shape, dtype=bool)
+        crosses[:, 1:] = (valid[:, 1:] & (prev >= 0) & (elon[:, 1:] < 180.) &
+                          (prev_elon > 180.))
+        straddle_cols[n:n+nrows] = np.where(crosses.any(axis=1),
+                                            np.argmax(crosses, axis=1), len(i))
+        straddles = np.arange(len(i)) >= straddle_cols[n:n+nrows, np.newaxis]
+        elon[valid & straddles] += 360.
+        _add_domain_edges(edges, lat, elon, valid, n)
+
+    # the vectorized projection can differ from the scalar one in the last
+    #   bit, so take the domain from the scalar projection of the edges
+    for row, col in edges:
+        ll = ll_from_lambert_conformal_gridpoint(
+                {'i': int(i[col]), 'j': int(j[row])}, grid_dict)
+        if col >= straddle_cols[row]:
+            ll['elon'] += 360.
+
+        domain['slat'] = min(ll['lat'], domain['slat'])
+        domain['nlat'] = max(ll['lat'], domain['nlat'])
+        domain['wlon'] = min(ll['elon'], domain['wlon'])
+        domain['elon'] = max(ll['elon'], domain['elon'])
 
     if domain['slat'] != 99.:
         if domain['wlon'] > 180.:
@@ -71,7 +200,7 @@ def fill_spatial_domain_from_lambert_conformal_grid(def_params):
     return domain
 
 
-def fill_spatial_domain_from_polar_stereographic_grid(def_params):
+def fill_spatial_domain_from_polar_stereographic_grid(def_params, **kwargs):
     domain = {'slat': 99., 'nlat': -99., 'wlon': 999., 'elon': -999.}
     ni = int(def_params[0])
     nj = int(def_params[1])
@@ -80,56 +209,82 @@ def fill_spatial_domain_from_polar_stereographic_grid(def_params):
     tan_lat = decode_latitude(def_params[4])
     orient_elon = decode_elongitude(def_params[5])
     dx = float(def_params[7])
-    ll = ll_from_polar_gridpoint({'i': 0, 'j': 0},
-                                 {'ni': ni, 'nj': nj,
-                                  'projection': def_params[6],
-                                  'tan_lat': tan_lat, 'dx': dx,
-                                  'orient_elon': orient_elon})
+    grid_dict = {'ni': ni, 'nj': nj, 'projection': def_params[6],
+                 'tan_lat': tan_lat, 'dx': dx, 'orient_elon': orient_elon}
+    ll = ll_from_polar_gridpoint({'i': 0, 'j': 0}, grid_dict)
     if (abs(ll['lat'] - start_lat) > 0.5 or
             abs(ll['elon'] - start_elon) > 0.5):
         yoverx = math.tan(math.radians(start_elon + 270. - orient_elon))
         if def_params[6] == "S":
             yoverx = -yoverx
 
-        pole_x = 1
         deg_res = dx / (math.cos(math.radians(tan_lat)) * 111.1)
         max_pole_x = int(360. / deg_res) + 1
-        pole_y = 0
-        while pole_x < max_pole_x:
-            ni = pole_x * 2 - 1
-            pole_y = round(1 - yoverx * (1 - pole_x))
-            nj = pole_y * 2 - 1
-            ll = ll_from_polar_gridpoint({'i': 0, 'j': 0},
-                                         {'ni': ni, 'nj': nj,
-                                          'projection': def_params[6],
-                                          'tan_lat': tan_lat, 'dx': dx,
-                                          'orient_elon': orient_elon})
+        # try every pole position along the line through the first gridpoint
+        #   at once, then confirm the first match with the scalar projection
+        pole_x = np.arange(1, max(1, max_pole_x), dtype=np.int64)
+        pole_y = np.round(1 - yoverx * (1 - pole_x))
+        lat, elon = ll_from_polar_gridpoints(
+                0, 0, dict(grid_dict, ni=pole_x * 2 - 1, nj=pole_y * 2 - 1))
+        matches = np.flatnonzero((np.abs(lat - start_lat) < 0.5 + 1.e-9) &
+                                 (np.abs(elon - start_elon) < 0.5 + 1.e-9))
+        for n in matches.tolist():
+            grid_dict['ni'] = ni = int(pole_x[n]) * 2 - 1
+            grid_dict['nj'] = nj = int(pole_y[n]) * 2 - 1
+            ll = ll_from_polar_gridpoint({'i': 0, 'j': 0}, grid_dict)
             if (abs(ll['lat'] - start_lat) < 0.5 and
                     abs(ll['elon'] - start_elon) < 0.5):
                 break
+        else:
+            if max_pole_x >= 1:
+                return domain
+
+    if ('method' in kwargs and kwargs['method'] == "perimeter" and ni > 0 and
+            nj > 0):
+        ring_i, ring_j = _grid_perimeter(ni, nj)
+        lat, elon = ll_from_polar_gridpoints(ring_i, ring_j, grid_dict)
+        _fill_domain_from_perimeter(domain, ring_i, ring_j, lat, elon,
+                                    ll_from_polar_gridpoint, grid_dict)
+        if _pole_in_grid((ni - 1) / 2., (nj - 1) / 2., ni, nj):
+            # every longitude meets at the pole
+            if def_params[6] == "S":
+                domain['slat'] = -90.
+            else:
+                domain['nlat'] = 90.
 
-            pole_x += 1
-
-        if pole_x == max_pole_x:
-            return domain
-
-    for j in range(0, nj):
-        for i in range(0, ni):
-            ll = ll_from_polar_gridpoint({'i': i, 'j': j},
-                                         {'ni': ni, 'nj': nj,
-                                          'projection': def_params[6],
-                                          'tan_lat': tan_lat, 'dx': dx,
-                                          'orient_elon': orient_elon})
-            domain['slat'] = min(ll['lat'], domain['slat'])
-            domain['nlat'] = max(ll['lat'], domain['nlat'])
-            domain['wlon'] = min(ll['elon'], domain['wlon'])
-            domain['elon'] = max(ll['elon'], domain['elon'])
+            domain['wlon'] = -180.
+            domain['elon'] = 180.
+        else:
+            if domain['wlon'] > 180.:
+                domain['wlon'] -= 360.
+
+            if domain['elon'] > 180.:
+                domain['elon'] -= 360.
+
+        return domain
+
+    # project the grid a block of rows at a time to bound the memory used
+    i = np.arange(0, max(0, ni))
+    j = np.arange(0, max(0, nj))
+    edges = set()
+    nrows = max(1, _GRID_BLOCK_SIZE // max(1, len(i)))
+    for n in range(0, len(j), nrows):
+        lat, elon = ll_from_polar_gridpoints(
+                i[np.newaxis, :], j[n:n+nrows, np.newaxis], grid_dict)
+        _add_domain_edges(edges, lat, elon, np.ones(lat.shape, dtype=bool),
+                          n)
+
+    # the vectorized projection can differ from the scalar one in the last
+    #   bit, so take the domain from the scalar projection of the edges
+    for row, col in edges:
+        ll = ll_from_polar_gridpoint({'i': col, 'j': row}, grid_dict)
+        domain['slat'] = min(ll['lat'], domain['slat'])
+        domain['nlat'] = max(ll['lat'], domain['nlat'])
+        domain['wlon'] = min(ll['elon'], domain['wlon'])
+        domain['elon'] = max(ll['elon'], domain['elon'])
 
     ll = ll_from_polar_gridpoint({'i': int(ni/2.), 'j': int(nj/2.)},
-                                 {'ni': ni, 'nj': nj,
-                                  'projection': def_params[6],
-                                  'tan_lat': tan_lat, 'dx': dx,
-                                  'orient_elon': orient_elon})
+                                 grid_dict)
     if ((ll['elon'] == 360. and abs(ll['lat']) == 90.) or
             (domain['wlon'] == 0. and domain['elon'] > 359.9)):
         domain['wlon'] = -180.
@@ -144,7 +299,103 @@ def fill_spatial_domain_from_polar_stereographic_grid(def_params):
     return domain
 
 
+def set_domain_cache_file(path):
+    """
+    Keeps the spatial domains computed by spatial_domain_from_grid_definition
+    in the SQLite database 'path' as well as in memory, so that they are
+    reused by later runs. The database is created if it doesn't exist. A
+    'path' of None stops using the database.
+    """
+    global _domain_cache_file, _domain_cache_conn
+    with _domain_cache_lock:
+        if _domain_cache_conn[1] is not None:
+            _domain_cache_conn[1].close()
+
+        _domain_cache_file = path
+        _domain_cache_conn = (None, None)
+        if path is not None:
+            _domain_cache_db()
+
+
+def clear_domain_cache():
+    with _domain_cache_lock:
+        _domain_cache.clear()
+
+
+def _domain_cache_db():
+    # returns the connection to the domain cache database for this process,
+    #   or None if there isn't one; the caller holds _domain_cache_lock
+    global _domain_cache_conn
+    if _domain_cache_file is None:
+        return None
+
+    if _domain_cache_conn[0] != os.getpid():
+        conn = sqlite3.connect(_domain_cache_file, timeout=60.,
+                               check_same_thread=False)
+        conn.execute((
+                "create table if not exists grid_domains (definition text not "
+                "null, def_params text not null, center_on text not null, "
+                "method text not null, wlon real, slat real, elon real, nlat "
+                "real, primary key (definition, def_params, center_on, "
+                "method))"))
+        conn.commit()
+        _domain_cache_conn = (os.getpid(), conn)
+
+    return _domain_cache_conn[1]
+
+
 def spatial_domain_from_grid_definition(gdef, **kwargs):
+    """
+    Returns the spatial domain of the grid definition 'gdef', a
+    (definition, def_params) tuple, as a dictionary of 'wlon', 'slat',
+    'elon' and 'nlat'; the values are None if the domain can't be computed.
+
+    Optional keyword arguments:
+        centerOn: "primeMeridian" or "dateLine" for global longitudes
+        method: "perimeter" to compute the domain of a projected grid from
+                its perimeter only
+
+    Domains are cached by grid definition and options, in memory and, after
+    set_domain_cache_file(), in a SQLite database.
+    """
+    key = (gdef[0], gdef[1],
+           kwargs['centerOn'] if 'centerOn' in kwargs else "",
+           kwargs['method'] if 'method' in kwargs else "")
+    with _domain_cache_lock:
+        domain = _domain_cache.get(key)
+        if domain is not None:
+            _domain_cache.move_to_end(key)
+            return dict(domain)
+
+        db = _domain_cache_db()
+        if db is not None:
+            res = db.execute((
+                    "select wlon, slat, elon, nlat from grid_domains where "
+                    "definition = ? and def_params = ? and center_on = ? and "
+                    "method = ?"), key).fetchone()
+            if res is not None:
+                domain = dict(zip(('wlon', 'slat', 'elon', 'nlat'), res))
+
+    if domain is None:
+        domain = _spatial_domain_from_grid_definition(gdef, **kwargs)
+        if db is not None:
+            with _domain_cache_lock:
+                db.execute((
+                        "insert or replace into grid_domains values (?, ?, "
+                        "?, ?, ?, ?, ?, ?)"),
+                        key + (domain['wlon'], domain['slat'], domain['elon'],
+                               domain['nlat']))
+                db.commit()
+
+    with _domain_cache_lock:
+        _domain_cache[key] = dict(domain)
+        if len(_domain_cache) > _DOMAIN_CACHE_SIZE:
+            _domain_cache.popitem(last=False)
+
+    return domain
+
+
+def _spatial_domain_from_grid_definition(gdef, **kwargs):
     domain = {'wlon': None, 'slat': None, 'elon': None, 'nlat': None}
     def_params = gdef[1].split(":")
     if re.compile("^(latLon|gaussLatLon|mercator)(Cell){0,1}$").match(gdef[0]):
@@ -231,9 +482,11 @@ def spatial_domain_from_grid_definition(gdef, **kwargs):
                                   else start_elon)
 
     elif gdef[0].find("lambertConformal") == 0:
-        domain = fill_spatial_domain_from_lambert_conformal_grid(def_params)
+        domain = fill_spatial_domain_from_lambert_conformal_grid(
+                def_params, **kwargs)
     elif gdef[0].find("polarStereographic") == 0:
-        domain = fill_spatial_domain_from_polar_stereographic_grid(def_params)
+        domain = fill_spatial_domain_from_polar_stereographic_grid(
+                def_params, **kwargs)
 
     return domain
 
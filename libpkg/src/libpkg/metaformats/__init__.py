@@ -0,0 +1,242 @@
+import multiprocessing
+import os
+
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from lxml import etree
+
+from ..citeutils import CitationIndex
+from ..dbutils import create_connection_pool, get_connection, put_connection
+from ..metautils import get_dataset_snapshot
+from ..xmlutils import get_xml_catalog, get_xml_schema, load_xml_schemas
+from . import (datacite_4, dublin_core, fgdc, gcmd_dif, iso_19115_3, iso_19139,
+               json_ld, native)
+
+
+def _export_native(dsid, metadb, wagtaildb, **kwargs):
+    return native.export(dsid, metadb, **kwargs)
+
+
+# the exporter of each format and the keyword arguments that select its
+#   output
+_EXPORTERS = {
+    'datacite_4': (datacite_4.export, {}),
+    'dublin_core_html_meta': (dublin_core.export, {'output': "html_meta"}),
+    'dublin_core_oai': (dublin_core.export, {}),
+    'fgdc': (fgdc.export, {}),
+    'gcmd_dif': (gcmd_dif.export, {}),
+    'iso_19115_3': (iso_19115_3.export, {}),
+    'iso_19139': (iso_19139.export, {}),
+    'json_ld': (json_ld.export, {}),
+    'native': (_export_native, {}),
+}
+FORMATS = tuple(_EXPORTERS)
+
+
+def export_all(dsid, metadb_settings, wagtaildb_settings, formats=None,
+               **kwargs):
+    """
+    Renders the metadata of the dataset 'dsid' in each of 'formats' (default
+    is all of FORMATS) and returns a dictionary of the documents keyed by
+    format. The 'datacite_4' document is the (XML, warnings) tuple returned
+    by datacite_4.export.
+
+    The formats share one connection to each database, one DatasetSnapshot
+    and one download of the dataset overview. 'metadb_settings' and
+    'wagtaildb_settings' are connection settings, pools or open connections.
+
+    Optional keyword arguments:
+        snapshot: an already-loaded DatasetSnapshot of 'dsid'
+        citation_index: a citeutils.CitationIndex for the formats that list
+                        the works that cite the dataset
+    """
+    if formats is None:
+        formats = FORMATS
+
+    unknown = [fmt for fmt in formats if fmt not in _EXPORTERS]
+    if len(unknown) > 0:
+        raise RuntimeError("unknown metadata format(s): " +
+                           ", ".join(unknown))
+
+    docs = {}
+    mconn = get_connection(metadb_settings, "metadata")
+    try:
+        wconn = get_connection(wagtaildb_settings, "wagtail")
+        try:
+            snapshot = get_dataset_snapshot(dsid, mconn.cursor(), **kwargs)
+            citation_index = (kwargs['citation_index'] if 'citation_index'
+                              in kwargs else None)
+            for fmt in formats:
+                export, fmt_kwargs = _EXPORTERS[fmt]
+                docs[fmt] = export(dsid, mconn, wconn, snapshot=snapshot,
+                                   citation_index=citation_index,
+                                   **fmt_kwargs)
+        finally:
+            put_connection(wconn, wagtaildb_settings)
+    finally:
+        put_connection(mconn, metadb_settings)
+
+    return docs
+
+
+def _validate_documents(docs, schemas):
+    # returns a message for each document that doesn't validate against the
+    #   schema for its format
+    errors = []
+    for fmt, doc in docs.items():
+        if fmt in schemas:
+            if isinstance(doc, tuple):
+                doc = doc[0]
+
+            try:
+                get_xml_schema(schemas[fmt]).assertValid(
+                        etree.fromstring(doc.encode("utf-8")))
+            except (etree.DocumentInvalid, etree.XMLSyntaxError) as err:
+                errors.append("{}: {}".format(fmt, err))
+
+    return errors
+
+
+def create_validation_pool(schemas, max_processes=None):
+    """
+    Returns a pool of processes for validating documents against the XSDs in
+    'schemas' (see export_batch), each of which compiles the schemas once.
+    Pass it to several export_batch calls to reuse the processes; the caller
+    shuts it down.
+    """
+    if max_processes is None:
+        max_processes = os.cpu_count()
+
+    # the callers may have threads running, so don't fork the workers; each
+    #   worker compiles the schemas once, with this process's XML catalog
+    return ProcessPoolExecutor(
+            max_processes, mp_context=multiprocessing.get_context("spawn"),
+            initializer=load_xml_schemas,
+            initargs=(list(schemas.values()), get_xml_catalog()))
+
+
+def export_batch(dsids, metadb_settings, wagtaildb_settings, formats=None,
+                 **kwargs):
+    """
+    Renders the metadata of each dataset in 'dsids' with export_all, several
+    datasets at a time, and returns (docs, errors): 'docs' maps each dataset
+    ID to its export_all dictionary and 'errors' maps each dataset that
+    failed to the exception that it raised. A failure only affects its own
+    dataset.
+
+    The exports, which wait on the databases and the web server, run in a
+    pool of threads. Connection settings are turned into a pool of
+    connections for the threads to share.
+
+    Optional keyword arguments:
+        max_threads: the number of datasets to export at once (default 8)
+        schemas: a dictionary of XSD locations keyed by format (see
+                 xmlutils.get_xml_schema); the documents in those formats
+                 are validated in a pool of processes and a dataset with an
+                 invalid document fails
+        max_processes: the number of validation processes (default is the
+                       number of CPUs)
+        validation_pool: a pool from create_validation_pool() for 'schemas'
+                         to validate in, instead of starting one for this
+                         call
+        progress: a function called as progress(done, total, dsid, error)
+                  when each dataset finishes; 'error' is None on success
+        changed: a function called as changed(dsid, docs) when each dataset
+                 is exported; a dataset for which it returns False is not
+                 validated and is left out of 'docs'
+        citation_index: the citeutils.CitationIndex that the exports share
+                        (default is a new one, loaded when the first
+                        dataset needs it)
+    """
+    dsids = list(dsids)
+    max_threads = kwargs['max_threads'] if 'max_threads' in kwargs else 8
+    schemas = kwargs['schemas'] if 'schemas' in kwargs else {}
+    progress = kwargs['progress'] if 'progress' in kwargs else None
+    changed = kwargs['changed'] if 'changed' in kwargs else None
+    citation_index = (kwargs['citation_index'] if 'citation_index' in kwargs
+                      else CitationIndex())
+    pools = []
+    if isinstance(metadb_settings, dict):
+        metadb_settings = create_connection_pool(metadb_settings,
+                                                 maxconn=max_threads)
+        pools.append(metadb_settings)
+
+    if isinstance(wagtaildb_settings, dict):
+        wagtaildb_settings = create_connection_pool(wagtaildb_settings,
+                                                    maxconn=max_threads)
+        pools.append(wagtaildb_settings)
+
+    procs = None
+    own_procs = False
+    if len(schemas) > 0:
+        if 'validation_pool' in kwargs:
+            procs = kwargs['validation_pool']
+        else:
+            procs = create_validation_pool(
+                    schemas, kwargs['max_processes'] if 'max_processes' in
+                    kwargs else None)
+            own_procs = True
+
+    docs = {}
+    errors = {}
+    num_done = 0
+
+    def finish(dsid, error):
+        nonlocal num_done
+        num_done += 1
+        if error is not None:
+            errors[dsid] = error
+            docs.pop(dsid, None)
+
+        if progress is not None:
+            progress(num_done, len(dsids), dsid, error)
+
+    validating = {}
+    try:
+        with ThreadPoolExecutor(max_threads) as threads:
+            exporting = {threads.submit(export_all, dsid, metadb_settings,
+                                        wagtaildb_settings, formats,
+                                        citation_index=citation_index): dsid
+                         for dsid in dsids}
+            while len(exporting) > 0 or len(validating) > 0:
+                done, _ = wait(list(exporting) + list(validating),
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in exporting:
+                        dsid = exporting.pop(future)
+                        try:
+                            docs[dsid] = future.result()
+                        except Exception as err:
+                            finish(dsid, err)
+                            continue
+
+                        if (changed is not None and not
+                                changed(dsid, docs[dsid])):
+                            del docs[dsid]
+                            finish(dsid, None)
+                        elif procs is None:
+                            finish(dsid, None)
+                        else:
+                            validating[procs.submit(_validate_documents,
+                                                    docs[dsid],
+                                                    schemas)] = dsid
+                    else:
+                        dsid = validating.pop(future)
+                        try:
+                            invalid = future.result()
+                            error = (RuntimeError(
+                                    "failed to validate: " +
+                                    "; ".join(invalid)) if len(invalid) > 0
+                                    else None)
+                        except Exception as err:
+                            error = err
+
+                        finish(dsid, error)
+    finally:
+        if own_procs:
+            procs.shutdown()
+
+        for pool in pools:
+            pool.closeall()
+
+    return (docs, errors)
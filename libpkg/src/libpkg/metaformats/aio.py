@@ -0,0 +1,146 @@
+import aiohttp
+import asyncio
+import functools
+
+from ..metautils import (DatasetSnapshot, cache_dataset_overview,
+                         dataset_overview_requests,
+                         get_cached_dataset_overview)
+from . import export_all as export_all_sync
+
+
+async def _fetch(pool, query, *args):
+    # runs 'query', with its one parameter as %(dsid)s or %s, on a connection
+    #   from the asyncpg pool 'pool' and returns the (column names, rows), as
+    #   a psycopg2 cursor would give them
+    query = query.replace("%(dsid)s", "$1").replace("%s", "$1")
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(query, *args)
+
+    cols = list(rows[0].keys()) if len(rows) > 0 else []
+    return (cols, [tuple(row) for row in rows])
+
+
+async def load_dataset_snapshot(dsid, pool, **kwargs):
+    """
+    Returns the DatasetSnapshot of the dataset 'dsid'. Its queries run at the
+    same time, each on its own connection from the asyncpg pool 'pool'.
+
+    Optional keyword arguments:
+        wagtail_pool: an asyncpg pool for the wagtail database, to load the
+                      dataset description page at the same time
+    """
+    queries = [_fetch(pool, query, dsid) for query in DatasetSnapshot.QUERIES]
+    if 'wagtail_pool' in kwargs and kwargs['wagtail_pool'] is not None:
+        queries.append(_fetch(kwargs['wagtail_pool'],
+                              DatasetSnapshot.PAGE_QUERY, dsid))
+
+    results = await asyncio.gather(*queries)
+    snapshot = DatasetSnapshot(dsid)
+    snapshot.load(results[0:len(DatasetSnapshot.QUERIES)])
+    if len(results) > len(DatasetSnapshot.QUERIES):
+        snapshot.load_page(results[-1])
+
+    return snapshot
+
+
+def _overview_step(fetch, resp):
+    # advances the overview generator 'fetch' with the response 'resp' (None
+    #   to start it) and returns (True, (url, headers)) for the next request
+    #   or (False, overview) when it is done; StopIteration can't be raised
+    #   through a future
+    try:
+        return (True, next(fetch) if resp is None else fetch.send(resp))
+    except StopIteration as stop:
+        return (False, stop.value)
+
+
+async def open_dataset_overview(dsid, session):
+    """
+    Asynchronous metautils.open_dataset_overview: downloads the overview with
+    the aiohttp ClientSession 'session' and shares the same cache. The stored
+    copy is read and written, and the overview is parsed, in the event
+    loop's default executor.
+    """
+    root = get_cached_dataset_overview(dsid)
+    if root is not None:
+        return root
+
+    loop = asyncio.get_running_loop()
+    fetch = dataset_overview_requests(dsid)
+    more, step = await loop.run_in_executor(None, _overview_step, fetch,
+                                            None)
+    while more:
+        url, headers = step
+        try:
+            async with session.get(url, headers=headers) as r:
+                resp = (r.status, r.headers, await r.text())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            resp = err
+
+        more, step = await loop.run_in_executor(None, _overview_step, fetch,
+                                                resp)
+
+    return await loop.run_in_executor(None, cache_dataset_overview, dsid,
+                                      step)
+
+
+async def _load_data_license(dsid, session, wagtail_pool):
+    # downloads the overview and then, with 'wagtail_pool', loads the data
+    #   license that it names; returns the (license ID, row), or None without
+    #   a pool
+    root = await open_dataset_overview(dsid, session)
+    if wagtail_pool is None:
+        return None
+
+    license_id = root.find("./dataLicense")
+    license_id = "CC-BY-4.0" if license_id is None else license_id.text
+    cols, rows = await _fetch(wagtail_pool, DatasetSnapshot.LICENSE_QUERY,
+                              license_id)
+    return (license_id, rows[0] if len(rows) > 0 else None)
+
+
+async def export_all(dsid, pool, metadb_settings, wagtaildb_settings,
+                     formats=None, **kwargs):
+    """
+    Asynchronous metaformats.export_all. The DatasetSnapshot (the dataset,
+    its versions, temporal ranges, authors, contributors, GCMD keywords and
+    citing DOIs) is loaded with concurrent queries on the asyncpg pool
+    'pool' while the dataset overview downloads, and then the documents are
+    rendered by the synchronous exporters in the event loop's default
+    executor.
+
+    With a 'wagtail_pool', the description page and the data license are
+    loaded concurrently as well. With a 'citation_index', the citing works
+    come from the index. The exporters' remaining queries (the grid
+    definitions, file dates and dataset size, for example) depend on other
+    rows, so they still use 'metadb_settings' and 'wagtaildb_settings'
+    (psycopg2 connection settings or pools) in the executor thread.
+
+    Optional keyword arguments:
+        session: the aiohttp ClientSession for the overview download (default
+                 is a new session)
+        wagtail_pool: an asyncpg pool for the wagtail database
+        any other keyword arguments (e.g. citation_index) are passed to
+        metaformats.export_all
+    """
+    wagtail_pool = kwargs.pop('wagtail_pool', None)
+    session = kwargs.pop('session', None)
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            snapshot, data_license = await asyncio.gather(
+                    load_dataset_snapshot(dsid, pool,
+                                          wagtail_pool=wagtail_pool),
+                    _load_data_license(dsid, session, wagtail_pool))
+    else:
+        snapshot, data_license = await asyncio.gather(
+                load_dataset_snapshot(dsid, pool, wagtail_pool=wagtail_pool),
+                _load_data_license(dsid, session, wagtail_pool))
+
+    if data_license is not None:
+        snapshot.load_license(*data_license)
+
+    kwargs['snapshot'] = snapshot
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(
+            export_all_sync, dsid, metadb_settings, wagtaildb_settings,
+            formats, **kwargs))
@@ -1,20 +1,22 @@
 import json
-import psycopg2
 
 from lxml import etree
 
 from . import settings
-from ..dbutils import uncompress_bitmap_values
+from ..citeutils import get_citation_works
+from ..dbutils import (CompressedBitmap, get_connection, get_grid_definitions,
+                       put_connection)
 from ..gridutils import spatial_domain_from_grid_definition
 from ..metautils import (get_dataset_size,
+                         get_dataset_snapshot,
                          get_date_from_precision,
                          get_pages,
                          open_dataset_overview)
 from ..strutils import snake_to_capital
-from ..xmlutils import convert_html_to_text
+from ..xmlutils import convert_html_to_text, get_xml_schema
 
 
-def get_mandatory_fields(dsid, xml_root, cursor):
+def get_mandatory_fields(dsid, xml_root, cursor, snapshot):
     mand = {
         'titles': [
                 {'title': xml_root.find("./title").text}
@@ -69,15 +71,10 @@ def get_mandatory_fields(dsid, xml_root, cursor):
                 })
 
     if len(mand['creators']) == 0:
-        cursor.execute(("select g.path, c.contact from search."
-                        "contributors_new as c left join search."
-                        "gcmd_providers as g on g.uuid = c.keyword where c."
-                        "dsid = %s and c.vocabulary = 'GCMD'"), (dsid, ))
-        res = cursor.fetchall()
-        for e in res:
+        for e in snapshot.contributors:
             parts = e[0].split(" > ")
             if parts[-1] == "UNAFFILIATED INDIVIDUAL":
-                nparts = e[1].split(",")
+                nparts = e[2].split(",")
                 lname = (nparts[-1][0].upper() +
                          nparts[1:].lower()).replace(" ", "_")
                 mand['creators'].append({
@@ -97,13 +94,10 @@ def get_mandatory_fields(dsid, xml_root, cursor):
         raise RuntimeError(("no creators found and this is a required "
                             "DataCite field"))
 
-    cursor.execute("select pub_date from search.datasets where dsid = %s",
-                   (dsid, ))
-    res = cursor.fetchall()
-    if len(res) != 1:
+    if snapshot.dataset is None:
         raise RuntimeError("missing or invalid row count for publication date")
 
-    mand['publicationYear'] = str(res[0][0])[0:4]
+    mand['publicationYear'] = str(snapshot.dataset['pub_date'])[0:4]
     return mand
 
 
@@ -282,7 +276,7 @@ def to_xml(dc_data, **kwargs):
             etree.SubElement(root, "rightsList"),
             "rights", rightsIdentifier=rights['rightsIdentifier'],
             rightsURI=rights['rightsUri']).text = rights['rights']
-    xml_schema = etree.XMLSchema(etree.parse(xsd))
+    xml_schema = get_xml_schema(xsd)
     root = etree.fromstring(etree.tostring(root))
     try:
         xml_schema.assertValid(root)
@@ -301,14 +295,11 @@ def to_output(dc_data, ofmt, **kwargs):
 
 
 def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
-    try:
-        metadb_conn = psycopg2.connect(**metadb_settings)
-        metadb_cursor = metadb_conn.cursor()
-    except psycopg2.Error as err:
-        raise RuntimeError("metadata database connection error: '{}'"
-                           .format(err))
+    metadb_conn = get_connection(metadb_settings, "metadata")
+    metadb_cursor = metadb_conn.cursor()
 
     try:
+        snapshot = get_dataset_snapshot(dsid, metadb_cursor, **kwargs)
         dc_data = {
             'alternateIdentifiers': [
                 {'identifier': ("https://" + settings.ARCHIVE['domain'] + "/" +
@@ -342,14 +333,12 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
         }
         ofmt = kwargs['fmt'] if 'fmt' in kwargs else 'xml'
         warnings = []
-        metadb_cursor.execute(("select doi from dssdb.dsvrsn where dsid = %s "
-                               "and status = 'A' and end_date is null"),
-                              (dsid, ))
-        res = metadb_cursor.fetchall()
-        if len(res) == 1:
-            dc_data['doi'] = res[0][0]
-
-        dc_data.update(get_mandatory_fields(dsid, xml_root, metadb_cursor))
+        dois = snapshot.dois(status="A", current=True)
+        if len(dois) == 1:
+            dc_data['doi'] = dois[0]
+
+        dc_data.update(get_mandatory_fields(dsid, xml_root, metadb_cursor,
+                                            snapshot))
         if 'mandatoryOnly' in kwargs and kwargs['mandatoryOnly']:
             o, warn = to_output(dc_data, ofmt, kwargs)
             if len(warn) > 0:
@@ -358,13 +347,8 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
             return (o, "\n".join(warnings))
 
         geocover = xml_root.find("./contentMetadata/geospatialCoverage")
-        metadb_cursor.execute((
-                "select g.path, g.uuid from search.variables as v left join "
-                "search.gcmd_sciencekeywords as g on g.uuid = v.keyword where "
-                "v.dsid = %s and v.vocabulary = 'GCMD'"), (dsid, ))
-        res = metadb_cursor.fetchall()
         dc_data['subjects'] = []
-        for e in res:
+        for e in snapshot.gcmd_variables:
             dc_data['subjects'].append({
                 'subject': e[0],
                 'valueUri': ("https://gcmd.earthdata.nasa.gov/kms/concept/" +
@@ -373,14 +357,7 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
                 'subjectScheme': "GCMD"})
 
         dc_data['dates'] = []
-        metadb_cursor.execute((
-                "select min(p.date_start), min(p.start_flag), max(p."
-                "date_end), min(p.end_flag) from (select cast(date_start as "
-                "text), start_flag, cast(date_end as text), end_flag from "
-                "dssdb.dsperiod where dsid = %s and time_zone = 'BCE') as p "
-                "having min(p.date_start) is not null and max(p.date_end) is "
-                "not null"), (dsid, ))
-        res = metadb_cursor.fetchone()
+        res = snapshot.bce_period
         if res is not None:
             dc_data['dates'].append(
                 {'date': (get_date_from_precision(res[0], res[1], 'BCE') +
@@ -388,16 +365,7 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
                                                            'BCE')),
                  'dateType': "Valid"})
 
-        metadb_cursor.execute((
-                "select min(p.start), min(p.start_flag), max(p.end), max(p."
-                "end_flag), min(p.time_zone) from (select concat(date_start, "
-                "' ', time_start) as start, start_flag, concat(date_end, ' ', "
-                "time_end) as end, end_flag, time_zone from dssdb.dsperiod "
-                "where dsid = %s and date_start between '0001-01-01' and "
-                "'3000-01-01' and date_end between '0001-01-01' and "
-                "'3000-01-01' and time_zone != 'BCE') as p having min(p."
-                "start) is not null and max(p.end) is not null"), (dsid, ))
-        res = metadb_cursor.fetchone()
+        res = snapshot.ce_period
         if res is not None:
             tz = res[4]
             idx = tz.find(",")
@@ -409,15 +377,27 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
                           + get_date_from_precision(res[2], res[3], tz)),
                  'dateType': "Valid"})
 
-        metadb_cursor.execute((
-                "select c.doi_work, w.type, count(a.last_name) from citation."
-                "data_citations_gdex as c left join (select distinct doi from "
-                "dssdb.dsvrsn where dsid = %s) as v on v.doi = c.doi_data "
-                "left join citation.works_authors as a on a.id = c.doi_work "
-                "left join citation.works as w on w.doi = c.doi_work where v."
-                "doi is not null and w.type is not null group by c.doi_work, "
-                "w.type having count(a.last_name) > 0"), (dsid, ))
-        res = metadb_cursor.fetchall()
+        # a citing work is listed if it has a type and an author with a last
+        #   name
+        if 'citation_index' in kwargs and kwargs['citation_index'] is not None:
+            res = [(doi, work.type) for doi, work in
+                   get_citation_works(dsid, metadb_cursor,
+                                      citing_dois=snapshot.citing_dois,
+                                      **kwargs) if
+                   work.type is not None and
+                   any(author[0] is not None for author in work.authors)]
+        else:
+            metadb_cursor.execute((
+                    "select c.doi_work, w.type, count(a.last_name) from "
+                    "citation.data_citations_gdex as c left join (select "
+                    "distinct doi from dssdb.dsvrsn where dsid = %s) as v on "
+                    "v.doi = c.doi_data left join citation.works_authors as a "
+                    "on a.id = c.doi_work left join citation.works as w on w."
+                    "doi = c.doi_work where v.doi is not null and w.type is "
+                    "not null group by c.doi_work, w.type having count(a."
+                    "last_name) > 0"), (dsid, ))
+            res = metadb_cursor.fetchall()
+
         dc_data['relatedIdentifiers'] = []
         for e in res:
             dc_data['relatedIdentifiers'].append({
@@ -444,27 +424,22 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
                 metadb_cursor.execute((
                         "select distinct grid_definition_codes from "
                         "\"WGrML\"." + dsid + "_agrids2"))
-                res = metadb_cursor.fetchall()
+                gvals = CompressedBitmap().union(
+                        *[CompressedBitmap(e[0]) for e in metadb_cursor])
                 min_wlon, min_slat, max_elon, max_nlat = None, None, None, None
-                for e in res:
-                    bvals = uncompress_bitmap_values(e[0])
-                    for val in bvals:
-                        metadb_cursor.execute((
-                                "select definition, def_params from \"WGrML\"."
-                                "grid_definitions where code = %s"),
-                                (str(val), ))
-                        gdef = metadb_cursor.fetchone()
-                        domain = spatial_domain_from_grid_definition(
-                                gdef, centerOn="primeMeridian")
-                        if all(domain):
-                            min_wlon = (domain['wlon'] if min_wlon is None else
-                                        min(domain['wlon'], min_wlon))
-                            min_slat = (domain['slat'] if min_slat is None else
-                                        min(domain['slat'], min_slat))
-                            max_elon = (domain['elon'] if max_elon is None else
-                                        max(domain['elon'], max_elon))
-                            max_nlat = (domain['nlat'] if max_nlat is None else
-                                        max(domain['nlat'], max_nlat))
+                for code, gdef in get_grid_definitions(metadb_cursor,
+                                                       gvals):
+                    domain = spatial_domain_from_grid_definition(
+                            gdef, centerOn="primeMeridian")
+                    if all(domain):
+                        min_wlon = (domain['wlon'] if min_wlon is None else
+                                    min(domain['wlon'], min_wlon))
+                        min_slat = (domain['slat'] if min_slat is None else
+                                    min(domain['slat'], min_slat))
+                        max_elon = (domain['elon'] if max_elon is None else
+                                    max(domain['elon'], max_elon))
+                        max_nlat = (domain['nlat'] if max_nlat is None else
+                                    max(domain['nlat'], max_nlat))
 
                 if min_wlon is not None:
                     dc_data['geoLocations'].append({
@@ -486,29 +461,19 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
                 dc_data['geoLocations'].append({'geoLocationPlace': e[0]})
 
         dc_data['sizes'] = [get_dataset_size(dsid, metadb_cursor)]
-        metadb_cursor.execute((
-                "select distinct keyword from search.formats where dsid = %s"),
-                (dsid, ))
-        res = metadb_cursor.fetchall()
-        dc_data['formats'] = [snake_to_capital(e[0]) for e in res]
+        dc_data['formats'] = [snake_to_capital(e) for e in snapshot.formats]
         license_id = xml_root.find("./dataLicense")
         license_id = "CC-BY-4.0" if license_id is None else license_id.text
+        wagtaildb_conn = get_connection(wagtaildb_settings, "wagtail")
         try:
-            wagtaildb_conn = psycopg2.connect(**wagtaildb_settings)
-            wagtaildb_cursor = wagtaildb_conn.cursor()
-        except psycopg2.Error as err:
-            raise RuntimeError("wagtail database connection error: '{}'"
-                               .format(err))
-
-        wagtaildb_cursor.execute((
-                "select url, name from wagtail2.home_datalicense where id = "
-                "%s"), (license_id, ))
-        res = wagtaildb_cursor.fetchone()
+            res = snapshot.license(license_id, wagtaildb_conn.cursor())
+        finally:
+            put_connection(wagtaildb_conn, wagtaildb_settings)
+
         dc_data['rightsList'] = [{
             'rights': res[1],
             'rightsIdentifier': license_id,
             'rightsUri': res[0]}]
-        wagtaildb_conn.close()
         abstract = xml_root.find("./summary")
         html = etree.tostring(abstract).decode().replace("&amp;", "&")
         dc_data['descriptions'] = [{
@@ -602,4 +567,4 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
 
         return (o, "\n".join(warnings))
     finally:
-        metadb_conn.close()
+        put_connection(metadb_conn, metadb_settings)
@@ -1,25 +1,22 @@
 import os
-import psycopg2
 
 from lxml import etree
 
 from . import settings
-from ..metautils import open_dataset_overview
+from ..dbutils import get_connection, put_connection
+from ..metautils import get_dataset_snapshot, open_dataset_overview
 from ..strutils import snake_to_capital
 from ..xmlutils import convert_html_to_text
 
 
-def export(dsid, metadb_settings, wagtaildb_settings):
-    try:
-        mconn = psycopg2.connect(**metadb_settings)
-        mcursor = mconn.cursor()
-        wconn = psycopg2.connect(**wagtaildb_settings)
-        wcursor = wconn.cursor()
-    except psycopg2.Error as err:
-        raise RuntimeError("metadata database connection error: '{}'"
-                           .format(err))
+def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
+    mconn = get_connection(metadb_settings, "metadata")
+    mcursor = mconn.cursor()
+    wconn = get_connection(wagtaildb_settings, "wagtail")
+    wcursor = wconn.cursor()
 
     try:
+        snapshot = get_dataset_snapshot(dsid, mcursor, **kwargs)
         nsmap = {
             'xsi': "http://www.w3.org/2001/XMLSchema-instance",
         }
@@ -35,10 +32,7 @@ def export(dsid, metadb_settings, wagtaildb_settings):
         idinfo = etree.SubElement(root, "idinfo")
         citeinfo = etree.SubElement(
                 etree.SubElement(idinfo, "citation"), "citeinfo")
-        mcursor.execute((
-                "select type, given_name, middle_name, family_name from "
-                "search.dataset_authors where dsid = %s"), (dsid, ))
-        alist = mcursor.fetchall()
+        alist = snapshot.authors
         authors = []
         if len(alist) > 0:
             for atype, fname, mname, lname in alist:
@@ -53,19 +47,14 @@ def export(dsid, metadb_settings, wagtaildb_settings):
 
                 authors.append(author)
         else:
-            mcursor.execute((
-                    "select g.path from search.contributors_new as c left "
-                    "join search.gcmd_providers as g on g.uuid = c.keyword "
-                    "where c.dsid = %s and c.vocabulary = 'GCMD'"), (dsid, ))
-            clist = mcursor.fetchall()
-            for contributor in clist:
+            for contributor in snapshot.contributors:
                 authors.append(contributor[0])
 
         etree.SubElement(citeinfo, "origin").text = ", ".join(authors)
-        mcursor.execute((
-                "select title, summary, pub_date, continuing_update from "
-                "search.datasets where dsid = %s"), (dsid, ))
-        title, summary, pub_date, progress = mcursor.fetchone()
+        title = snapshot.dataset['title']
+        summary = snapshot.dataset['summary']
+        pub_date = snapshot.dataset['pub_date']
+        progress = snapshot.dataset['continuing_update']
         summary = convert_html_to_text("<summary>" + summary + "</summary>")
         etree.SubElement(citeinfo, "pubdate").text = (
                 str(pub_date).replace("-", ""))
@@ -77,12 +66,10 @@ def export(dsid, metadb_settings, wagtaildb_settings):
                 "Atmospheric Research, Computational and Information Systems "
                 "Laboratory")
         onlink = etree.SubElement(citeinfo, "onlink")
-        mcursor.execute((
-                "select doi from dssdb.dsvrsn where dsid = %s and status = "
-                "'A'"), (dsid, ))
-        doi = mcursor.fetchone()
-        if doi is not None:
-            onlink.text = os.path.join("https://", settings.DOI_DOMAIN, doi[0])
+        dois = snapshot.dois(status="A")
+        if len(dois) > 0:
+            onlink.text = os.path.join("https://", settings.DOI_DOMAIN,
+                                       dois[0])
         else:
             onlink.text = os.path.join("https://", settings.ARCHIVE['domain'],
                                        settings.ARCHIVE['datasets_path'], dsid)
@@ -91,11 +78,7 @@ def export(dsid, metadb_settings, wagtaildb_settings):
         etree.SubElement(descript, "abstract").text = summary
         etree.SubElement(descript, "purpose").text = "Not captured"
         timeperd = etree.SubElement(idinfo, "timeperd")
-        mcursor.execute((
-                "select min(date_start), max(date_end) from dssdb.dsperiod "
-                "where dsid = %s and date_start < '9998-01-01' and date_end < "
-                "'9998-01-01'"), (dsid, ))
-        dates = mcursor.fetchone()
+        dates = snapshot.period_dates
         if dates is not None:
             rngdates = etree.SubElement(
                     etree.SubElement(timeperd, "timeinfo"), "rngdates")
@@ -120,12 +103,7 @@ def export(dsid, metadb_settings, wagtaildb_settings):
             etree.SubElement(status, "update").text = "None planned"
 
         keywords = etree.SubElement(idinfo, "keywords")
-        mcursor.execute((
-                "select g.path from search.variables as v left join search."
-                "gcmd_sciencekeywords as g on g.uuid = v.keyword where v."
-                "dsid = %s and v.vocabulary = 'GCMD'"), (dsid, ))
-        klist = mcursor.fetchall()
-        for keyword in klist:
+        for keyword in snapshot.gcmd_variables:
             etree.SubElement(
                     etree.SubElement(keywords, "theme"), "themekt").text = (
                     "GCMD")
@@ -134,26 +112,17 @@ def export(dsid, metadb_settings, wagtaildb_settings):
                     keyword[0])
 
         accconst = etree.SubElement(idinfo, "accconst")
-        wcursor.execute((
-                "select access_restrict from wagtail2."
-                "dataset_description_datasetdescriptionpage where dsid = %s"),
-                (dsid, ))
-        acc = wcursor.fetchone()
-        if acc is not None and len(acc[0]) > 0:
-            accconst.text = convert_html_to_text(("<access>" + acc[0] +
-                                                  "</access>"))
+        page = snapshot.page(wcursor)
+        if page is not None and len(page['access_restrict']) > 0:
+            accconst.text = convert_html_to_text((
+                    "<access>" + page['access_restrict'] + "</access>"))
         else:
             accconst.text = "None"
 
         useconst = etree.SubElement(idinfo, "useconst")
-        wcursor.execute((
-                "select usage_restrict from wagtail2."
-                "dataset_description_datasetdescriptionpage where dsid = %s"),
-                (dsid, ))
-        use = wcursor.fetchone()
-        if use is not None and len(use[0]) > 0:
-            useconst.text = convert_html_to_text(("<usage>" + use[0] +
-                                                  "</usage>"))
+        if page is not None and len(page['usage_restrict']) > 0:
+            useconst.text = convert_html_to_text((
+                    "<usage>" + page['usage_restrict'] + "</usage>"))
         else:
             useconst.text = "None"
 
@@ -174,7 +143,7 @@ def export(dsid, metadb_settings, wagtaildb_settings):
                 "FGDC Content Standard for Digital Geospatial Metadata")
         etree.SubElement(metainfo, "metstdv").text = "FGDC-STD-001-1998"
     finally:
-        mconn.close()
-        wconn.close()
+        put_connection(mconn, metadb_settings)
+        put_connection(wconn, wagtaildb_settings)
 
     return etree.tostring(root, pretty_print=True).decode("utf-8")
@@ -1,25 +1,22 @@
 import os
-import psycopg2
 
 from lxml import etree
 
 from . import settings
-from ..metautils import (get_dataset_size, get_date_from_precision,
-                         open_dataset_overview)
+from ..dbutils import get_connection, put_connection
+from ..metautils import (get_dataset_size, get_dataset_snapshot,
+                         get_date_from_precision, open_dataset_overview)
 from ..xmlutils import convert_html_to_text
 
 
-def export(dsid, metadb_settings, wagtaildb_settings):
-    try:
-        mconn = psycopg2.connect(**metadb_settings)
-        mcursor = mconn.cursor()
-        wconn = psycopg2.connect(**wagtaildb_settings)
-        wcursor = wconn.cursor()
-    except psycopg2.Error as err:
-        raise RuntimeError("metadata database connection error: '{}'"
-                           .format(err))
+def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
+    mconn = get_connection(metadb_settings, "metadata")
+    mcursor = mconn.cursor()
+    wconn = get_connection(wagtaildb_settings, "wagtail")
+    wcursor = wconn.cursor()
 
     try:
+        snapshot = get_dataset_snapshot(dsid, mcursor, **kwargs)
         publisher_keyword = (
                 "UCAR/NCAR/CISL/DECS > Data Engineering and Curation Section, "
                 "Computational and Information Systems Laboratory, National "
@@ -35,30 +32,22 @@ def export(dsid, metadb_settings, wagtaildb_settings):
                              nsmap=nsmap)
         xml_root = open_dataset_overview(dsid)
         entry_id = etree.SubElement(root, "Entry_ID")
-        mcursor.execute((
-                "select doi from dssdb.dsvrsn where dsid = %s and status = "
-                "'A'"), (dsid, ))
-        doi = mcursor.fetchone()
-        if doi is not None:
-            entry_id.text = "DOI:" + doi[0]
+        dois = snapshot.dois(status="A")
+        if len(dois) > 0:
+            entry_id.text = "DOI:" + dois[0]
         else:
             parts = settings.ARCHIVE['domain'].split(".")
             entry_id.text = ".".join(reversed(parts)) + ":" + dsid
 
-        mcursor.execute((
-                "select title, summary, continuing_update from search."
-                "datasets where dsid = %s"), (dsid, ))
-        title, summary, progress = mcursor.fetchone()
+        title = snapshot.dataset['title']
+        summary = snapshot.dataset['summary']
+        progress = snapshot.dataset['continuing_update']
         summary = convert_html_to_text("<summary>" + summary + "</summary>")
         etree.SubElement(root, "Entry_Title").text = title
         ds_citation = etree.SubElement(root, "Data_Set_Citation")
         creators = []
-        mcursor.execute((
-                "select type, given_name, middle_name, family_name from "
-                "search.dataset_authors where dsid = %s"), (dsid, ))
-        res = mcursor.fetchall()
-        if len(res) > 0:
-            for atype, first, middle, last in res:
+        if len(snapshot.authors) > 0:
+            for atype, first, middle, last in snapshot.authors:
                 if atype == "Person":
                     author = first
                     if len(middle) > 0:
@@ -70,13 +59,8 @@ def export(dsid, metadb_settings, wagtaildb_settings):
                     creators.append(first)
 
         else:
-            mcursor.execute((
-                    "select g.path from search.contributors_new as c left "
-                    "join search.gcmd_providers as g on g.uuid = c.keyword "
-                    "where c.dsid = %s and c.vocabulary = 'GCMD'"), (dsid, ))
-            res = mcursor.fetchall()
-            for contributor, in res:
-                creators.append(contributor)
+            for contributor in snapshot.contributors:
+                creators.append(contributor[0])
 
         etree.SubElement(ds_citation, "Dataset_Creator").text = (
                 ", ".join(creators))
@@ -90,12 +74,7 @@ def export(dsid, metadb_settings, wagtaildb_settings):
         etree.SubElement(personnel, "Role").text = "Technical Contact"
         etree.SubElement(personnel, "Email").text = (
                 settings.ARCHIVE['email'])
-        mcursor.execute((
-                "select g.path from search.variables as v left join search."
-                "gcmd_sciencekeywords as g on g.uuid = v.keyword where v.dsid "
-                "= %s and v.vocabulary = 'GCMD'"), (dsid, ))
-        res = mcursor.fetchall()
-        for e in res:
+        for e in snapshot.gcmd_variables:
             parts = e[0].split(" > ")
             parameters = etree.SubElement(root, "Parameters")
             etree.SubElement(parameters, "Category").text = parts[0]
@@ -113,17 +92,9 @@ def export(dsid, metadb_settings, wagtaildb_settings):
                                 parameters, "Detailed_Variable").text = (
                                 parts[6])
 
-        mcursor.execute((
-                "select keyword from search.topics where dsid = %s and "
-                "vocabulary = 'ISO'"), (dsid, ))
-        iso_topic, = mcursor.fetchone()
-        etree.SubElement(root, "ISO_Topic_Category").text = iso_topic
-        mcursor.execute((
-                "select g.path from search.platforms_new as p left join "
-                "search.gcmd_platforms as g on g.uuid = p.keyword where p."
-                "dsid = %s and p.vocabulary = 'GCMD'"), (dsid, ))
-        res = mcursor.fetchall()
-        for path, in res:
+        etree.SubElement(root, "ISO_Topic_Category").text = (
+                snapshot.iso_topic)
+        for path, _ in snapshot.gcmd_platforms:
             source = etree.SubElement(root, "Source_Name")
             idx = path.find(" > ")
             if idx > 0:
@@ -132,13 +103,7 @@ def export(dsid, metadb_settings, wagtaildb_settings):
             else:
                 etree.SubElement(source, "Short_Name").text = path
 
-        mcursor.execute((
-                "select min(concat(date_start, ' ', time_start)), min("
-                "start_flag), max(concat(date_end, ' ', time_end)), min("
-                "end_flag), min(time_zone) from dssdb.dsperiod where dsid = "
-                "%s and date_start < '9998-01-01' and date_end < "
-                "'9998-01-01'"), (dsid, ))
-        res = mcursor.fetchone()
+        res = snapshot.period
         if res is not None:
             tz = res[4]
             idx = tz.find(",")
@@ -157,15 +122,7 @@ def export(dsid, metadb_settings, wagtaildb_settings):
         else:
             dsprog.text = "Complete"
 
-        mcursor.execute((
-                "select distinct g.path from (select keyword from search."
-                "projects_new where dsid = %(dsid)s and vocabulary = 'GCMD' "
-                "union select keyword from search.supported_projects where "
-                "dsid = %(dsid)s  and vocabulary = 'GCMD') as p left join "
-                "search.gcmd_projects as g on g.uuid = p.keyword"),
-                {'dsid': dsid})
-        res = mcursor.fetchall()
-        for path, in res:
+        for path in snapshot.gcmd_project_paths():
             project = etree.SubElement(root, "Project")
             idx = path.find(" > ")
             if idx > 0:
@@ -174,23 +131,17 @@ def export(dsid, metadb_settings, wagtaildb_settings):
             else:
                 etree.SubElement(project, "Short_Name").text = path
 
-        wcursor.execute((
-                "select access_restrict from wagtail2."
-                "dataset_description_datasetdescriptionpage where dsid = %s"),
-                (dsid, ))
-        access = wcursor.fetchone()
-        if access is not None and len(access[0]) > 0:
+        page = snapshot.page(wcursor)
+        if page is not None and len(page['access_restrict']) > 0:
             etree.SubElement(root, "Access_Constraints").text = (
-                    convert_html_to_text("<access>" + access[0] + "</access>"))
-
-        wcursor.execute((
-                "select usage_restrict from wagtail2."
-                "dataset_description_datasetdescriptionpage where dsid = %s"),
-                (dsid, ))
-        usage = wcursor.fetchone()
-        if usage is not None and len(usage[0]) > 0:
+                    convert_html_to_text("<access>" +
+                                         page['access_restrict'] +
+                                         "</access>"))
+
+        if page is not None and len(page['usage_restrict']) > 0:
             etree.SubElement(root, "Use_Constraints").text = (
-                    convert_html_to_text("<usage>" + usage[0] + "</usage>"))
+                    convert_html_to_text("<usage>" + page['usage_restrict'] +
+                                         "</usage>"))
 
         etree.SubElement(root, "Data_Set_Language").text = "English"
         center = etree.SubElement(root, "Data_Center")
@@ -227,7 +178,7 @@ def export(dsid, metadb_settings, wagtaildb_settings):
         etree.SubElement(root, "Metadata_Name").text = "CEOS IDN DIF"
         etree.SubElement(root, "Metadata_Version").text = "9.7"
     finally:
-        mconn.close()
-        wconn.close()
+        put_connection(mconn, metadb_settings)
+        put_connection(wconn, wagtaildb_settings)
 
     return etree.tostring(root, pretty_print=True).decode("utf-8")
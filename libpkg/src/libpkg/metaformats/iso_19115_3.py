@@ -1,12 +1,12 @@
 import os
-import psycopg2
 
 from datetime import timedelta
 from lxml import etree
 
 from . import settings
+from ..dbutils import get_connection, put_connection
 from ..geospatial import fill_geographic_extent_data
-from ..metautils import get_date_from_precision
+from ..metautils import get_dataset_snapshot, get_date_from_precision
 from ..strutils import snake_to_capital
 from ..xmlutils import convert_html_to_text
 
@@ -100,17 +100,15 @@ def add_contact(root, nsmap):
             codeListValue="browsing").text = "browsing"
 
 
-def add_metadata_date(root, nsmap, cursor, dsid):
+def add_metadata_date(root, nsmap, cursor, snapshot):
     ci_date = (
             etree.SubElement(
                     etree.SubElement(root, "{" + nsmap['mdb'] + "}dateInfo"),
                     "{" + nsmap['cit'] + "}CI_Date"))
-    cursor.execute(("select timestamp_utc from search.datasets where dsid = "
-                    "%s"), (dsid, ))
-    tstamp, = cursor.fetchone()
+    tstamp = snapshot.dataset['timestamp_utc']
     cursor.execute((
            "select max(date_modified + time_modified) from dssdb.wfile_" +
-           dsid))
+           snapshot.dsid))
     fdate, = cursor.fetchone() or (None, )
     if fdate is not None:
         fdate += timedelta(hours=6)
@@ -211,18 +209,10 @@ def add_metadata_linkage(root, nsmap, dsid):
             codeListValue="completeMetadata").text = "completeMetadata"
 
 
-def add_authors(root, nsmap, cursor, dsid):
-    cursor.execute((
-            "select type, given_name, middle_name, family_name from search."
-            "dataset_authors where dsid = %s"), (dsid, ))
-    authors = cursor.fetchall()
+def add_authors(root, nsmap, snapshot):
+    authors = snapshot.authors
     if len(authors) == 0:
-        cursor.execute((
-                "select 'Organization', g.last_in_path from search."
-                "contributors_new as c left join search.gcmd_providers as g "
-                "on g.uuid = c.keyword where c.dsid = %s and c.vocabulary = "
-                "'GCMD'"), (dsid, ))
-        authors = cursor.fetchall()
+        authors = [("Organization", e[3]) for e in snapshot.contributors]
 
     ci_respons = (
             etree.SubElement(
@@ -261,7 +251,7 @@ def add_authors(root, nsmap, cursor, dsid):
                     "{" + nsmap['gco'] + "}CharacterString").text = author[1]
 
 
-def add_extent(root, nsmap, cursor, dsid, geoext):
+def add_extent(root, nsmap, snapshot, geoext):
     extents = {'point': False, 'box': False, 'location': False,
                'temporal': False}
     if all(geoext.values()):
@@ -272,14 +262,8 @@ def add_extent(root, nsmap, cursor, dsid, geoext):
             else:
                 extents['box'] = True
 
-    cursor.execute(("select min(concat(date_start, ' ', time_start)), min("
-                    "start_flag), max(concat(date_end, ' ', time_end)), min("
-                    "end_flag), min(time_zone) from dssdb.dsperiod where dsid "
-                    "= %s and date_start < '9998-01-01' and date_end < "
-                    "'9998-01-01' having length(min(concat("
-                    "date_start, ' ', time_start))) > 0"), (dsid, ))
-    res = cursor.fetchone()
-    if res is not None:
+    res = snapshot.period
+    if res[0] is not None and len(res[0]) > 0:
         extents['temporal'] = True
         tz = res[4]
         idx = tz.find(",")
@@ -334,7 +318,7 @@ def add_extent(root, nsmap, cursor, dsid, geoext):
                                          "}EX_TemporalExtent")),
                                 "{" + nsmap['gex'] + "}extent"),
                         "{" + nsmap['gml'] + "}TimePeriod",
-                        {id: dsid + "_time_period"}, nsmap=nsmap))
+                        {id: snapshot.dsid + "_time_period"}, nsmap=nsmap))
         etree.SubElement(time_period,
                          "{" + nsmap['gml'] + "}beginPosition").text = beg_date
         etree.SubElement(time_period,
@@ -345,12 +329,8 @@ def add_references(root, nsmap):
     pass
 
 
-def add_maint_frequency(root, nsmap, cursor, dsid):
-    cursor.execute((
-            "select update_freq from wagtail2."
-            "dataset_description_datasetdescriptionpage where dsid = %s"),
-            (dsid, ))
-    freq, = cursor.fetchone()
+def add_maint_frequency(root, nsmap, page):
+    freq = page['update_freq']
     if freq == "Bi-monthly":
         freq = "monthly"
     elif freq == "Half-yearly":
@@ -396,12 +376,8 @@ def add_graphic_overview(root, nsmap, graphic):
                     graphic[(graphic.rfind(".")+1):])
 
 
-def add_data_formats(root, nsmap, cursor, dsid):
-    cursor.execute((
-            "select distinct keyword from search.formats where dsid = %s"),
-            (dsid, ))
-    dfmts = cursor.fetchall()
-    for dfmt in dfmts:
+def add_data_formats(root, nsmap, snapshot):
+    for dfmt in snapshot.formats:
         ci_citation = (
                 etree.SubElement(
                         etree.SubElement(
@@ -416,49 +392,31 @@ def add_data_formats(root, nsmap, cursor, dsid):
         etree.SubElement(
                 etree.SubElement(ci_citation, "{" + nsmap['cit'] + "}title"),
                 "{" + nsmap['gco'] + "}CharacterString").text = (
-                        snake_to_capital(dfmt[0]))
+                        snake_to_capital(dfmt))
 
 
-def add_gcmd_keywords(root, nsmap, cursor, dsid, concept):
-    cursor.execute((
-            "select version from search.gcmd_versions where concept_scheme = "
-            "%s"), (concept, ))
-    edition, = cursor.fetchone()
+def add_gcmd_keywords(root, nsmap, snapshot, concept):
+    edition = snapshot.gcmd_versions[concept][1]
     concept_map = {
         'sciencekeywords': {
-            'db_tables': ["variables"],
+            'keywords': [e[0] for e in snapshot.gcmd_variables],
             'list_type': "Science and Services",
         },
         'platforms': {
-            'db_tables': ["platforms_new"],
+            'keywords': [e[0] for e in snapshot.gcmd_platforms],
             'list_type': "Platforms",
         },
         'projects': {
-            'db_tables': ["projects_new", "supported_projects",
-                          "gcmd_projects"],
+            'keywords': snapshot.gcmd_project_paths(),
             'list_type': "Projects",
         },
         'instruments': {
-            'db_tables': ["instruments"],
+            'keywords': [e[0] for e in snapshot.gcmd_instruments],
             'list_type': "Instruments",
         },
     }
-    if len(concept_map[concept]['db_tables']) > 1:
-        ulst = [("select keyword from search." + e + " where dsid = %(dsid)s "
-                 "and vocabulary = 'GCMD'") for e in
-                concept_map[concept]['db_tables'][0:-1]]
-        union = " union ".join(ulst)
-        q = ("select distinct g.path from (" + union + ") as p left join "
-             "search." + concept_map[concept]['db_tables'][-1] + " as g on g."
-             "uuid = p.keyword")
-    else:
-        q = ("select g.path from search." +
-             concept_map[concept]['db_tables'][0] + " as v left join search."
-             "gcmd_" + concept + " as g on g.uuid = v.keyword where v.dsid = "
-             "%(dsid)s and v.vocabulary = 'GCMD'")
-
-    cursor.execute(q, {'dsid': dsid})
-    keywords = cursor.fetchall()
+    # the keywords are all in the dataset snapshot
+    keywords = concept_map[concept]['keywords']
     if len(keywords) == 0:
         return
 
@@ -468,7 +426,7 @@ def add_gcmd_keywords(root, nsmap, cursor, dsid, concept):
                             root,
                             "{" + nsmap['mri'] + "}descriptiveKeywords"),
                     "{" + nsmap['mri'] + "}MD_Keywords"))
-    for keyword, in keywords:
+    for keyword in keywords:
         etree.SubElement(
                 etree.SubElement(md_keywords, "{" + nsmap['mri'] + "}keyword"),
                 "{" + nsmap['gco'] + "}CharacterString").text = keyword
@@ -505,19 +463,16 @@ def add_gcmd_keywords(root, nsmap, cursor, dsid, concept):
                         " Keywords")
 
 
-def add_constraints(root, nsmap, cursor, dsid):
+def add_constraints(root, nsmap, page):
     md_constraints = (
             etree.SubElement(
                     etree.SubElement(
                             root, "{" + nsmap['mri'] + "}resourceConstraints"),
                     "{" + nsmap['mco'] + "}MD_LegalConstraints"))
-    cursor.execute(("select access_restrict from wagtail2."
-                    "dataset_description_datasetdescriptionpage "
-                    "where dsid = %s"), (dsid, ))
-    access = cursor.fetchone()
-    if access is not None and len(access[0]) > 0:
+    if page is not None and len(page['access_restrict']) > 0:
         code = "otherRestrictions"
-        access = convert_html_to_text("<access>" + access[0] + "</access>")
+        access = convert_html_to_text(
+                "<access>" + page['access_restrict'] + "</access>")
         etree.SubElement(
                 etree.SubElement(
                         md_constraints, "{" + nsmap['mco'] + "}useLimitation"),
@@ -532,11 +487,7 @@ def add_constraints(root, nsmap, cursor, dsid):
             codeList=("http://standards.iso.org/iso/19115/resources/Codelists/"
                       "cat/codelists.xml#MD_RestrictionCode"),
             codeListValue=code).text = code
-    cursor.execute(("select usage_restrict from wagtail2."
-                    "dataset_description_datasetdescriptionpage "
-                    "where dsid = %s"), (dsid, ))
-    usage = cursor.fetchone()
-    if usage is not None and len(usage[0]) > 0:
+    if page is not None and len(page['usage_restrict']) > 0:
         md_constraints = (
                 etree.SubElement(
                         etree.SubElement(
@@ -553,14 +504,9 @@ def add_constraints(root, nsmap, cursor, dsid):
                 codeListValue="otherRestrictions").text = "otherRestrictions"
 
 
-def add_associated_resources(root, nsmap, cursor, dsid):
-    cursor.execute((
-            "select related_rsrc_list from wagtail2."
-            "dataset_description_datasetdescriptionpage where dsid = %s"),
-            (dsid, ))
-    rsrcs = cursor.fetchone()
-    if rsrcs is not None and len(rsrcs) > 0:
-        for rsrc in rsrcs[0]:
+def add_associated_resources(root, nsmap, page):
+    if page is not None:
+        for rsrc in page['related_rsrc_list']:
             ci_citation = (
                 etree.SubElement(
                         etree.SubElement(
@@ -590,10 +536,12 @@ def add_associated_resources(root, nsmap, cursor, dsid):
                     "{" + nsmap['gco'] + "}CharacterString").text = rsrc['url']
 
 
-def add_data_identification(root, nsmap, mcursor, wcursor, dsid):
-    mcursor.execute(("select title, summary, pub_date, continuing_update from "
-                     "search.datasets where dsid = %s"), (dsid, ))
-    title, abstract, pub_date, progress = mcursor.fetchone()
+def add_data_identification(root, nsmap, mcursor, wcursor, snapshot):
+    dsid = snapshot.dsid
+    title = snapshot.dataset['title']
+    abstract = snapshot.dataset['summary']
+    pub_date = snapshot.dataset['pub_date']
+    progress = snapshot.dataset['continuing_update']
     abstract = convert_html_to_text(
             "<abstract>" + abstract + "</abstract>")
     progress = "onGoing" if progress == "Y" else "completed"
@@ -625,11 +573,8 @@ def add_data_identification(root, nsmap, mcursor, wcursor, dsid):
             codeList=("http://standards.iso.org/iso/19115/-3/cit/1.0/"
                       "codelists.html#CI_DateTypeCode"),
             codeListValue="publication").text = "publication"
-    mcursor.execute((
-            "select doi from dssdb.dsvrsn where dsid = %s and status = 'A'"),
-            (dsid, ))
-    doi = mcursor.fetchone()
-    if doi is not None:
+    doi = snapshot.dois(status="A")
+    if len(doi) > 0:
         md_ident = (
                 etree.SubElement(
                         etree.SubElement(ci_citation,
@@ -652,7 +597,7 @@ def add_data_identification(root, nsmap, mcursor, wcursor, dsid):
                 etree.SubElement(md_ident, "{" + nsmap['mcc'] + "}codeSpace"),
                 "{" + nsmap['gco'] + "}CharacterString").text = "doi"
 
-    add_authors(ci_citation, nsmap, mcursor, dsid)
+    add_authors(ci_citation, nsmap, snapshot)
     etree.SubElement(
             etree.SubElement(data_ident, "{" + nsmap['mri'] + "}abstract"),
             "{" + nsmap['gco'] + "}CharacterString").text = abstract
@@ -724,28 +669,23 @@ def add_data_identification(root, nsmap, mcursor, wcursor, dsid):
                     "{" + nsmap['gco'] + "}Distance",
                     uom=val['uom']).text = val['dist']
 
-    add_extent(data_ident, nsmap, mcursor, dsid, geoext)
+    add_extent(data_ident, nsmap, snapshot, geoext)
     add_references(data_ident, nsmap)
+    page = snapshot.page(wcursor)
     if progress == "onGoing":
-        add_maint_frequency(data_ident, nsmap, wcursor, dsid)
-
-    wcursor.execute((
-            "select dslogo from wagtail2."
-            "dataset_description_datasetdescriptionpage where dsid = %s"),
-            (dsid, ))
-    logo = wcursor.fetchone()
-    if logo is not None:
-        logo = logo[0]
+        add_maint_frequency(data_ident, nsmap, page)
+
+    if page is not None:
+        logo = page['dslogo']
         if len(logo) > 0 and logo.find("default") != 0:
             add_graphic_overview(data_ident, nsmap, logo)
 
-    add_data_formats(data_ident, nsmap, mcursor, dsid)
-    add_gcmd_keywords(data_ident, nsmap, mcursor, dsid, "sciencekeywords")
-    add_gcmd_keywords(data_ident, nsmap, mcursor, dsid, "platforms")
-    add_gcmd_keywords(data_ident, nsmap, mcursor, dsid, "projects")
-    add_gcmd_keywords(data_ident, nsmap, mcursor, dsid, "instruments")
-    add_constraints(data_ident, nsmap, wcursor, dsid)
-    add_associated_resources(data_ident, nsmap, wcursor, dsid)
+    add_data_formats(data_ident, nsmap, snapshot)
+    for concept in ("sciencekeywords", "platforms", "projects",
+                    "instruments"):
+        add_gcmd_keywords(data_ident, nsmap, snapshot, concept)
+    add_constraints(data_ident, nsmap, page)
+    add_associated_resources(data_ident, nsmap, page)
 
 
 def add_distribution_info(root, nsmap, dsid):
@@ -827,16 +767,13 @@ def add_distribution_info(root, nsmap, dsid):
             codeListValue="download").text = "download"
 
 
-def export(dsid, metadb_settings, wagtaildb_settings):
-    try:
-        mconn = psycopg2.connect(**metadb_settings)
-        mcursor = mconn.cursor()
-        wconn = psycopg2.connect(**wagtaildb_settings)
-        wcursor = wconn.cursor()
-    except psycopg2.Error as err:
-        raise RuntimeError("metadata database connection error: '{}'"
-                           .format(err))
+def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
+    mconn = get_connection(metadb_settings, "metadata")
+    mcursor = mconn.cursor()
+    wconn = get_connection(wagtaildb_settings, "wagtail")
+    wcursor = wconn.cursor()
     try:
+        snapshot = get_dataset_snapshot(dsid, mcursor, **kwargs)
         nsmap = {
             'mdb': "http://standards.iso.org/iso/19115/-3/mdb/1.0",
             'cit': "http://standards.iso.org/iso/19115/-3/cit/1.0",
@@ -861,14 +798,14 @@ def export(dsid, metadb_settings, wagtaildb_settings):
                 nsmap=nsmap)
         add_metadata_identifier(root, nsmap, dsid)
         add_contact(root, nsmap)
-        add_metadata_date(root, nsmap, mcursor, dsid)
+        add_metadata_date(root, nsmap, mcursor, snapshot)
         add_metadata_standard(root, nsmap)
         add_alt_metadata_ref(root, nsmap)
         add_metadata_linkage(root, nsmap, dsid)
-        add_data_identification(root, nsmap, mcursor, wcursor, dsid)
+        add_data_identification(root, nsmap, mcursor, wcursor, snapshot)
         add_distribution_info(root, nsmap, dsid)
     finally:
-        mconn.close()
-        wconn.close()
+        put_connection(mconn, metadb_settings)
+        put_connection(wconn, wagtaildb_settings)
 
     return etree.tostring(root, pretty_print=True).decode("utf-8")
@@ -1,12 +1,13 @@
 import os
-import psycopg2
 
 from datetime import datetime, timedelta
 from lxml import etree
 
 from . import settings
+from ..dbutils import get_connection, put_connection
 from ..geospatial import fill_geographic_extent_data
 from ..metautils import (get_dataset_size,
+                         get_dataset_snapshot,
                          get_date_from_precision,
                          metadata_date,
                          open_dataset_overview)
@@ -128,15 +129,14 @@ def add_metadata_standard(root, nsmap):
             "ISO19115:2003/Cor 1 2006")
 
 
-def add_dataset_uri(root, nsmap, dsid, cursor):
-    cursor.execute(("select doi from dssdb.dsvrsn where dsid = %s and status "
-                    "= 'A'"), (dsid, ))
-    res = cursor.fetchone()
-    if res is not None:
-        ds_uri = os.path.join("https://", settings.DOI_DOMAIN, res[0])
+def add_dataset_uri(root, nsmap, snapshot):
+    dois = snapshot.dois(status="A")
+    if len(dois) > 0:
+        ds_uri = os.path.join("https://", settings.DOI_DOMAIN, dois[0])
     else:
         ds_uri = os.path.join("https://", settings.ARCHIVE['domain'],
-                              settings.ARCHIVE['datasets_path'], dsid)
+                              settings.ARCHIVE['datasets_path'],
+                              snapshot.dsid)
 
     etree.SubElement(
             etree.SubElement(root, "{" + nsmap['gmd'] + "}dataSetURI"),
@@ -180,8 +180,8 @@ def add_related_resources(root, nsmap, related_resources):
                 related_resources[x].text)
 
 
-def add_di_citation(root, nsmap, nil_reason, dsid, authors, cursor, title,
-                    pub_date):
+def add_di_citation(root, nsmap, nil_reason, dsid, authors, contributors,
+                    title, pub_date):
     ci_citation = etree.SubElement(
             etree.SubElement(root, "{" + nsmap['gmd'] + "}citation"),
             "{" + nsmap['gmd'] + "}CI_Citation")
@@ -229,16 +229,11 @@ def add_di_citation(root, nsmap, nil_reason, dsid, authors, cursor, title,
             author_list.append({'type': "O", 'name': author.get("name")})
 
     if len(author_list) == 0:
-        cursor.execute(("select g.path from search.contributors_new as c "
-                        "left join search.gcmd_providers as g on g.uuid = c."
-                        "keyword where c.dsid = %s and c.vocabulary "
-                        "= 'GCMD'"), (dsid, ))
-        res = cursor.fetchall()
-        if len(res) == 0:
+        if len(contributors) == 0:
             raise RuntimeError(("no authors or contributors could be "
                                 "identified"))
 
-        for e in res:
+        for e in contributors:
             author_list.append({
                 'type': "O",
                 'name': e[0][(e[0].find(" > ")+3):]})
@@ -418,7 +413,7 @@ def add_di_resource_formats(root, nsmap, nil_reason, formats):
                 etree.SubElement(
                         md_format, "{" + nsmap['gmd'] + "}name"),
                 "{" + nsmap['gco'] + "}CharacterString").text = (
-                snake_to_capital(e[0].replace("proprietary_", "")))
+                snake_to_capital(e.replace("proprietary_", "")))
         etree.SubElement(md_format, "{" + nsmap['gmd'] + "}version",
                          {nil_reason: "inapplicable"},
                          nsmap=nsmap)
@@ -490,36 +485,27 @@ def add_di_keywords(root, nsmap, keywords, **kwargs):
                     kwargs['otherDetails'])
 
 
-def add_di_resource_constraints(root, nsmap, dsid, cursor):
+def add_di_resource_constraints(root, nsmap, page):
     md_legalconstraints = etree.SubElement(
             etree.SubElement(
                     root, "{" + nsmap['gmd'] + "}resourceConstraints"),
             "{" + nsmap['gmd'] + "}MD_LegalConstraints")
-    cursor.execute(("select usage_restrict from wagtail2."
-                    "dataset_description_datasetdescriptionpage where "
-                    "dsid = %s"), (dsid, ))
-    usage = cursor.fetchone()
-    if usage is not None and len(usage[0]) > 0:
-        usage = convert_html_to_text("<usage>" + usage[0] + "</usage>")
+    if page is not None and len(page['usage_restrict']) > 0:
+        usage = convert_html_to_text(
+                "<usage>" + page['usage_restrict'] + "</usage>")
     else:
-        cursor.execute(("select data_license from wagtail2."
-                        "dataset_description_datasetdescriptionpage "
-                        "where dsid = %s"), (dsid, ))
-        usage = cursor.fetchone()[0]['name']
+        usage = page['data_license']['name']
 
     etree.SubElement(
             etree.SubElement(
                     md_legalconstraints,
                     "{" + nsmap['gmd'] + "}useLimitation"),
             "{" + nsmap['gco'] + "}CharacterString").text = usage
-    cursor.execute(("select access_restrict from wagtail2."
-                    "dataset_description_datasetdescriptionpage "
-                    "where dsid = %s"), (dsid, ))
-    access = cursor.fetchone()
-    if access is None or len(access[0]) == 0:
+    if page is None or len(page['access_restrict']) == 0:
         access = "None"
     else:
-        access = convert_html_to_text("<access>" + access[0] + "</access>")
+        access = convert_html_to_text(
+                "<access>" + page['access_restrict'] + "</access>")
 
     etree.SubElement(
             etree.SubElement(
@@ -577,14 +563,9 @@ def add_di_topic_category(root, nsmap, topic):
             "{" + nsmap['gmd'] + "}MD_TopicCategoryCode").text = topic
 
 
-def get_di_temporal_extent(dsid, cursor):
-    cursor.execute(("select min(concat(date_start, ' ', time_start)), min("
-                    "start_flag), max(concat(date_end, ' ', time_end)), min("
-                    "end_flag), min(time_zone) from dssdb.dsperiod where dsid "
-                    "= %s and date_start < '9998-01-01' and date_end < "
-                    "'9998-01-01'"), (dsid, ))
-    res = cursor.fetchone()
-    if res is None or not all(res):
+def get_di_temporal_extent(snapshot):
+    res = snapshot.period
+    if not all(res):
         return (False, None, None)
 
     tz = res[4]
@@ -676,16 +657,18 @@ def add_di_extent(root, nsmap, dsid, geoext, tempext):
 
 
 def add_data_identification(root, nsmap, nil_reason, dsid, mcursor, wcursor,
-                            xml_root):
+                            xml_root, snapshot):
     md_dataidentification = etree.SubElement(
             etree.SubElement(
                     root, "{" + nsmap['gmd'] + "}identificationInfo"),
             "{" + nsmap['gmd'] + "}MD_DataIdentification")
-    mcursor.execute(("select title, summary, pub_date, continuing_update from "
-                     "search.datasets where dsid = %s"), (dsid, ))
-    title, abstract, pub_date, progress = mcursor.fetchone()
+    title = snapshot.dataset['title']
+    abstract = snapshot.dataset['summary']
+    pub_date = snapshot.dataset['pub_date']
+    progress = snapshot.dataset['continuing_update']
     add_di_citation(md_dataidentification, nsmap, nil_reason, dsid,
-                    xml_root.findall("./author"), mcursor, title, pub_date)
+                    xml_root.findall("./author"), snapshot.contributors,
+                    title, pub_date)
     add_di_abstract(md_dataidentification, nsmap,
                     convert_html_to_text((
                             "<summary>" + abstract + "</summary>")))
@@ -698,10 +681,8 @@ def add_data_identification(root, nsmap, nil_reason, dsid, mcursor, wcursor,
     if logo is not None:
         add_di_graphic_overview(md_dataidentification, nsmap, logo)
 
-    mcursor.execute(("select distinct keyword from search.formats where "
-                     "dsid = %s"), (dsid, ))
-    formats = mcursor.fetchall()
-    add_di_resource_formats(md_dataidentification, nsmap, nil_reason, formats)
+    add_di_resource_formats(md_dataidentification, nsmap, nil_reason,
+                            snapshot.formats)
     # DataCite resource type
     add_di_keywords(md_dataidentification, nsmap,
                     ["dataset"],
@@ -710,16 +691,9 @@ def add_data_identification(root, nsmap, nil_reason, dsid, mcursor, wcursor,
                     edition="4.4",
                     orgName="DataCite Metadata Working Group",
                     otherDetails="resourceTypeGeneral")
-    mcursor.execute(("select g.path from search.platforms_new as p left "
-                     "join search.gcmd_platforms as g on g.uuid = p."
-                     "keyword where dsid = %s and p.vocabulary = 'GCMD'"),
-                    (dsid, ))
-    platforms = mcursor.fetchall()
+    platforms = snapshot.gcmd_platforms
     if len(platforms) > 0:
-        mcursor.execute(("select revision_date, version from search."
-                         "gcmd_versions where concept_scheme = "
-                         "'platforms'"))
-        res = mcursor.fetchone()
+        res = snapshot.gcmd_versions['platforms']
         add_di_keywords(md_dataidentification, nsmap,
                         [e[0] for e in platforms],
                         title=settings.GCMD['title'],
@@ -729,16 +703,9 @@ def add_data_identification(root, nsmap, nil_reason, dsid, mcursor, wcursor,
                         orgName=settings.GCMD['org_name'],
                         otherDetails="Valids List: Platforms")
 
-    mcursor.execute(("select g.path from search.instruments as i left "
-                     "join search.gcmd_instruments as g on g.uuid = i."
-                     "keyword where i.dsid = %s and i.vocabulary = "
-                     "'GCMD'"), (dsid, ))
-    instrs = mcursor.fetchall()
+    instrs = snapshot.gcmd_instruments
     if len(instrs) > 0:
-        mcursor.execute(("select revision_date, version from search."
-                         "gcmd_versions where concept_scheme = "
-                         "'instruments'"))
-        res = mcursor.fetchone()
+        res = snapshot.gcmd_versions['instruments']
         add_di_keywords(md_dataidentification, nsmap,
                         [e[0] for e in instrs],
                         title=settings.GCMD['title'],
@@ -748,20 +715,11 @@ def add_data_identification(root, nsmap, nil_reason, dsid, mcursor, wcursor,
                         orgName=settings.GCMD['org_name'],
                         otherDetails="Valids List: Instruments")
 
-    mcursor.execute(("select distinct g.path from (select keyword from "
-                     "search.projects_new where dsid = %s and vocabulary "
-                     "= 'GCMD' union select keyword from search."
-                     "supported_projects where dsid = %s  and vocabulary "
-                     "= 'GCMD') as p left join search.gcmd_projects as g "
-                     "on g.uuid = p.keyword"), (dsid, dsid))
-    projects = mcursor.fetchall()
+    projects = snapshot.gcmd_project_paths()
     if len(projects) > 0:
-        mcursor.execute(("select revision_date, version from search."
-                         "gcmd_versions where concept_scheme = "
-                         "'projects'"))
-        res = mcursor.fetchone()
+        res = snapshot.gcmd_versions['projects']
         add_di_keywords(md_dataidentification, nsmap,
-                        [e[0] for e in projects],
+                        projects,
                         title=settings.GCMD['title'],
                         alternateTitle=settings.GCMD['alternate_title'],
                         revisionDate=res[0],
@@ -769,15 +727,8 @@ def add_data_identification(root, nsmap, nil_reason, dsid, mcursor, wcursor,
                         orgName=settings.GCMD['org_name'],
                         otherDetails="Valids List: Projects")
 
-    mcursor.execute(("select g.path from search.variables as v left join "
-                     "search.gcmd_sciencekeywords as g on g.uuid = v."
-                     "keyword where v.dsid = %s and v.vocabulary = "
-                     "'GCMD'"), (dsid, ))
-    vars = mcursor.fetchall()
-    mcursor.execute(("select revision_date, version from search."
-                     "gcmd_versions where concept_scheme = "
-                     "'sciencekeywords'"))
-    res = mcursor.fetchone()
+    vars = snapshot.gcmd_variables
+    res = snapshot.gcmd_versions['sciencekeywords']
     add_di_keywords(md_dataidentification, nsmap,
                     [e[0] for e in vars],
                     title=settings.GCMD['title'],
@@ -787,7 +738,8 @@ def add_data_identification(root, nsmap, nil_reason, dsid, mcursor, wcursor,
                     orgName=settings.GCMD['org_name'],
                     otherDetails="Valids List: Science and Services Keywords")
 
-    add_di_resource_constraints(md_dataidentification, nsmap, dsid, wcursor)
+    add_di_resource_constraints(md_dataidentification, nsmap,
+                                snapshot.page(wcursor))
     geoext = fill_geographic_extent_data(dsid, mcursor)
     if 'is_grid' in geoext and geoext['is_grid']:
         add_di_spatial_representation_type(
@@ -798,11 +750,8 @@ def add_data_identification(root, nsmap, nil_reason, dsid, mcursor, wcursor,
 
     add_di_language(md_dataidentification, nsmap)
     add_di_charset(md_dataidentification, nsmap)
-    mcursor.execute(("select keyword from search.topics where dsid = %s "
-                     "and vocabulary = 'ISO'"), (dsid, ))
-    res = mcursor.fetchone()
-    add_di_topic_category(md_dataidentification, nsmap, res[0])
-    tempext = get_di_temporal_extent(dsid, mcursor)
+    add_di_topic_category(md_dataidentification, nsmap, snapshot.iso_topic)
+    tempext = get_di_temporal_extent(snapshot)
     add_di_extent(md_dataidentification, nsmap, dsid, geoext, tempext)
 
 
@@ -955,22 +904,16 @@ def add_metadata_info(root, nsmap):
             codeListValue="asNeeded").text = "asNeeded"
 
 
-def export(dsid, metadb_settings, wagtaildb_settings):
+def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
+    mconn = get_connection(metadb_settings, "metadata")
+    mcursor = mconn.cursor()
+    wconn = get_connection(wagtaildb_settings, "wagtail")
+    wcursor = wconn.cursor()
     try:
-        mconn = psycopg2.connect(**metadb_settings)
-        mcursor = mconn.cursor()
-        wconn = psycopg2.connect(**wagtaildb_settings)
-        wcursor = wconn.cursor()
-    except psycopg2.Error as err:
-        raise RuntimeError("metadata database connection error: '{}'"
-                           .format(err))
-    try:
-        mcursor.execute(("select title, summary, pub_date, continuing_update "
-                         "from search.datasets where dsid = %s"), (dsid, ))
-        title, abstract, pub_date, progress = mcursor.fetchone()
-        abstract = convert_html_to_text(
-                "<abstract>" + abstract + "</abstract>")
-        progress = "onGoing" if progress == "Y" else "completed"
+        snapshot = get_dataset_snapshot(dsid, mcursor, **kwargs)
+        if snapshot.dataset is None:
+            raise RuntimeError("dataset doesn't exist or could not be found")
+
         nsmap = {
             'gmd': "http://www.isotc211.org/2005/gmd",
             'gco': "http://www.isotc211.org/2005/gco",
@@ -997,23 +940,23 @@ def export(dsid, metadb_settings, wagtaildb_settings):
         add_charset(root, nsmap)
         add_hierarchy_level(root, nsmap)
         add_contact(root, nsmap)
-        mdate = metadata_date(dsid, mcursor)
+        mdate = metadata_date(dsid, mcursor, snapshot=snapshot)
         if mdate is not None:
             add_date_stamp(root, nsmap, mdate.strftime("%Y-%m-%dT%H:%M:%SZ"))
 
         add_metadata_standard(root, nsmap)
-        add_dataset_uri(root, nsmap, dsid, mcursor)
+        add_dataset_uri(root, nsmap, snapshot)
         lst = xml_root.findall("./relatedResource")
         if len(lst) > 0:
             add_related_resources(root, nsmap, lst)
 
         add_data_identification(root, nsmap, nil_reason, dsid, mcursor,
-                                wcursor, xml_root)
+                                wcursor, xml_root, snapshot)
         size = get_dataset_size(dsid, mcursor, valueOnly="Mbytes")
         add_distribution_info(root, nsmap, dsid, size)
         add_metadata_info(root, nsmap)
     finally:
-        mconn.close()
-        wconn.close()
+        put_connection(mconn, metadb_settings)
+        put_connection(wconn, wagtaildb_settings)
 
     return etree.tostring(root, pretty_print=True).decode("utf-8")
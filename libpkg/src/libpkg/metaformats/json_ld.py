@@ -1,41 +1,32 @@
 import json
 import os
-import psycopg2
 
 from . import settings
+from ..dbutils import get_connection, put_connection
 from ..geospatial import fill_geographic_extent_data
-from ..metautils import open_dataset_overview
+from ..metautils import get_dataset_snapshot, open_dataset_overview
 from ..xmlutils import convert_html_to_text
 
 
 def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
-    try:
-        mconn = psycopg2.connect(**metadb_settings)
-        mcursor = mconn.cursor()
-    except psycopg2.Error as err:
-        raise RuntimeError("metadata database connection error: '{}'"
-                           .format(err))
-
-    try:
-        wconn = psycopg2.connect(**wagtaildb_settings)
-        wcursor = wconn.cursor()
-    except psycopg2.Error as err:
-        raise RuntimeError("wagtail database connection error: '{}'"
-                           .format(err))
+    mconn = get_connection(metadb_settings, "metadata")
+    mcursor = mconn.cursor()
+    wconn = get_connection(wagtaildb_settings, "wagtail")
+    wcursor = wconn.cursor()
 
     try:
-        mcursor.execute(("select s.title, s.summary, s.pub_date, v.doi from "
-                         "search.datasets as s left join dssdb.dsvrsn as v on "
-                         "v.dsid = s.dsid where s.dsid = %s and v.end_date is "
-                         "null"), (dsid, ))
-        res = mcursor.fetchone()
-        if res is None:
+        snapshot = get_dataset_snapshot(dsid, mcursor, **kwargs)
+        dois = snapshot.dois(current=True)
+        if snapshot.dataset is None or (len(dois) == 0 and
+                                        len(snapshot.versions) > 0):
             raise RuntimeError("dataset doesn't exist or could not be found")
 
+        res = snapshot.dataset
         summary = convert_html_to_text(
-                "<summary>" + res[1].replace("&amp;", "&") + "</summary>")
-        if res[3] is not None and len(res[3]) > 0:
-            id = os.path.join("https://", settings.DOI_DOMAIN, res[3])
+                "<summary>" + res['summary'].replace("&amp;", "&") +
+                "</summary>")
+        if len(dois) > 0 and dois[0] is not None and len(dois[0]) > 0:
+            id = os.path.join("https://", settings.DOI_DOMAIN, dois[0])
         else:
             id = os.path.join("https://", settings.ARCHIVE['domain'],
                               settings.ARCHIVE['datasets_path'], dsid)
@@ -51,13 +42,13 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
             },
             '@type': "Dataset",
             '@id': id,
-            'name': res[0],
+            'name': res['title'],
             'description': summary,
             'publisher': {
                 '@type': "Organization",
                 'name': settings.ARCHIVE['pub_name']['default']['name'],
             },
-            'datePublished': str(res[2]),
+            'datePublished': str(res['pub_date']),
             'author': {},
         }
         xml_root = open_dataset_overview(dsid)
@@ -81,17 +72,11 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
                 alst.append(d)
 
         else:
-            mcursor.execute(("select g.path, c.contact from search."
-                             "contributors_new as c left join search."
-                             "gcmd_providers as g on g.uuid = c.keyword where "
-                             "c.dsid = %s and c.vocabulary = 'GCMD'"),
-                            (dsid, ))
-            res = mcursor.fetchall()
-            for e in res:
+            for e in snapshot.contributors:
                 name_parts = e[0].split(" > ")
                 if name_parts[-1] == "UNAFFILIATED INDIVIDUAL":
-                    if len(e[1]) > 0:
-                        contact_parts = e[1].split(",")
+                    if len(e[2]) > 0:
+                        contact_parts = e[2].split(",")
                         d = {
                                 '@type': "Person",
                                 'name': contact_parts[0],
@@ -117,24 +102,17 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
         else:
             jsonld_data['author'].update(alst[0])
 
-        mcursor.execute(("select g.path from search.variables as v left join "
-                         "search.gcmd_sciencekeywords as g on g.uuid = v."
-                         "keyword where v.dsid = %s and v.vocabulary = "
-                         "'GCMD'"), (dsid, ))
-        res = mcursor.fetchall()
+        res = snapshot.gcmd_variables
         if len(res) > 0:
             if len(res) > 1:
                 jsonld_data['keywords'] = [e[0] for e in res]
             else:
                 jsonld_data['keywords'] = res[0][0]
 
-        mcursor.execute(("select min(date_start), min(time_start), max("
-                         "date_end), max(time_end), min(start_flag), min("
-                         "time_zone) from dssdb.dsperiod where dsid = %s and "
-                         "date_start < '9998-01-01' and date_end < "
-                         "'9998-01-01' group by dsid"), (dsid, ))
-        res = mcursor.fetchone()
-        if res is not None:
+        if snapshot.period[0] is not None:
+            res = (snapshot.period_dates[0], snapshot.period_times[0],
+                   snapshot.period_dates[1], snapshot.period_times[1],
+                   snapshot.period[1], snapshot.period[4])
             num_parts = int(res[4])
             sdate = str(res[0])
             edate = str(res[2])
@@ -180,10 +158,7 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
         else:
             license = license.text
 
-        wcursor.execute((
-                "select url from wagtail2.home_datalicense where id = %s"),
-                (license, ))
-        url = wcursor.fetchone()
+        url = snapshot.license(license, wcursor)
         if url is not None:
             jsonld_data['license'] = url[0]
         else:
@@ -191,8 +166,8 @@ def export(dsid, metadb_settings, wagtaildb_settings, **kwargs):
                                 "identified"))
 
     finally:
-        mconn.close()
-        wconn.close()
+        put_connection(mconn, metadb_settings)
+        put_connection(wconn, wagtaildb_settings)
 
     indent = kwargs['indent'] if 'indent' in kwargs else None
     return json.dumps(jsonld_data, indent=indent)
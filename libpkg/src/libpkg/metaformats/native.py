@@ -1,11 +1,13 @@
-import psycopg2
-
 from lxml import etree
 
-from ..metautils import get_date_from_precision, open_dataset_overview
+from ..dbutils import get_connection, put_connection
+from ..metautils import (get_dataset_snapshot, get_date_from_precision,
+                         open_dataset_overview)
 
 
-def convert_gcmd_uuids(dsid, xml_root, element, concept, cursor, table):
+def convert_gcmd_uuids(xml_root, element, keywords):
+    # replaces the GCMD 'element's of the overview with one for each of the
+    #   (path, uuid) 'keywords'
     els = xml_root.findall("./" + element + "[@vocabulary='GCMD']")
     if len(els) > 0:
         anchor = etree.Element("ANCHOR")
@@ -14,13 +16,7 @@ def convert_gcmd_uuids(dsid, xml_root, element, concept, cursor, table):
         for el in els:
             xml_root.remove(el)
 
-        cursor.execute((
-                "select c.path, t.keyword, '" + table + "' from search." +
-                table + " as t left join search.gcmd_" + concept + " as c on "
-                "c.uuid = t.keyword where t.dsid = %s and t.vocabulary = "
-                "'GCMD'"), (dsid, ))
-        res = cursor.fetchall()
-        for e in res:
+        for e in keywords:
             new_e = etree.Element(element, vocabulary="GCMD", uuid=e[1])
             new_e.text = e[0]
             anchor.addprevious(new_e)
@@ -28,21 +24,16 @@ def convert_gcmd_uuids(dsid, xml_root, element, concept, cursor, table):
         xml_root.remove(anchor)
 
 
-def export(dsid, metadb_settings):
-    try:
-        conn = psycopg2.connect(**metadb_settings)
-        cursor = conn.cursor()
-    except psycopg2.Error as err:
-        raise RuntimeError("metadata database connection error: '{}'"
-                           .format(err))
+def export(dsid, metadb_settings, **kwargs):
+    conn = get_connection(metadb_settings, "metadata")
+    cursor = conn.cursor()
 
     try:
+        snapshot = get_dataset_snapshot(dsid, cursor, **kwargs)
         xml_root = open_dataset_overview(dsid)
-        cursor.execute("select doi from dssdb.dsvrsn where dsid = %s",
-                       (dsid, ))
-        doi, = cursor.fetchone() or (None, )
-        if doi is not None:
-            xml_root.set("DOI", doi)
+        dois = snapshot.dois()
+        if len(dois) > 0 and dois[0] is not None:
+            xml_root.set("DOI", dois[0])
 
         summary = xml_root.find("./summary")
         stext = etree.tostring(summary).decode("utf-8")
@@ -74,18 +65,12 @@ def export(dsid, metadb_settings):
                 author.text = author.get("name")
                 author.attrib.pop("name")
 
-        convert_gcmd_uuids(dsid, xml_root, "contributor", "providers",
-                           cursor, "contributors_new")
-        convert_gcmd_uuids(dsid, xml_root, "variable", "sciencekeywords",
-                           cursor, "variables")
-        convert_gcmd_uuids(dsid, xml_root, "platform", "platforms", cursor,
-                           "platforms_new")
-        convert_gcmd_uuids(dsid, xml_root, "project", "projects", cursor,
-                           "projects_new")
-        convert_gcmd_uuids(dsid, xml_root, "supportsProject", "projects",
-                           cursor, "projects_new")
-        convert_gcmd_uuids(dsid, xml_root, "instrument", "instruments", cursor,
-                           "instruments")
+        convert_gcmd_uuids(xml_root, "contributor", snapshot.contributors)
+        convert_gcmd_uuids(xml_root, "variable", snapshot.gcmd_variables)
+        convert_gcmd_uuids(xml_root, "platform", snapshot.gcmd_platforms)
+        convert_gcmd_uuids(xml_root, "project", snapshot.gcmd_projects)
+        convert_gcmd_uuids(xml_root, "supportsProject", snapshot.gcmd_projects)
+        convert_gcmd_uuids(xml_root, "instrument", snapshot.gcmd_instruments)
         lst = xml_root.findall("./relatedDataset")
         for el in lst:
             id = el.get("ID")
@@ -154,6 +139,6 @@ def export(dsid, metadb_settings):
                     etree.SubElement(cmd, "format").text = fmt
 
     finally:
-        conn.close()
+        put_connection(conn, metadb_settings)
 
     return etree.tostring(xml_root, pretty_print=True).decode("utf-8")
@@ -1,23 +1,478 @@
+import collections
+import copy
+import json
+import os
 import requests
+import threading
+import time
 
 from datetime import timedelta, timezone
 from lxml import etree
 from zoneinfo import ZoneInfo
 
+from .citeutils import CITING_DOIS
 
-def open_dataset_overview(dsid):
+
+# the servers that provide the dataset overviews, in order of preference
+_OVERVIEW_URLS = ("http://localhost:8080/datasets/",
+                  "https://gdex.ucar.edu/datasets/")
+# number of parsed dataset overviews to keep in memory
+_OVERVIEW_CACHE_SIZE = 64
+# the parsed overview of each dataset in memory, with its validators and the
+#   time it was last downloaded or revalidated
+_overview_cache = collections.OrderedDict()
+_overview_cache_lock = threading.Lock()
+# the number of seconds after which an overview in memory is revalidated
+#   with the server
+_overview_max_age = 300
+# the directory that keeps the downloaded overviews and their validators
+#   between runs
+_overview_cache_dir = None
+
+
+def set_overview_cache_dir(path):
+    """
+    Keeps the dataset overviews downloaded by open_dataset_overview in the
+    directory 'path' as well as in memory. A stored overview is revalidated
+    with its ETag or Last-Modified date and only downloaded again if it has
+    changed. The directory is created if it doesn't exist. A 'path' of None
+    stops using the directory.
+    """
+    global _overview_cache_dir
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+
+    with _overview_cache_lock:
+        _overview_cache_dir = path
+
+
+def set_overview_max_age(seconds):
+    """
+    Sets the number of seconds (default 300) that open_dataset_overview uses
+    an overview from memory before it revalidates it with the server, by its
+    ETag or Last-Modified date. A 'seconds' of None never revalidates it.
+    """
+    global _overview_max_age
+    _overview_max_age = seconds
+
+
+def clear_overview_cache():
+    with _overview_cache_lock:
+        _overview_cache.clear()
+
+
+def _read_stored_overview(dsid):
+    # returns the stored overview of a dataset and its validators, or None
+    if _overview_cache_dir is None:
+        return None
+
+    path = os.path.join(_overview_cache_dir, dsid)
     try:
-        resp = requests.get("http://localhost:8080/datasets/" + dsid +
-                            "/native/")
-    except Exception:
-        resp = requests.get("https://gdex.ucar.edu/datasets/" + dsid +
-                            "/native/")
-        if resp.status_code != 200:
+        with open(path + ".json") as f:
+            stored = json.load(f)
+
+        with open(path + ".xml", encoding="utf-8") as f:
+            stored['text'] = f.read()
+    except (OSError, ValueError):
+        return None
+
+    return stored
+
+
+def _write_stored_overview(dsid, stored):
+    # writes to temporary files and renames them so that concurrent runs
+    #   never read a partial overview
+    path = os.path.join(_overview_cache_dir, dsid)
+    tmp = ".{}.tmp".format(os.getpid())
+    with open(path + ".xml" + tmp, "w", encoding="utf-8") as f:
+        f.write(stored['text'])
+
+    with open(path + ".json" + tmp, "w") as f:
+        json.dump({k: v for k, v in stored.items() if k != "text"}, f)
+
+    os.replace(path + ".xml" + tmp, path + ".xml")
+    os.replace(path + ".json" + tmp, path + ".json")
+
+
+def dataset_overview_requests(dsid):
+    """
+    A generator for downloading the overview of the dataset 'dsid' with any
+    HTTP client. It yields the (url, headers) of each request to make,
+    which is conditional when there is an expired copy in memory or a
+    stored copy from the same server, and is sent back the (status code,
+    headers, text) of each response or the exception raised by the request.
+    It returns the overview to pass to cache_dataset_overview(): a
+    dictionary of its 'url', 'etag' and 'last_modified' and either its
+    'text' or, if the copy in memory hasn't changed, its parsed 'root'.
+    """
+    with _overview_cache_lock:
+        stored = _overview_cache.get(dsid)
+
+    if stored is None:
+        stored = _read_stored_overview(dsid)
+    for n, url in enumerate(_OVERVIEW_URLS):
+        url += dsid + "/native/"
+        is_last = n == len(_OVERVIEW_URLS) - 1
+        headers = {}
+        if stored is not None and stored['url'] == url:
+            if stored['etag'] is not None:
+                headers['If-None-Match'] = stored['etag']
+
+            if stored['last_modified'] is not None:
+                headers['If-Modified-Since'] = stored['last_modified']
+
+        resp = yield (url, headers)
+        if isinstance(resp, Exception):
+            if is_last:
+                raise resp
+
+            continue
+
+        status_code, resp_headers, text = resp
+        if status_code == 304 and len(headers) > 0:
+            return {k: v for k, v in stored.items() if k != "time"}
+
+        if status_code != 200 and is_last:
             raise RuntimeError(("unable to download dataset overview: status "
-                                "code: {}".format(resp.status_code)))
+                                "code: {}".format(status_code)))
+
+        break
+
+    overview = {'url': url, 'etag': resp_headers.get("ETag"),
+                'last_modified': resp_headers.get("Last-Modified"),
+                'text': text}
+    if _overview_cache_dir is not None and status_code == 200:
+        _write_stored_overview(dsid, overview)
+
+    return overview
+
+
+def _fetch_dataset_overview(dsid):
+    fetch = dataset_overview_requests(dsid)
+    try:
+        url, headers = next(fetch)
+        while True:
+            try:
+                resp = requests.get(url, headers=headers)
+                resp = (resp.status_code, resp.headers, resp.text)
+            except Exception as err:
+                resp = err
+
+            url, headers = fetch.send(resp)
+    except StopIteration as stop:
+        return stop.value
+
+
+def get_cached_dataset_overview(dsid):
+    """
+    Returns a copy of the root element of the overview of the dataset 'dsid'
+    in memory, or None if there isn't one or it needs to be revalidated.
+    """
+    with _overview_cache_lock:
+        cached = _overview_cache.get(dsid)
+        if cached is None or (_overview_max_age is not None and
+                              time.monotonic() - cached['time'] >
+                              _overview_max_age):
+            return None
+
+        _overview_cache.move_to_end(dsid)
+
+    return copy.deepcopy(cached['root'])
+
+
+def cache_dataset_overview(dsid, overview):
+    """
+    Parses 'overview', as returned by dataset_overview_requests(), if it has
+    changed, caches it in memory and returns a copy of its root element.
+    """
+    if 'root' in overview:
+        root = overview['root']
+    else:
+        parser = etree.XMLParser(remove_blank_text=True)
+        root = etree.fromstring(overview['text'], parser=parser)
+
+    with _overview_cache_lock:
+        _overview_cache[dsid] = {
+                'root': root, 'url': overview['url'],
+                'etag': overview['etag'],
+                'last_modified': overview['last_modified'],
+                'time': time.monotonic()}
+        _overview_cache.move_to_end(dsid)
+        if len(_overview_cache) > _OVERVIEW_CACHE_SIZE:
+            _overview_cache.popitem(last=False)
 
-    parser = etree.XMLParser(remove_blank_text=True)
-    return etree.fromstring(resp.text, parser=parser)
+    return copy.deepcopy(root)
+
+
+def open_dataset_overview(dsid):
+    """
+    Returns the root element of the XML overview of the dataset 'dsid'.
+
+    Overviews are cached in memory and, after set_overview_cache_dir(), on
+    disk. An overview in memory is revalidated with the server once it is
+    older than the maximum age (see set_overview_max_age()). Each call
+    returns a copy of the cached tree, so the caller is free to modify it.
+    """
+    root = get_cached_dataset_overview(dsid)
+    if root is None:
+        root = cache_dataset_overview(dsid, _fetch_dataset_overview(dsid))
+
+    return root
+
+
+# the dssdb.dsperiod rows that count toward the temporal range of a dataset,
+#   and the Common Era and BCE subsets of those rows used by DataCite
+_VALID_PERIOD = "date_start < '9998-01-01' and date_end < '9998-01-01'"
+_CE_PERIOD = ("date_start between '0001-01-01' and '3000-01-01' and date_end "
+              "between '0001-01-01' and '3000-01-01' and time_zone != 'BCE'")
+_BCE_PERIOD = "time_zone = 'BCE'"
+
+# the aggregates of dssdb.dsperiod that give every temporal range in one pass
+_PERIOD_AGGREGATES = [
+    ("min", "concat(date_start, ' ', time_start)", _VALID_PERIOD),
+    ("min", "start_flag", _VALID_PERIOD),
+    ("max", "concat(date_end, ' ', time_end)", _VALID_PERIOD),
+    ("min", "end_flag", _VALID_PERIOD),
+    ("min", "time_zone", _VALID_PERIOD),
+    ("min", "date_start", _VALID_PERIOD),
+    ("max", "date_end", _VALID_PERIOD),
+    ("min", "time_start", _VALID_PERIOD),
+    ("max", "time_end", _VALID_PERIOD),
+    ("min", "concat(date_start, ' ', time_start)", _CE_PERIOD),
+    ("min", "start_flag", _CE_PERIOD),
+    ("max", "concat(date_end, ' ', time_end)", _CE_PERIOD),
+    ("max", "end_flag", _CE_PERIOD),
+    ("min", "time_zone", _CE_PERIOD),
+    ("min", "cast(date_start as text)", _BCE_PERIOD),
+    ("min", "start_flag", _BCE_PERIOD),
+    ("max", "cast(date_end as text)", _BCE_PERIOD),
+    ("min", "end_flag", _BCE_PERIOD),
+]
+
+
+def _gcmd_keywords(attr, table, concept):
+    # the rows of _DATASET_LOOKUPS for the GCMD keywords of a dataset in
+    #   'table'
+    return ("select '" + attr + "', g.path, cast(t.keyword as text), null, "
+            "null from search." + table + " as t left join search.gcmd_" +
+            concept + " as g on g.uuid = t.keyword where t.dsid = %(dsid)s "
+            "and t.vocabulary = 'GCMD'")
+
+
+# the authors, contributors, GCMD keywords, ISO topic and citing works of a
+#   dataset, and the versions of the GCMD keyword lists, in one query, each
+#   row tagged with the DatasetSnapshot attribute that it belongs to
+_DATASET_LOOKUPS = " union all ".join([
+    ("select 'authors', type, given_name, middle_name, family_name from "
+     "search.dataset_authors where dsid = %(dsid)s"),
+    ("select 'contributors', g.path, cast(c.keyword as text), c.contact, g."
+     "last_in_path from search.contributors_new as c left join search."
+     "gcmd_providers as g on g.uuid = c.keyword where c.dsid = %(dsid)s and "
+     "c.vocabulary = 'GCMD'"),
+    _gcmd_keywords("gcmd_variables", "variables", "sciencekeywords"),
+    _gcmd_keywords("gcmd_platforms", "platforms_new", "platforms"),
+    _gcmd_keywords("gcmd_instruments", "instruments", "instruments"),
+    _gcmd_keywords("gcmd_projects", "projects_new", "projects"),
+    _gcmd_keywords("gcmd_supported_projects", "supported_projects",
+                   "projects"),
+    ("select 'iso_topic', keyword, null, null, null from search.topics where "
+     "dsid = %(dsid)s and vocabulary = 'ISO'"),
+    ("select 'citing_dois', doi_work, null, null, null from (" + CITING_DOIS +
+     ") as c"),
+    ("select 'gcmd_versions', concept_scheme, cast(revision_date as text), "
+     "version, null from search.gcmd_versions"),
+])
+
+
+# marks a DatasetSnapshot description page that hasn't been loaded
+_NOT_LOADED = object()
+
+
+class DatasetSnapshot:
+    """
+    The rows of search.datasets, dssdb.dsvrsn, the search keyword and author
+    tables, dssdb.dsperiod and the citations of one dataset, loaded once
+    with 'cursor' so that they can be shared by every metadata exporter.
+    Pass the snapshot to an exporter with the 'snapshot' keyword argument.
+
+    The queries are in DatasetSnapshot.QUERIES, each with the dataset ID as
+    its only parameter, %(dsid)s. To run them some other way (e.g.
+    concurrently with an asynchronous driver), create the snapshot without a
+    cursor and pass the results to load().
+
+    The wagtail dataset description page and the data licenses are in the
+    other database, so they are loaded on first use by page() and
+    license(), or ahead of time with load_page() and load_license().
+
+    Attributes:
+        dsid: the dataset ID
+        dataset: the search.datasets row as a dictionary keyed by column name,
+                 or None if the dataset doesn't exist
+        versions: the dssdb.dsvrsn rows as dictionaries keyed by column name
+        gcmd_variables: (path, uuid) tuples of the GCMD science keywords
+        formats: the distinct data format keywords
+        period: (start, start_flag, end, end_flag, time_zone) of the temporal
+                range, with None values if there isn't one
+        period_dates: (start date, end date) of the temporal range
+        period_times: (start time, end time) of the temporal range
+        ce_period: (start, start_flag, end, end_flag, time_zone) of the
+                   temporal range in the Common Era, or None
+        bce_period: (start date, start_flag, end date, end_flag) of the
+                    temporal range before the Common Era, or None
+        authors: (type, given name, middle name, family name) of each author
+        contributors: (path, uuid, contact, last_in_path) of each GCMD data
+                      center
+        gcmd_platforms, gcmd_instruments, gcmd_projects,
+        gcmd_supported_projects: (path, uuid) tuples of the GCMD keywords
+        iso_topic: the ISO topic category, or None
+        citing_dois: the DOIs of the works that cite the dataset
+        gcmd_versions: the (revision date, version) of each GCMD keyword
+                       list, keyed by concept scheme
+    """
+
+    QUERIES = (
+        "select * from search.datasets where dsid = %(dsid)s",
+        "select * from dssdb.dsvrsn where dsid = %(dsid)s",
+        "select distinct keyword from search.formats where dsid = %(dsid)s",
+        ("select " +
+         ", ".join("{}({}) filter (where {})".format(*e) for e in
+                   _PERIOD_AGGREGATES) +
+         " from dssdb.dsperiod where dsid = %(dsid)s"),
+        _DATASET_LOOKUPS,
+    )
+    # the wagtail queries, with the dataset ID and the license ID
+    PAGE_QUERY = (
+        "select access_restrict, usage_restrict, data_license, update_freq, "
+        "related_rsrc_list, dslogo from wagtail2."
+        "dataset_description_datasetdescriptionpage where dsid = %s")
+    LICENSE_QUERY = (
+        "select url, name from wagtail2.home_datalicense where id = %s")
+
+    def __init__(self, dsid, cursor=None):
+        self.dsid = dsid
+        self._page = _NOT_LOADED
+        self._licenses = {}
+        if cursor is not None:
+            results = []
+            for query in self.QUERIES:
+                cursor.execute(query, {'dsid': dsid})
+                cols = [e[0] for e in cursor.description]
+                results.append((cols, cursor.fetchall()))
+
+            self.load(results)
+
+    def load(self, results):
+        """
+        Fills the snapshot from 'results', a (column names, rows) tuple for
+        each of DatasetSnapshot.QUERIES, in order.
+        """
+        cols, rows = results[0]
+        self.dataset = dict(zip(cols, rows[0])) if len(rows) > 0 else None
+        cols, rows = results[1]
+        self.versions = [dict(zip(cols, e)) for e in rows]
+        self.formats = [e[0] for e in results[2][1]]
+        res = tuple(results[3][1][0])
+        self.period = res[0:5]
+        self.period_dates = res[5:7]
+        self.period_times = res[7:9]
+        self.ce_period = (res[9:14] if res[9] is not None and res[11] is not
+                          None else None)
+        self.bce_period = (res[14:18] if res[14] is not None and res[16] is
+                           not None else None)
+        lookups = {'authors': [], 'contributors': [], 'gcmd_variables': [],
+                   'gcmd_platforms': [], 'gcmd_instruments': [],
+                   'gcmd_projects': [], 'gcmd_supported_projects': [],
+                   'iso_topic': [], 'citing_dois': [], 'gcmd_versions': []}
+        for e in results[4][1]:
+            lookups[e[0]].append(tuple(e[1:]))
+
+        self.authors = lookups['authors']
+        self.contributors = lookups['contributors']
+        for attr in ("gcmd_variables", "gcmd_platforms", "gcmd_instruments",
+                     "gcmd_projects", "gcmd_supported_projects"):
+            setattr(self, attr, [e[0:2] for e in lookups[attr]])
+
+        self.iso_topic = (lookups['iso_topic'][0][0] if
+                          len(lookups['iso_topic']) > 0 else None)
+        self.citing_dois = [e[0] for e in lookups['citing_dois']]
+        self.gcmd_versions = {e[0]: e[1:3] for e in lookups['gcmd_versions']}
+
+    def load_page(self, results):
+        """
+        Fills the description page from 'results', the (column names, rows)
+        of DatasetSnapshot.PAGE_QUERY.
+        """
+        cols, rows = results
+        self._page = dict(zip(cols, rows[0])) if len(rows) > 0 else None
+
+    def page(self, cursor):
+        """
+        Returns the wagtail dataset description page as a dictionary of the
+        columns in DatasetSnapshot.PAGE_QUERY, or None if there isn't one.
+        It is loaded with the wagtail 'cursor' the first time.
+        """
+        if self._page is _NOT_LOADED:
+            cursor.execute(self.PAGE_QUERY, (self.dsid, ))
+            self.load_page(([e[0] for e in cursor.description],
+                            cursor.fetchall()))
+
+        return self._page
+
+    def load_license(self, license_id, row):
+        """
+        Keeps 'row', the result of DatasetSnapshot.LICENSE_QUERY for
+        'license_id' (None if there is no such license).
+        """
+        self._licenses[license_id] = None if row is None else tuple(row)
+
+    def license(self, license_id, cursor):
+        """
+        Returns the (url, name) of the data license 'license_id', or None if
+        there is no such license. It is loaded with the wagtail 'cursor' the
+        first time.
+        """
+        if license_id not in self._licenses:
+            cursor.execute(self.LICENSE_QUERY, (license_id, ))
+            self.load_license(license_id, cursor.fetchone())
+
+        return self._licenses[license_id]
+
+    def gcmd_project_paths(self):
+        """
+        Returns the distinct paths of the GCMD projects and supported
+        projects.
+        """
+        return list(dict.fromkeys(
+                e[0] for e in self.gcmd_projects +
+                self.gcmd_supported_projects))
+
+    def dois(self, **kwargs):
+        """
+        Returns the DOIs of the dataset.
+
+        Optional keyword arguments:
+            status: only the DOIs with this status (e.g. "A" for active)
+            current: if True, only the DOIs without an end date
+        """
+        return [v['doi'] for v in self.versions if
+                ('status' not in kwargs or v['status'] == kwargs['status'])
+                and ('current' not in kwargs or not kwargs['current'] or
+                     v['end_date'] is None)]
+
+
+def get_dataset_snapshot(dsid, cursor, **kwargs):
+    """
+    Returns the DatasetSnapshot passed to an exporter in the 'snapshot'
+    keyword argument, or loads one for 'dsid' with 'cursor'.
+    """
+    if 'snapshot' in kwargs and kwargs['snapshot'] is not None:
+        if kwargs['snapshot'].dsid != dsid:
+            raise RuntimeError(("dataset snapshot is for '{}', not '{}'")
+                               .format(kwargs['snapshot'].dsid, dsid))
+
+        return kwargs['snapshot']
+
+    return DatasetSnapshot(dsid, cursor)
 
 
 def get_date_from_precision(dt, precision, tz, **kwargs):
@@ -85,12 +540,17 @@ def get_pages(pages):
     return {}
 
 
-def metadata_date(dsid, cursor):
+def metadata_date(dsid, cursor, **kwargs):
     try:
-        cursor.execute(
-                "select timestamp_utc from search.datasets where dsid = %s",
-                (dsid, ))
-        tstamp_utc = cursor.fetchone()[0].replace(tzinfo=timezone.utc)
+        if 'snapshot' in kwargs:
+            tstamp = kwargs['snapshot'].dataset['timestamp_utc']
+        else:
+            cursor.execute(
+                    "select timestamp_utc from search.datasets where dsid = "
+                    "%s", (dsid, ))
+            tstamp, = cursor.fetchone()
+
+        tstamp_utc = tstamp.replace(tzinfo=timezone.utc)
     except Exception:
         pass
 
@@ -111,7 +571,7 @@ def metadata_date(dsid, cursor):
             return tstamp_utc
 
     elif 'wfile_date' in locals():
-        return 'wfile_date'
+        return wfile_date
 
     return None
 
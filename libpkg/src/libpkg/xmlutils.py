@@ -1,4 +1,10 @@
+import os
 import re
+import requests
+import threading
+
+from lxml import etree
+from urllib.parse import urljoin
 
 from . import strutils
 
@@ -224,3 +230,150 @@ def convert_plain_ampersands(text):
         idx = text.find("&Amp;")
 
     return text
+
+
+_XML_CATALOG_NS = "urn:oasis:names:tc:entity:xmlns:xml:catalog"
+
+# the entries of the XML catalog(s): exact system IDs/URIs mapped to local
+#   locations, and (prefix, rewrite prefix) pairs
+_xml_catalog = {'files': [], 'exact': {}, 'rewrite': []}
+# the compiled XML schemas of this process, keyed by location; each location
+#   has its own lock so that a slow compile only blocks the callers waiting
+#   for the same schema, and the generation counts the catalog changes so
+#   that a compile with an old catalog isn't kept
+_xml_schemas = {}
+_xml_schema_locks = {}
+_xml_schemas_generation = 0
+_xml_schemas_lock = threading.Lock()
+
+
+def _read_xml_catalog(path, catalog):
+    # adds the entries of the OASIS XML catalog 'path', and of the catalogs
+    #   that it chains to, to 'catalog'
+    root = etree.parse(path).getroot()
+    for e in root.iter("{" + _XML_CATALOG_NS + "}*"):
+        kind = etree.QName(e).localname
+        if kind in ("rewriteSystem", "rewriteURI"):
+            prefix = urljoin(e.base, e.get("rewritePrefix"))
+
+        if kind == "system":
+            catalog['exact'][e.get("systemId")] = urljoin(e.base, e.get("uri"))
+        elif kind == "uri":
+            catalog['exact'][e.get("name")] = urljoin(e.base, e.get("uri"))
+        elif kind == "rewriteSystem":
+            catalog['rewrite'].append((e.get("systemIdStartString"), prefix))
+        elif kind == "rewriteURI":
+            catalog['rewrite'].append((e.get("uriStartString"), prefix))
+        elif kind == "nextCatalog":
+            _read_xml_catalog(urljoin(e.base, e.get("catalog")), catalog)
+
+
+def set_xml_catalog(*paths):
+    """
+    Sets the OASIS XML catalog file(s) that map schema URLs to local copies.
+    The default is the catalogs in the XML_CATALOG_FILES environment
+    variable. Schemas that were compiled with the old catalog are dropped.
+    """
+    global _xml_schemas_generation
+    catalog = {'files': list(paths), 'exact': {}, 'rewrite': []}
+    for path in paths:
+        _read_xml_catalog(path, catalog)
+
+    # the longest matching prefix wins
+    catalog['rewrite'].sort(key=lambda e: len(e[0]), reverse=True)
+    with _xml_schemas_lock:
+        _xml_catalog.update(catalog)
+        _xml_schemas.clear()
+        _xml_schemas_generation += 1
+
+
+def get_xml_catalog():
+    return list(_xml_catalog['files'])
+
+
+def resolve_xml_catalog(location):
+    """
+    Returns the local location that the XML catalog maps 'location' to, or
+    'location' if the catalog doesn't have it.
+    """
+    if location in _xml_catalog['exact']:
+        return _xml_catalog['exact'][location]
+
+    for prefix, rewrite in _xml_catalog['rewrite']:
+        if location.startswith(prefix):
+            return rewrite + location[len(prefix):]
+
+    return location
+
+
+class _XMLCatalogResolver(etree.Resolver):
+    # resolves the location of a schema and its xs:import and xs:include
+    #   locations through the XML catalog, and downloads the ones that are
+    #   only on the web
+    def resolve(self, url, pubid, context):
+        local = resolve_xml_catalog(url)
+        if local.startswith("http://") or local.startswith("https://"):
+            resp = requests.get(local)
+            if resp.status_code != 200:
+                raise RuntimeError(("unable to download '{}': status code: "
+                                    "{}").format(local, resp.status_code))
+
+            return self.resolve_string(resp.content, context, base_url=local)
+
+        if local != url:
+            return self.resolve_filename(local, context)
+
+        return None
+
+
+def get_xml_schema(location):
+    """
+    Returns the compiled etree.XMLSchema for the XSD at 'location' (a file
+    path or URL). Each schema is compiled only once per process. The XSD and
+    the schemas that it imports are read from their local copies when the XML
+    catalog has them (see set_xml_catalog).
+    """
+    with _xml_schemas_lock:
+        if location in _xml_schemas:
+            return _xml_schemas[location]
+
+        lock = _xml_schema_locks.setdefault(location, threading.Lock())
+
+    with lock:
+        with _xml_schemas_lock:
+            if location in _xml_schemas:
+                return _xml_schemas[location]
+
+            generation = _xml_schemas_generation
+
+        # compiling can download the imported schemas that the catalog
+        #   doesn't have, so it is done without holding _xml_schemas_lock
+        parser = etree.XMLParser()
+        parser.resolvers.add(_XMLCatalogResolver())
+        schema = etree.XMLSchema(etree.parse(resolve_xml_catalog(location),
+                                             parser))
+        with _xml_schemas_lock:
+            if generation == _xml_schemas_generation:
+                _xml_schemas[location] = schema
+
+    return schema
+
+
+def load_xml_schemas(locations, catalog=None):
+    """
+    Compiles the XSDs at 'locations' ahead of time, using the XML catalog
+    file(s) in the list 'catalog' if it is given. Pass it as the
+    initializer of a worker process pool so that the workers validate with
+    pre-compiled schemas.
+    """
+    if catalog is not None:
+        set_xml_catalog(*catalog)
+
+    for location in locations:
+        get_xml_schema(location)
+
+
+if 'XML_CATALOG_FILES' in os.environ:
+    set_xml_catalog(*[path[7:] if path.startswith("file://") else path
+                      for path in os.environ['XML_CATALOG_FILES'].split()
+                      if os.path.exists(path.replace("file://", "", 1))])
@@ -0,0 +1,109 @@
+import random
+
+import pytest
+
+from libpkg.dbutils import (CompressedBitmap, compress_bitmap_values,
+                            iter_bitmap_values, uncompress_bitmap_values)
+
+
+# hand-written bitmaps and their values; every bit of a '{...}' group is
+#   decoded, up to and including the one before the '}'
+DECODED_BITMAPS = [
+    ("3:0-4/{AB1A}1", list(range(4, 37))),
+    ("10:1-3/A-2/b1", [10, 11, 12, 13, 14, 15, 16, 23]),
+    ("5:1-2/{1a1}-1/C", [5, 6, 9, 10, 13, 14, 15, 16, 17]),
+    ("2:-3/{a1}", [4, 7, 10]),
+    ("0:1-0/A-0/{AB}1", [0, 1]),
+    ("!4,9,12", [4, 9, 12]),
+    ("7:", []),
+]
+
+
+def _sparse(rnd, n):
+    return [rnd.randrange(0, 10**9) for _ in range(n)]
+
+
+def _dense(rnd, n):
+    vals = []
+    val = rnd.randrange(0, 1000)
+    while len(vals) < n:
+        val += 1 if rnd.random() < 0.9 else rnd.randrange(2, 60)
+        vals.append(val)
+
+    return vals
+
+
+def _periodic(rnd, n):
+    steps = [rnd.randrange(1, 30) for _ in range(rnd.randrange(1, 6))]
+    vals = []
+    val = rnd.randrange(0, 1000)
+    while len(vals) < n:
+        val += steps[len(vals) % len(steps)]
+        vals.append(val)
+
+    return vals
+
+
+def _negative(rnd, n):
+    return [rnd.randrange(-5000, 5000) for _ in range(n)]
+
+
+def _mixed(rnd, n):
+    vals = []
+    val = rnd.randrange(0, 1000)
+    while len(vals) < n:
+        val += rnd.choice([1, 1, 2, 3, 27, 28, 30, 1000, 100000])
+        vals.append(val)
+
+    return vals
+
+
+@pytest.mark.parametrize("bitmap, values", DECODED_BITMAPS)
+def test_decode(bitmap, values):
+    assert list(uncompress_bitmap_values(bitmap)) == values
+    assert list(iter_bitmap_values(bitmap)) == values
+
+
+@pytest.mark.parametrize("bitmap, values", DECODED_BITMAPS)
+def test_decode_compressed_bitmap(bitmap, values):
+    assert list(CompressedBitmap(bitmap)) == sorted(set(values))
+
+
+@pytest.mark.parametrize("make_values", [_sparse, _dense, _periodic,
+                                         _negative, _mixed])
+def test_round_trip(make_values):
+    rnd = random.Random(make_values.__name__)
+    for n in [0, 1, 2, 5, 50, 500, 3000] * 4:
+        vals = make_values(rnd, n)
+        expected = sorted(set(vals))
+        bitmap = compress_bitmap_values(vals)
+        assert list(uncompress_bitmap_values(bitmap)) == expected, bitmap
+        assert list(CompressedBitmap(bitmap)) == expected, bitmap
+        assert compress_bitmap_values(CompressedBitmap(bitmap)) == bitmap
+
+
+def test_round_trip_long_runs():
+    # runs and gaps longer than a single bit character can hold
+    vals = (list(range(3, 3 + 1000)) + list(range(5000, 5027)) +
+            list(range(5055, 5083)) + [10**9])
+    bitmap = compress_bitmap_values(vals)
+    assert list(uncompress_bitmap_values(bitmap)) == vals
+    assert list(CompressedBitmap(bitmap)) == vals
+
+
+def test_round_trip_repeated_groups():
+    # a pattern that repeats is written as a '{...}' group
+    vals = [val for start in range(0, 30000, 10)
+            for val in (start, start + 1, start + 4)]
+    bitmap = compress_bitmap_values(vals)
+    assert bitmap.find("{") >= 0
+    assert list(uncompress_bitmap_values(bitmap)) == vals
+    assert list(CompressedBitmap(bitmap)) == vals
+    assert compress_bitmap_values(CompressedBitmap(bitmap)) == bitmap
+
+
+def test_round_trip_decoded_bitmaps():
+    for bitmap, values in DECODED_BITMAPS:
+        expected = sorted(set(values))
+        bitmap = compress_bitmap_values(values)
+        assert list(uncompress_bitmap_values(bitmap)) == expected
@@ -0,0 +1,70 @@
+import pytest
+
+from libpkg.gridutils import fill_spatial_domain_from_polar_stereographic_grid
+
+
+NO_DOMAIN = {'slat': 99., 'nlat': -99., 'wlon': 999., 'elon': -999.}
+
+# polar stereographic grid definitions and the domains that the original
+#   (unvectorized) code found for them; NO_DOMAIN is the result when the
+#   search for the pole finds no grid that contains the first gridpoint
+POLAR_GRIDS = [
+    ("NCEP 5", "53:57:7.647N:133.443W:60N:105W:N:190.5:190.5",
+     (7.646943675042316, 90., -180., 180.)),
+    ("NCEP 6", "53:45:7.647N:133.443W:60N:105W:N:190.5:190.5",
+     (7.646943675042316, 90., -180., 180.)),
+    ("NCEP 27", "65:65:20.826S:125W:60N:80W:N:381:381",
+     (-20.825677278046474, 90., -180., 180.)),
+    ("NCEP 28", "65:65:20.826N:145E:60S:100E:S:381:381",
+     (-90., 20.825677278046474, -180., 180.)),
+    ("NCEP 55", "87:71:10N:137W:60N:105W:N:254:254", None),
+    ("NCEP 56", "87:71:25N:125W:60N:105W:N:127:127", None),
+    ("NCEP 87", "81:62:22.876N:120.491W:60N:105W:N:68.153:68.153",
+     (22.658251881796215, 90., -180., 180.)),
+    ("NCEP 100", "83:83:17.108N:129.296W:60N:105W:N:91.452:91.452", None),
+    ("NCEP 101", "113:91:10.528N:137.146W:60N:105W:N:91.452:91.452",
+     (10.888009034854758, 90., -180., 180.)),
+    ("NCEP 104", "147:110:0.268S:139.475W:60N:105W:N:90.755:90.755",
+     (0.034673462058391946, 90., -180., 180.)),
+    ("NCEP 105", "83:83:17.529N:129.296W:60N:105W:N:90.755:90.755", None),
+    ("NCEP 107", "120:92:23.438N:120.5W:60N:105W:N:45.373:45.373",
+     (23.357868797771292, 90., -180., 180.)),
+    ("NCEP 201", "65:65:20.826S:150W:60N:105W:N:381:381",
+     (-20.825677278046474, 90., -180., 180.)),
+    ("NCEP 202", "65:43:7.838N:141.028W:60N:105W:N:190.5:190.5",
+     (7.838100675479861, 90., -180., 180.)),
+    ("NCEP 203", "45:39:19.132N:185.837E:60N:150W:N:190.5:190.5", None),
+    ("NCEP 205", "45:39:0.616N:84.904W:60N:60W:N:190.5:190.5",
+     (0.6157460776106561, 90., -180., 180.)),
+    ("NCEP 207", "49:35:42.085N:175.641W:60N:150W:N:95.25:95.25",
+     (42.084630060957366, 90., -180., 180.)),
+    ("NCEP 213", "129:85:7.838N:141.028W:60N:105W:N:95.25:95.25",
+     (7.838100675479861, 90., -180., 180.)),
+    ("NCEP 214", "97:69:42.085N:175.641W:60N:150W:N:47.625:47.625",
+     (42.084630060957366, 90., -180., 180.)),
+    ("NCEP 216", "139:107:30N:173W:60N:135W:N:45:45",
+     (30.49041114599867, 90., -180., 180.)),
+    ("NCEP 217", "277:213:30N:173W:60N:135W:N:22.5:22.5",
+     (30.49041114599867, 90., -180., 180.)),
+    ("NCEP 224", "65:65:20.826N:120E:60S:105W:S:381:381", None),
+    ("NCEP 242", "553:425:30N:173W:60N:135W:N:11.25:11.25",
+     (30.49041114599867, 90., -180., 180.)),
+    ("NCEP 249", "367:343:45.4N:171.6W:60N:150W:N:9.868:9.868",
+     (45.791984418064224, 90., -180., 180.)),
+    ("NSIDC north", "304:448:33.92N:279.26E:70N:45W:N:25:25",
+     (34.10534184431972, 90., -180., 180.)),
+    ("NSIDC south", "316:332:41.45S:225E:70S:0E:S:25:25", None),
+]
+
+
+@pytest.mark.parametrize("gdef, domain", [e[1:] for e in POLAR_GRIDS],
+                         ids=[e[0] for e in POLAR_GRIDS])
+def test_polar_stereographic_domain(gdef, domain):
+    if domain is None:
+        expected = NO_DOMAIN
+    else:
+        expected = dict(zip(('slat', 'nlat', 'wlon', 'elon'), domain))
+
+    result = fill_spatial_domain_from_polar_stereographic_grid(
+            gdef.split(":"))
+    assert result == pytest.approx(expected, abs=1.e-9)